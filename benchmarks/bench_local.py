@@ -0,0 +1,229 @@
+"""benchmarks of the local read path of calibrolino on synthetic libraries
+
+the times are compared with the baselines stored in baselines.json. a
+benchmark slower than its baseline by more than the tolerance is reported
+as a regression (exit code 1).
+
+usage:
+    python benchmarks/bench_local.py --books 1000 10000
+    python benchmarks/bench_local.py --books 10000 --update-baselines
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+class SilentView(object):
+
+    """view for the controller that shows nothing and answers no"""
+
+    def showinfo(self, msg):
+        pass
+
+    def showerror(self, msg):
+        print('error:', msg, file=sys.stderr)
+
+    def askokcancel(self, msg):
+        return False
+
+    def askyesno(self, msg):
+        return False
+
+
+def prepare_environment(workdir):
+    """point the xdg folders to the workdir, so that the real calibre
+    config, snapshot and credentials of the user are not used"""
+    for name in ('CONFIG', 'CACHE', 'DATA'):
+        folder = os.path.join(workdir, name.lower())
+        os.makedirs(folder, exist_ok=True)
+        os.environ[f'XDG_{name}_HOME'] = folder
+
+
+def measure(function, repeat):
+    """
+    :returns: best time (s) of repeat calls of function
+
+    """
+    times = list()
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(n_books, workdir, repeat, n_tag_books):
+    """create a library of n_books and time the read path on it
+
+    :returns: dict (name of benchmark: time in s)
+
+    """
+    from calibrolino.synthetic import create_library, write_calibre_config
+    from calibrolino.models import CalibreDBReader, TAG_ADD, TAG_REMOVE
+    from calibrolino.controllers import CalibrolinoController
+    from calibrolino.controllers import diff_library_frames
+    from calibrolino.controllers import apply_library_diff
+
+    library_folder = os.path.join(workdir, f'library_{n_books}')
+    create_library(library_folder, n_books, write_files=False)
+    write_calibre_config(os.environ['XDG_CONFIG_HOME'], library_folder)
+
+    results = dict()
+    calibre_db = CalibreDBReader(use_snapshot=False)
+    results['read_db'] = measure(calibre_db.read_db, repeat)
+    results['_create_books_dict'] = measure(
+            calibre_db._create_books_dict, repeat)
+    CalibreDBReader()
+    results['snapshot_load'] = measure(CalibreDBReader, repeat)
+
+    books = list(calibre_db.books.values())[:n_tag_books]
+
+    def add_tags():
+        for book in books:
+            calibre_db.add_tag(book, 'benchmark')
+        calibre_db.commit()
+
+    def rm_tags():
+        for book in books:
+            calibre_db.rm_tag(book, 'benchmark')
+        calibre_db.commit()
+
+    results['add_tag'] = measure(add_tags, 1)
+    results['rm_tag'] = measure(rm_tags, 1)
+    changes = [(book['book_id'], TAG_ADD, 'benchmark') for book in books]
+    results['apply_tag_changes'] = measure(
+            lambda: calibre_db.apply_tag_changes(changes), 1)
+    calibre_db.apply_tag_changes(
+            (book_id, TAG_REMOVE, tag) for book_id, action, tag in changes)
+
+    controller = CalibrolinoController(SilentView())
+    results['get_full_library'] = measure(
+            lambda: controller.get_full_library(include_online=False),
+            repeat)
+
+    old_library = controller.get_full_library(include_online=False)
+    displayed = old_library.sort_values('last_modified')
+    calibre_db.apply_tag_changes(changes)
+    library = controller.get_full_library(include_online=False)
+
+    def update_display():
+        diff = diff_library_frames(old_library, library)
+        apply_library_diff(displayed, library, diff)
+
+    results['library_diff'] = measure(update_display, repeat)
+    return results
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_PATH) as myfile:
+            return json.load(myfile)
+    except FileNotFoundError:
+        return dict()
+
+
+def save_baselines(baselines):
+    with open(BASELINES_PATH, 'w') as myfile:
+        json.dump(baselines, myfile, indent=4, sort_keys=True)
+        myfile.write('\n')
+
+
+def compare(results, baselines, tolerance, min_delta):
+    """print the results and their ratio to the baselines. a benchmark
+    regressed if it is slower than its baseline by more than tolerance
+    (relative) and min_delta (s)
+
+    :returns: list of the names of the benchmarks that regressed
+
+    """
+    regressions = list()
+    for name, duration in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f'  {name:<20} {duration:9.4f}s')
+            continue
+        ratio = duration / baseline
+        flag = ''
+        if ratio > 1 + tolerance and duration - baseline > min_delta:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'  {name:<20} {duration:9.4f}s  '
+              f'baseline {baseline:9.4f}s  x{ratio:.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+            '--books',
+            type=int,
+            nargs='+',
+            default=[1000, 10000],
+            help='sizes of the synthetic libraries',
+            )
+    parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='number of runs of each read benchmark (best is kept)',
+            )
+    parser.add_argument(
+            '--tag-books',
+            type=int,
+            default=1000,
+            help='number of books tagged in the tag benchmarks',
+            )
+    parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.3,
+            help='accepted slowdown compared to the baselines',
+            )
+    parser.add_argument(
+            '--min-delta',
+            type=float,
+            default=0.02,
+            help='slowdown (s) below which a benchmark never regresses',
+            )
+    parser.add_argument(
+            '--update-baselines',
+            action='store_true',
+            help='store the results as the new baselines',
+            )
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    regressions = list()
+    with tempfile.TemporaryDirectory(prefix='calibrolino_bench_') as workdir:
+        prepare_environment(workdir)
+        for n_books in args.books:
+            print(f'{n_books} books:')
+            results = run_benchmarks(
+                    n_books, workdir, args.repeat, args.tag_books)
+            key = str(n_books)
+            regressions += [
+                    f'{key}/{name}' for name in
+                    compare(results, baselines.get(key, dict()),
+                            args.tolerance, args.min_delta)]
+            if args.update_baselines:
+                baselines[key] = {
+                        name: round(duration, 4)
+                        for name, duration in results.items()}
+    if args.update_baselines:
+        save_baselines(baselines)
+        print(f'baselines saved in {BASELINES_PATH}')
+    elif regressions:
+        print('regressions:', ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""memory footprint of the books of a synthetic library
+
+the books are read with CalibreDBReader and two sizes are reported: the
+deep size of the index of the books (BookRecord, interned names and
+lookups), and the python memory retained by the reader, measured with
+tracemalloc. they are compared with the baselines of baselines.json (keys
+memory_<books>) with the tolerance of bench_local.
+
+usage:
+    python benchmarks/bench_memory.py --books 10000 100000
+    python benchmarks/bench_memory.py --books 100000 --update-baselines
+"""
+
+
+import gc
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+
+
+from bench_local import prepare_environment, load_baselines, save_baselines
+
+
+def measure_memory(n_books, workdir):
+    """create a library of n_books and read it
+
+    :returns: dict (name: bytes) of index, retained and peak
+
+    """
+    from calibrolino.synthetic import create_library, write_calibre_config
+    from calibrolino.models import CalibreDBReader
+    from calibrolino.library import get_deep_size
+
+    library_folder = os.path.join(workdir, f'library_{n_books}')
+    create_library(library_folder, n_books, write_files=False)
+    write_calibre_config(os.environ['XDG_CONFIG_HOME'], library_folder)
+
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    calibre_db = CalibreDBReader(use_snapshot=False)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(
+            index=get_deep_size(calibre_db.index),
+            retained=current - start,
+            peak=peak - start,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+            '--books',
+            type=int,
+            nargs='+',
+            default=[10000],
+            help='sizes of the synthetic libraries',
+            )
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--update-baselines', action='store_true')
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    regressions = list()
+    with tempfile.TemporaryDirectory(prefix='calibrolino_bench_') as workdir:
+        prepare_environment(workdir)
+        for n_books in args.books:
+            print(f'{n_books} books:')
+            results = measure_memory(n_books, workdir)
+            key = f'memory_{n_books}'
+            baseline = baselines.get(key, dict())
+            for name, size in results.items():
+                line = (f'  {name:<10} {size / 2 ** 20:9.2f}MiB '
+                        f'{size / n_books:8.0f}B/book')
+                if name in baseline:
+                    ratio = size / baseline[name]
+                    line += (f'  baseline {baseline[name] / 2 ** 20:9.2f}MiB'
+                             f'  x{ratio:.2f}')
+                    if ratio > 1 + args.tolerance:
+                        line += '  REGRESSION'
+                        regressions.append(f'{key}/{name}')
+                print(line)
+            if args.update_baselines:
+                baselines[key] = results
+    if args.update_baselines:
+        save_baselines(baselines)
+        print('baselines saved')
+    elif regressions:
+        print('regressions:', ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
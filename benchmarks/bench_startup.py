@@ -0,0 +1,126 @@
+"""startup time of calibrolino -t on a synthetic library
+
+calibrolino -t is started several times and quits at its first menu. the
+median wall time is compared with the budget: the --budget option, or the
+baseline of baselines.json (with the tolerance of bench_local). the startup
+also fails if it imports a GUI or pandas module, which text mode never
+needs.
+
+usage:
+    python benchmarks/bench_startup.py --books 10000
+    python benchmarks/bench_startup.py --budget 1.5
+"""
+
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+from bench_local import prepare_environment, load_baselines, save_baselines
+from bench_local import compare, BASELINES_PATH
+
+
+FORBIDDEN_MODULES = ('tkinter', 'pandastable', 'pandas', 'matplotlib')
+
+_CHILD_CODE = """
+import sys
+import atexit
+
+
+def print_modules():
+    print('MODULES', *(m for m in %r if m in sys.modules))
+
+
+atexit.register(print_modules)
+from calibrolino.launcher import start_calibrolino
+start_calibrolino()
+""" % (FORBIDDEN_MODULES,)
+
+
+def start_textmode(report_path):
+    """run calibrolino -t until its first menu
+
+    :returns: wall time (s) and the forbidden modules that were imported
+
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+            [sys.executable, '-c', _CHILD_CODE, '-t',
+             '--profile-report', report_path],
+            input='q\n',
+            capture_output=True,
+            text=True,
+            )
+    duration = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    lines = [
+            line for line in result.stdout.splitlines()
+            if line.startswith('MODULES')]
+    modules = lines[-1].split()[1:] if lines else list()
+    return duration, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='number of measured starts (after one warm-up start)')
+    parser.add_argument(
+            '--budget', type=float, default=None,
+            help='maximum startup time (s). default: baseline + tolerance')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--min-delta', type=float, default=0.05)
+    parser.add_argument('--update-baselines', action='store_true')
+    args = parser.parse_args()
+
+    from calibrolino.synthetic import create_library, write_calibre_config
+
+    with tempfile.TemporaryDirectory(prefix='calibrolino_bench_') as workdir:
+        prepare_environment(workdir)
+        library_folder = os.path.join(workdir, 'library')
+        create_library(library_folder, args.books, write_files=False)
+        write_calibre_config(os.environ['XDG_CONFIG_HOME'], library_folder)
+        report_path = os.path.join(workdir, 'profile.txt')
+        start_textmode(report_path)
+        durations = list()
+        for i in range(args.repeat):
+            duration, modules = start_textmode(report_path)
+            durations.append(duration)
+        with open(report_path) as myfile:
+            report = myfile.read()
+
+    startup = statistics.median(durations)
+    print(f'calibrolino -t with {args.books} books (phases of the last run):')
+    print(report)
+    failed = False
+    if modules:
+        print('text mode imported:', ', '.join(modules))
+        failed = True
+    key = f'startup_{args.books}'
+    results = dict(textmode=startup)
+    if args.update_baselines:
+        baselines = load_baselines()
+        baselines[key] = dict(textmode=round(startup, 4))
+        save_baselines(baselines)
+        print(f'  textmode {startup:9.4f}s')
+        print(f'baselines saved in {BASELINES_PATH}')
+    elif args.budget is not None:
+        print(f'  textmode {startup:9.4f}s  budget {args.budget:9.4f}s')
+        failed = failed or startup > args.budget
+    else:
+        baselines = load_baselines().get(key, dict())
+        failed = bool(compare(
+            results, baselines, args.tolerance, args.min_delta)) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""end-to-end benchmark of the sync against the local stand-in of the cloud
+
+a synthetic library is uploaded with CalibrolinoController.sync_upload to
+a StandinServer (with --async, the books are uploaded with
+AsyncTolinoCloud.upload_books and --jobs gives max_concurrency). the script
+reports books/s, requests per book, errors and the latency percentiles of
+the requests (server side) and of the upload steps (client side).
+
+usage:
+    python benchmarks/bench_sync.py --books 200 --jobs 1 4 8 --latency 0.05
+    python benchmarks/bench_sync.py --async --books 100 --jobs 32
+"""
+
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+
+from bench_local import SilentView, prepare_environment
+
+
+class ConfirmingView(SilentView):
+
+    """view that accepts the sync"""
+
+    def askokcancel(self, msg):
+        return True
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """
+    :returns: dict (point: value), nearest rank method
+
+    """
+    values = sorted(values)
+    if not values:
+        return {point: float('nan') for point in points}
+    return {
+            point: values[min(len(values) - 1, len(values) * point // 100)]
+            for point in points}
+
+
+def run_sync(library_folder, n_books, jobs, config, rate):
+    """upload the library to a new stand-in server
+
+    :returns: dict of the results
+
+    """
+    from calibrolino.controllers import CalibrolinoController
+    from calibrolino.standin import StandinServer
+    from calibrolino.retry import RateLimiter
+    from calibrolino.progress import STEP_FINISHED
+
+    step_durations = dict()
+
+    def record_step(event):
+        if event.kind == STEP_FINISHED:
+            step_durations.setdefault(event.step, list()).append(
+                    event.duration)
+
+    with StandinServer(config) as server:
+        controller = CalibrolinoController(ConfirmingView())
+        controller._tolino_cloud = server.create_tolino_cloud(
+                rate_limiter=RateLimiter(rate=rate, burst=jobs))
+        username = f'bench_{jobs}_{time.time()}'
+        controller._ledger = controller._get_ledger(
+                dict(partner='standin', username=username))
+        controller.subscribe_progress(record_step)
+        start = time.perf_counter()
+        controller.sync_upload(max_workers=jobs)
+        duration = time.perf_counter() - start
+        stats = server.state.stats
+        n_uploaded = len(server.state.books)
+        login_count = controller._tolino_cloud.login_stats['count']
+
+    return get_results(
+            duration, stats, n_uploaded, login_count, step_durations)
+
+
+def run_async_upload(library_folder, n_books, jobs, config, rate):
+    """upload the library to a new stand-in server with AsyncTolinoCloud
+
+    :returns: dict of the results
+
+    """
+    from calibrolino.models import CalibreDBReader, AsyncTolinoCloud
+    from calibrolino.standin import StandinServer
+    from calibrolino.retry import RateLimiter
+    from calibrolino.progress import ProgressTracker, STEP_FINISHED
+
+    step_durations = dict()
+
+    def record_step(event):
+        if event.kind == STEP_FINISHED:
+            step_durations.setdefault(event.step, list()).append(
+                    event.duration)
+
+    books = list(CalibreDBReader(use_snapshot=False).books.values())
+    progress = ProgressTracker()
+    progress.subscribe(record_step)
+    with StandinServer(config) as server:
+        tolino_cloud = server.create_tolino_cloud(
+                rate_limiter=RateLimiter(rate=rate, burst=jobs))
+        async_cloud = AsyncTolinoCloud(tolino_cloud, max_concurrency=jobs)
+        try:
+            start = time.perf_counter()
+            asyncio.run(async_cloud.upload_books(books, progress=progress))
+            duration = time.perf_counter() - start
+        finally:
+            async_cloud.close()
+        stats = server.state.stats
+        n_uploaded = len(server.state.books)
+        login_count = tolino_cloud.login_stats['count']
+
+    return get_results(
+            duration, stats, n_uploaded, login_count, step_durations)
+
+
+def get_results(duration, stats, n_uploaded, login_count, step_durations):
+    """
+    :stats: stats of the stand-in server
+    :step_durations: dict (step: list of durations)
+    :returns: dict of the results
+
+    """
+    n_requests = sum(
+            count for endpoint, count in stats['requests'].items()
+            if endpoint != 'token')
+    return dict(
+            duration=duration,
+            uploaded=n_uploaded,
+            books_per_s=n_uploaded / duration,
+            requests_per_book=n_requests / max(1, n_uploaded),
+            logins=login_count,
+            errors=stats['errors'],
+            request_latency=percentiles(stats['latencies']),
+            step_latency={
+                step: percentiles(durations)
+                for step, durations in step_durations.items()},
+            )
+
+
+def print_results(jobs, results):
+    latency = results['request_latency']
+    print(f"jobs {jobs}: {results['uploaded']} books in "
+          f"{results['duration']:.2f}s, "
+          f"{results['books_per_s']:.2f} books/s, "
+          f"{results['requests_per_book']:.1f} requests/book, "
+          f"{results['logins']} logins, errors {results['errors']}")
+    print(f"  requests     p50 {latency[50] * 1e3:7.1f}ms  "
+          f"p95 {latency[95] * 1e3:7.1f}ms  p99 {latency[99] * 1e3:7.1f}ms")
+    for step, latency in sorted(results['step_latency'].items()):
+        print(f"  {step:<12} p50 {latency[50] * 1e3:7.1f}ms  "
+              f"p95 {latency[95] * 1e3:7.1f}ms  "
+              f"p99 {latency[99] * 1e3:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=200)
+    parser.add_argument(
+            '--jobs',
+            type=int,
+            nargs='+',
+            default=[1, 4, 8],
+            help='values of max_workers of sync_upload (max_concurrency '
+            'with --async)',
+            )
+    parser.add_argument(
+            '--async', dest='use_async', action='store_true',
+            help='upload with AsyncTolinoCloud instead of sync_upload')
+    parser.add_argument(
+            '--latency', type=float, default=0.02,
+            help='latency (s) of each request')
+    parser.add_argument(
+            '--latency-jitter', type=float, default=0.01,
+            help='random latency (s) added to each request')
+    parser.add_argument(
+            '--bandwidth', type=float, default=None,
+            help='bytes/s of the uploads')
+    parser.add_argument(
+            '--error-rate', type=float, default=0.,
+            help='probability of a 503 error')
+    parser.add_argument(
+            '--throttle-rate', type=float, default=None,
+            help='requests/s accepted by the server before 429 errors')
+    parser.add_argument(
+            '--rate', type=float, default=None,
+            help='requests/s of the client rate limiter (default: none)')
+    parser.add_argument(
+            '--file-size', type=int, default=100000,
+            help='size (bytes) of the epub files')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    from calibrolino.synthetic import create_library, write_calibre_config
+    from calibrolino.standin import StandinConfig
+
+    config = StandinConfig(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            bandwidth=args.bandwidth,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            seed=0,
+            )
+    with tempfile.TemporaryDirectory(prefix='calibrolino_bench_') as workdir:
+        prepare_environment(workdir)
+        library_folder = os.path.join(workdir, 'library')
+        create_library(
+                library_folder, args.books, file_size=args.file_size)
+        write_calibre_config(os.environ['XDG_CONFIG_HOME'], library_folder)
+        failed = False
+        run = run_async_upload if args.use_async else run_sync
+        for jobs in args.jobs:
+            results = run(
+                    library_folder, args.books, jobs, config, args.rate)
+            print_results(jobs, results)
+            failed = failed or results['uploaded'] < args.books
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
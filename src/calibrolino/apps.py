@@ -1,5 +1,7 @@
-from calibrolino.views import CalibrolinoShellView
-from calibrolino.gui_views import CalibrolinoGUIView
+import sys
+from contextlib import redirect_stdout
+
+
 from calibrolino.controllers import CalibrolinoController
 
 
@@ -7,10 +9,17 @@ class CalibrolinoShellApp(object):
 
     """calibrolino app in a shell"""
 
-    def __init__(self):
-        """init mvc model """
+    def __init__(self, rate_limiter=None):
+        """init mvc model
+
+        :rate_limiter: RateLimiter of the requests to the cloud
+
+        """
+        from calibrolino.views import CalibrolinoShellView
+
         self._view = CalibrolinoShellView()
-        controller = CalibrolinoController(self._view)
+        controller = CalibrolinoController(
+                self._view, rate_limiter=rate_limiter)
         self._view.controller = controller
 
     def start(self):
@@ -22,12 +31,20 @@ class CalibrolinoShellApp(object):
 
 class CalibrolinoTkinterApp(object):
 
-    """calibrolino app in tkinter GUI"""
+    """calibrolino app in tkinter GUI. tkinter and pandastable are only
+    imported when it is created"""
+
+    def __init__(self, rate_limiter=None):
+        """init mvc model
+
+        :rate_limiter: RateLimiter of the requests to the cloud
+
+        """
+        from calibrolino.gui_views import CalibrolinoGUIView
 
-    def __init__(self):
-        """init mvc model """
         self._view = CalibrolinoGUIView()
-        controller = CalibrolinoController(self._view)
+        controller = CalibrolinoController(
+                self._view, rate_limiter=rate_limiter)
         self._view.controller = controller
 
     def start(self):
@@ -35,3 +52,33 @@ class CalibrolinoTkinterApp(object):
 
         """
         self._view.start()
+
+
+class CalibrolinoBatchApp(object):
+
+    """calibrolino app that runs one command without interaction"""
+
+    def __init__(self, command, options=None, rate_limiter=None):
+        """init mvc model
+
+        :command: sync, status or delete
+        :options: options of the command, see CalibrolinoBatchView
+        :rate_limiter: RateLimiter of the requests to the cloud
+
+        """
+        from calibrolino.views import CalibrolinoBatchView
+
+        self._view = CalibrolinoBatchView(command, options)
+        # stdout is kept for the json summary of the view
+        with redirect_stdout(sys.stderr):
+            controller = CalibrolinoController(
+                    self._view, rate_limiter=rate_limiter)
+        self._view.controller = controller
+
+    def start(self) -> int:
+        """run the command
+
+        :returns: exit code
+
+        """
+        return self._view.start()
@@ -1,22 +1,189 @@
+import re
+from operator import itemgetter
+from typing import TYPE_CHECKING
+
+
 from varboxes import VarBox
 from pytolino.tolino_cloud import PARTNERS
-from pandas import DataFrame
 
 
 from calibrolino.interfaces import Controller, View
 from calibrolino.models import CalibreDBReader
 from calibrolino.models import CalibrolinoException
 from calibrolino.models import TolinoCloud
+from calibrolino.models import TolinoCloudException
+from calibrolino.ledger import SyncLedger
+from calibrolino.ledger import BOOK_MISSING
+from calibrolino.ledger import BOOK_FILE_CHANGED
+from calibrolino.ledger import BOOK_METADATA_CHANGED
+from calibrolino.progress import ProgressTracker
+from calibrolino.profiling import span
+
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+LIBRARY_COLUMNS = (
+        'local',
+        'online',
+        'book_id',
+        'uuid',
+        'publicationId',
+        'size',
+        'last_modified',
+        'stale_metadata',
+        )
+
+
+def get_library_frame(local_books: dict, online_books: dict,
+                      ledger_entries: dict) -> 'DataFrame':
+    """build the table of the library with one row per title of the local
+    and the online books. the frames of the local books, of the inventory
+    and of the ledger are joined on their index, without a python loop
+    over the rows. the local books come first, then the books that are
+    only on the cloud
+
+    :local_books: dict of books of CalibreDBReader
+    :online_books: dict of books on the cloud (full_title: publication id)
+    :ledger_entries: dict of the rows of the ledger (uuid: dict of row)
+    :returns: DataFrame indexed by full title with the LIBRARY_COLUMNS.
+    publicationId comes from the inventory, or from the ledger for the
+    books that are not in the inventory. stale_metadata is True for the
+    books uploaded before their last modification in calibre
+
+    """
+    from numpy import arange
+    from pandas import DataFrame, Series, Index
+
+    local_columns = ('book_id', 'uuid', 'size', 'last_modified')
+    df = DataFrame.from_records(
+            list(map(itemgetter(*local_columns), local_books.values())),
+            index=list(local_books),
+            columns=local_columns,
+            )
+    online_only = [title for title in online_books if title not in local_books]
+    if online_only:
+        df = df.reindex(df.index.append(Index(online_only, dtype=object)))
+    publication_ids = Series(online_books, dtype=object).reindex(df.index)
+    df = df.assign(
+            publicationId=publication_ids,
+            local=arange(len(df)) < len(local_books),
+            online=publication_ids.notna(),
+            book_id=df['book_id'].astype('Int64'),
+            size=df['size'].astype('Int64'),
+            )
+
+    ledger = DataFrame.from_records(
+            list(ledger_entries.values()),
+            columns=('uuid', 'publication_id', 'last_modified'),
+            ).set_index('uuid')
+    uploaded_version = df['uuid'].map(ledger['last_modified'])
+    df['publicationId'] = df['publicationId'].fillna(
+            df['uuid'].map(ledger['publication_id']))
+    df['stale_metadata'] = (
+            uploaded_version.notna()
+            & (uploaded_version != df['last_modified']))
+    return df.loc[:, list(LIBRARY_COLUMNS)]
+
+
+class LibraryDiff(object):
+
+    """rows that differ between two tables of the library"""
+
+    def __init__(self, added, removed, changed):
+        """
+        :added: index of the titles that are only in the new table
+        :removed: index of the titles that are only in the old table
+        :changed: index of the titles whose columns changed
+
+        """
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(len(self.added) or len(self.removed) or len(self.changed))
+
+    def __repr__(self):
+        return (f'LibraryDiff(added={len(self.added)}, '
+                f'removed={len(self.removed)}, changed={len(self.changed)})')
+
+
+def diff_library_frames(old: 'DataFrame', new: 'DataFrame') -> LibraryDiff:
+    """compare two tables of get_library_frame with set operations on
+    their index and a comparison of the arrays of the common rows, column
+    by column
+
+    :old: previous table
+    :new: current table
+    :returns: LibraryDiff
+
+    """
+    from numpy import ndarray, ones
+    from pandas import isna
+
+    in_old = new.index.isin(old.index)
+    added = new.index[~in_old]
+    removed = old.index[~old.index.isin(new.index)]
+    common = new.index[in_old]
+    old_positions = old.index.get_indexer(common)
+    equal = ones(len(common), dtype=bool)
+    for column in new.columns:
+        old_values = old[column].array.take(old_positions)
+        new_values = new[column].array[in_old]
+        same = old_values == new_values
+        if not isinstance(same, ndarray):
+            same = same.to_numpy(dtype=bool, na_value=False)
+        equal &= same | (isna(old_values) & isna(new_values))
+    changed = common[~equal]
+    return LibraryDiff(added, removed, changed)
+
+
+def apply_library_diff(df: 'DataFrame', new: 'DataFrame',
+                       diff: LibraryDiff, add=True) -> 'DataFrame':
+    """update a displayed table of the library with a diff, keeping the
+    order of its rows (for example after a sort or a filter)
+
+    :df: displayed table, with the rows of the old table in any order
+    :new: current table
+    :diff: LibraryDiff of the old and the new table
+    :add: if True, the added rows are appended at the end
+    :returns: updated table
+
+    """
+    from pandas import concat
+
+    df = df.drop(diff.removed.intersection(df.index))
+    changed = diff.changed[diff.changed.isin(df.index)]
+    if len(changed):
+        df = df.copy()
+        positions = df.index.get_indexer(changed)
+        for column in new.columns:
+            values = df[column].array.copy()
+            values[positions] = new.loc[changed, column].array
+            df[column] = values
+    if add and len(diff.added):
+        df = concat([df, new.loc[diff.added]])
+    return df
 
 
 class CalibrolinoController(Controller):
 
     """controller of calibrolino in mvc arch"""
 
-    def __init__(self, view: View):
+    def __init__(self, view: View, rate_limiter=None):
+        """
+        :view: view of calibrolino
+        :rate_limiter: RateLimiter of the requests to the cloud, see
+        TolinoCloud
+
+        """
         Controller.__init__(self)
         self._view = view
+        self._rate_limiter = rate_limiter
         self._varbox = VarBox('calibrolino')
+        self._progress = ProgressTracker()
         try:
             self._calibre_db = CalibreDBReader()
         except CalibrolinoException:
@@ -24,21 +191,38 @@ class CalibrolinoController(Controller):
             self._view.showerror('could not read calibre library!')
 
         self._tolino_cloud = None
+        self._ledger = None
         credentials = self.credentials
         if credentials:
             self._init_tolino_cloud(credentials)
 
     def _init_tolino_cloud(self, credentials):
         try:
-            tc = TolinoCloud(**credentials)
+            tc = TolinoCloud(**credentials, rate_limiter=self._rate_limiter)
         except CalibrolinoException as e:
             self._view.showerror(e)
             self._view.showerror('could not use the credentials. bad format?')
             return False
         else:
             self._tolino_cloud = tc
+            self._ledger = self._get_ledger(credentials)
             return True
 
+    def _get_ledger(self, credentials):
+        name = f"{credentials['partner']}_{credentials['username']}"
+        name = re.sub(r'[^\w.@-]', '_', name)
+        return SyncLedger(name)
+
+    def subscribe_progress(self, callback):
+        self._progress.subscribe(callback)
+
+    def cancel(self):
+        self._progress.cancel()
+
+    def clear_cancel(self):
+        """forget a cancel of a previous job"""
+        self._progress.clear_cancel()
+
     @property
     def partners(self) -> list:
         return list(PARTNERS)
@@ -78,6 +262,7 @@ class CalibrolinoController(Controller):
             delattr(self._varbox, 'password')
         self._varbox.info = 'this attr has been set to delete the cred'
         self._tolino_cloud = None
+        self._ledger = None
 
     @property
     def local_books(self) -> dict[dict]:
@@ -98,21 +283,128 @@ class CalibrolinoController(Controller):
             self._view.showinfo(msg)
         return online_books
 
-    def sync_upload(self) -> None:
-        local_books = self.local_books
+    def get_uploaded_online_books(self) -> dict:
+        """
+        :returns: dict of the online books (full_title: book id) that were
+        uploaded by calibrolino, i.e. recorded in the sync ledger. the books
+        bought in the store are never given
+
+        """
         online_books = self.get_online_books()
-        if online_books is not None:
-            books_to_upload = list()
-            for full_title, book in local_books.items():
-                if full_title not in online_books:
-                    books_to_upload.append(book)
-            msg = f'I will upload {len(books_to_upload)} books'
-            answer = self._view.askokcancel(msg)
-            if answer:
-                self._tolino_cloud.upload_books(books_to_upload)
-                self._view.showinfo('done')
+        if self._ledger is None:
+            return dict()
+        publication_ids = self._ledger.publication_ids
+        return {
+                full_title: book_id
+                for full_title, book_id in online_books.items()
+                if book_id in publication_ids}
+
+    def invalidate_online_books(self):
+        if self._tolino_cloud is not None:
+            self._tolino_cloud.invalidate_inventory()
+
+    def _reconcile_ledger(self) -> bool:
+        """compare the ledger with the inventory of the cloud
+
+        :returns: False if the inventory could not be downloaded
+
+        """
+        try:
+            online_books = self._tolino_cloud.get_uploaded_books()
+        except (CalibrolinoException, TolinoCloudException) as e:
+            self._view.showerror(e)
+            self._view.showerror('could not get online books inv')
+            return False
+        else:
+            self._ledger.reconcile(self.local_books, online_books)
+            return True
+
+    def get_sync_plan(self, delta: bool = True):
+        self._progress.clear_cancel()
+        if self._tolino_cloud is None:
+            msg = 'please enter first your credentials in the main menu'
+            self._view.showinfo(msg)
+            return None
+        if self._ledger.needs_reconcile():
+            if not self._reconcile_ledger():
+                return None
+        with span('sync.plan'):
+            if delta:
+                changes = self._ledger.get_changes(self.local_books)
+            else:
+                changes = {
+                        BOOK_MISSING: self._ledger.get_missing_books(
+                            self.local_books),
+                        BOOK_FILE_CHANGED: list(),
+                        BOOK_METADATA_CHANGED: list(),
+                        }
+        return changes
+
+    def run_sync(self, changes: dict, max_workers: int = 1) -> bool:
+        with span('sync.upload'):
+            return self._sync_changes(changes, max_workers)
+
+    def sync_upload(self, max_workers: int = 1, delta: bool = False) -> None:
+        changes = self.get_sync_plan(delta)
+        if changes is None:
+            return
+        msg = f'I will upload {len(changes[BOOK_MISSING])} books'
+        if delta:
+            msg = (
+                    f'{msg}, upload again '
+                    f'{len(changes[BOOK_FILE_CHANGED])} modified books '
+                    'and update the metadata of '
+                    f'{len(changes[BOOK_METADATA_CHANGED])} books')
+        answer = self._view.askokcancel(msg)
+        if answer:
+            try:
+                completed = self.run_sync(changes, max_workers)
+            except CalibrolinoException as e:
+                self._view.showerror(e)
+            else:
+                if completed:
+                    self._view.showinfo('done')
+                else:
+                    self._view.showinfo(
+                            'sync cancelled. the next sync will continue '
+                            'where it stopped')
+
+    def _sync_changes(self, changes: dict, max_workers: int):
+        """upload the missing books, replace the books whose file changed
+        and upload the metadata of the books whose metadata changed. the
+        progress is saved in the ledger after each step, an interrupted
+        sync continues where it stopped
+
+        :changes: dict of list of books, see SyncLedger.get_changes
+        :returns: False if the sync was cancelled before its end
+
+        """
+        entries = self._ledger.entries
+        # the old copy of a book whose file changed becomes obsolete when
+        # the new copy is uploaded (see SyncLedger.finish)
+        books_to_upload = changes[BOOK_MISSING] + changes[BOOK_FILE_CHANGED]
+        self._tolino_cloud.upload_books(
+                books_to_upload,
+                max_workers=max_workers,
+                checkpoint=self._ledger,
+                progress=self._progress,
+                )
+        if self._progress.cancelled:
+            return False
+        for old_book_id in self._ledger.obsolete_copies:
+            self._tolino_cloud.delete_book(old_book_id)
+            self._ledger.forget(old_book_id)
+
+        for book in changes[BOOK_METADATA_CHANGED]:
+            if self._progress.cancelled:
+                return False
+            book_id = entries[book['uuid']]['publication_id']
+            self._tolino_cloud.upload_metadata(book, book_id)
+            self._ledger.record_uploads([book], {book['full_title']: book_id})
+        return True
 
     def upload_book(self, book_title: str):
+        self._progress.clear_cancel()
         try:
             book = self.local_books[book_title]
         except KeyError:
@@ -124,11 +416,18 @@ class CalibrolinoController(Controller):
                 if book['full_title'] not in online_books:
                     books_to_upload = [book]
                     try:
-                        self._tolino_cloud.upload_books(books_to_upload)
+                        uploaded_books = self._tolino_cloud.upload_books(
+                                books_to_upload,
+                                checkpoint=self._ledger,
+                                progress=self._progress,
+                                )
                     except CalibrolinoException as e:
                         self._view.showerror(e)
                     else:
-                        msg = f'{book_title} has been uploaded'
+                        if book['full_title'] in uploaded_books:
+                            msg = f'{book_title} has been uploaded'
+                        else:
+                            msg = f'upload of {book_title} cancelled'
                         self._view.showinfo(msg)
                 else:
                     msg = (
@@ -141,6 +440,8 @@ class CalibrolinoController(Controller):
                     except CalibrolinoException as e:
                         self._view.showerror(e)
                     else:
+                        self._ledger.record_uploads(
+                                [book], {book['full_title']: book_id})
                         msg = f'metadata of {book_title} have been uploaded'
                         self._view.showinfo(msg)
 
@@ -162,31 +463,30 @@ class CalibrolinoController(Controller):
                     except CalibrolinoException as e:
                         self._view.showerror(e)
                     else:
+                        self._ledger.forget(book_id)
                         msg = f'{book_title} has been deleted'
                         self._view.showinfo(msg)
 
     def _read_db(self):
-        """read the calibre library and get books
+        """read the changes of the calibre library and update the books
 
         """
         try:
-            local_books = self._calibre_db.read_db()
+            self._calibre_db.refresh()
         except CalibrolinoException:
             self._view.showerror('failed to read the calibre db')
 
-    def get_full_library(self, include_online: bool) -> DataFrame:
+    def get_full_library(self, include_online: bool) -> 'DataFrame':
         self._read_db()
         local_lib = self.local_books
         if include_online:
             online_lib = self.get_online_books()
         else:
             online_lib = dict()
-        local_titles = local_lib.keys()
-        online_titles = online_lib.keys()
-        all_titles = list(local_titles|online_titles)
-        df = DataFrame(dict(local=False, online=False), all_titles)
-        for title in local_titles:
-            df.at[title, 'local'] = True
-        for title in online_lib:
-            df.at[title, 'online'] = True
+        if self._ledger is not None:
+            ledger_entries = self._ledger.entries
+        else:
+            ledger_entries = dict()
+        with span('library.table'):
+            df = get_library_frame(local_lib, online_lib, ledger_entries)
         return df
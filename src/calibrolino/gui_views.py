@@ -6,6 +6,9 @@ from pandastable import Table
 
 
 from calibrolino.interfaces import View, Controller
+from calibrolino.controllers import diff_library_frames, apply_library_diff
+from calibrolino.progress import BOOK_STARTED, BATCH_FINISHED, format_stats
+from calibrolino.worker import BackgroundWorker
 
 
 class CredentialsPrompt(simpledialog.Dialog):
@@ -46,9 +49,12 @@ class CredentialsPrompt(simpledialog.Dialog):
 
 class CalibrolinoGUIView(View, tkinter.Tk):
 
-    """GUI view run calibrolino"""
+    """GUI view run calibrolino. the operations of the controller run in a
+    BackgroundWorker: the window stays responsive and only one operation
+    runs at a time"""
 
     _welcome_msg = 'welcome to the calibrolino menu'
+    _poll_interval = 100  # ms
 
     @property
     def controller(self) -> Controller:
@@ -59,19 +65,24 @@ class CalibrolinoGUIView(View, tkinter.Tk):
         self._controller = value
 
     def showerror(self, msg: str):
-        tkinter.messagebox.showerror(
+        self._worker.run_in_main_thread(
+                tkinter.messagebox.showerror,
                 title='error',
                 message=msg,
                 )
 
     def showinfo(self, msg: str):
-        tkinter.messagebox.showinfo(
+        self._worker.run_in_main_thread(
+                tkinter.messagebox.showinfo,
                 title='info',
                 message=msg,
                 )
 
     def __init__(self):
         tkinter.Tk.__init__(self)
+        self._library = None
+        self._worker = BackgroundWorker(on_error=self._show_job_error)
+        self._action_buttons = list()
         self._create_menu()
         self._library_frame = ttk.LabelFrame(self)
         self._library_frame.pack()
@@ -103,26 +114,33 @@ class CalibrolinoGUIView(View, tkinter.Tk):
                 text='test',
                 command=self._test,
                 ).grid(column=0, row=0)
-        ttk.Button(
-                self._options_frame,
-                text='update',
-                command=self._update_library_display,
-                ).grid(column=1, row=0)
-        ttk.Button(
-                self._options_frame,
-                text='upload all',
-                command=self._upload_all,
-                ).grid(column=2, row=0)
-        ttk.Button(
+        actions = (
+                ('update', self._refresh_library_display),
+                ('upload all', self._upload_all),
+                ('upload selection', self._upload_one),
+                ('delete selection', self._delete_selected_book),
+                ('upload changes', self._sync_changes),
+                )
+        for column, (text, command) in enumerate(actions, 1):
+            button = ttk.Button(
+                    self._options_frame,
+                    text=text,
+                    command=command,
+                    )
+            button.grid(column=column, row=0)
+            self._action_buttons.append(button)
+        self._cancel_button = ttk.Button(
                 self._options_frame,
-                text='upload selection',
-                command=self._upload_one,
-                ).grid(column=3, row=0)
-        ttk.Button(
+                text='cancel',
+                command=self._cancel,
+                state='disabled',
+                )
+        self._cancel_button.grid(column=6, row=0)
+        self._progress_text = tkinter.StringVar()
+        ttk.Label(
                 self._options_frame,
-                text='delete selection',
-                command=self._delete_selected_book,
-                ).grid(column=4, row=0)
+                textvariable=self._progress_text,
+                ).grid(column=0, row=1, columnspan=7)
 
     def _test(self):
         rowdata = self._library_table.getSelectedRowData()
@@ -135,19 +153,27 @@ class CalibrolinoGUIView(View, tkinter.Tk):
 
 
         """
+        if self._worker.busy:
+            self._show_busy()
+            return
         partners = self.controller.partners
         prompt = CredentialsPrompt(self, partners)
         new_credentials = prompt.new_credentials
         if new_credentials:
-            self.controller.credentials = new_credentials
-            self._update_library_display()
+            def set_credentials():
+                self.controller.credentials = new_credentials
+
+            self._run_job('login', set_credentials)
 
     def _del_credentials(self):
         """
 
         """
+        if self._worker.busy:
+            self._show_busy()
+            return
         del self.controller.credentials
-        self._update_library_display(False)
+        self._run_job('update', lambda: None, include_online=False)
 
     def _create_menu(self):
         """put option in menu
@@ -175,24 +201,181 @@ class CalibrolinoGUIView(View, tkinter.Tk):
                 )
 
     def start(self):
-        self._update_library_display(include_online=False)
+        self.controller.subscribe_progress(self._show_progress)
+        self._run_job('load', lambda: None, include_online=False)
+        self.after(self._poll_interval, self._poll_worker)
         self.mainloop()
 
-    def _update_library_display(self, include_online=True):
+    def _poll_worker(self):
+        """run the callbacks posted by the background job"""
+        self._worker.process_queue()
+        self.after(self._poll_interval, self._poll_worker)
+
+    def _run_job(self, name, operation, include_online=True,
+                 cancellable=False):
+        """run the operation and the reading of the library in the
+        background, then update the table. the action buttons are disabled
+        until the job is finished
+
+        :name: name of the job, shown under the buttons
+        :operation: function without argument that calls the controller
+        :cancellable: enable the cancel button while the job runs (for the
+        uploads)
+
         """
+        def job():
+            self.controller.clear_cancel()
+            operation()
+            return self.controller.get_full_library(include_online)
+
+        if not self._worker.submit(name, job, on_done=self._finish_job):
+            self._show_busy()
+            return
+        self._progress_text.set(f'{name}...')
+        self._set_busy(True, cancellable)
+
+    def _finish_job(self, library):
+        self._set_busy(False)
+        if self._progress_text.get().endswith('...'):
+            self._progress_text.set('')
+        self._update_library_display(library)
+
+    def _show_job_error(self, error):
+        self._set_busy(False)
+        self._progress_text.set('')
+        tkinter.messagebox.showerror(title='error', message=str(error))
+
+    def _set_busy(self, busy, cancellable=False):
+        """disable the actions (and enable cancel if the job can be
+        cancelled) while a job runs"""
+        state = 'disabled' if busy else '!disabled'
+        for button in self._action_buttons:
+            button.state([state])
+        cancel_state = '!disabled' if busy and cancellable else 'disabled'
+        self._cancel_button.state([cancel_state])
+
+    def _show_busy(self):
+        self.showinfo(f'please wait, {self._worker.job_name} is running')
+
+    def _cancel(self):
+        """stop the running upload before the next book"""
+        self.controller.cancel()
+        self._progress_text.set('cancelling after the current book...')
+
+    def _show_progress(self, event):
+        """display the progress of the uploads under the buttons. called
+        from the background thread: the display is done by the tkinter
+        thread
+
+        :event: ProgressEvent
 
         """
-        full_lib = self.controller.get_full_library(include_online)
-        self._library_table.model.df = full_lib
-        self._library_table.sortTable(1)
-        self._library_table.redraw()
+        text = format_stats(event.stats)
+        if event.kind == BOOK_STARTED:
+            text = f"uploading {event.book['full_title']} - {text}"
+        elif event.kind == BATCH_FINISHED:
+            text = f'done: {text}'
+        self._worker.post(self._progress_text.set, text)
+
+    def _update_library_display(self, library):
+        """apply the changes of the library to the table. only the rows
+        that were added, removed or changed are touched: the order of the
+        rows (sort), the filter, the selection and the scroll position are
+        kept. the added rows are shown at the end of the table
+
+        :library: DataFrame of get_full_library
+
+        """
+        table = self._library_table
+        if self._library is None:
+            self._library = library
+            table.model.df = library
+            table.sortTable(1)
+            return
+        diff = diff_library_frames(self._library, library)
+        self._library = library
+        if not diff:
+            return
+        selection = self._get_selected_titles()
+        first_title = self._get_first_visible_title()
+        if table.filtered and hasattr(table, 'dataframe'):
+            table.dataframe = apply_library_diff(
+                    table.dataframe, library, diff)
+            table.model.df = apply_library_diff(
+                    table.model.df, library, diff, add=False)
+        else:
+            table.model.df = apply_library_diff(table.model.df, library, diff)
+        if len(diff.added) or len(diff.removed):
+            self._restore_table_position(selection, first_title)
+        else:
+            index = table.model.df.index
+            visible_titles = index[[
+                row for row in getattr(table, 'visiblerows', list())
+                if row < len(index)]]
+            if visible_titles.isin(diff.changed).any():
+                table.redrawVisible()
+
+    def _get_selected_titles(self) -> list:
+        table = self._library_table
+        index = table.model.df.index
+        rows = table.multiplerowlist or [table.currentrow]
+        return [
+                index[row] for row in rows
+                if row is not None and 0 <= row < len(index)]
+
+    def _get_first_visible_title(self):
+        table = self._library_table
+        index = table.model.df.index
+        rows = getattr(table, 'visiblerows', list())
+        if rows and rows[0] < len(index):
+            return index[rows[0]]
+        return None
+
+    def _restore_table_position(self, selection, first_title):
+        """select again the same titles and scroll back to the first
+        title that was visible, after rows were added or removed
+
+        """
+        table = self._library_table
+        index = table.model.df.index
+        positions = [
+                int(position) for position in index.get_indexer(selection)
+                if position >= 0]
+        if positions:
+            table.setSelectedRow(positions[0])
+            table.setSelectedRows(positions)
+        else:
+            table.setSelectedRow(min(table.currentrow or 0,
+                                     max(len(index) - 1, 0)))
+        table.redrawVisible()
+        if first_title in index:
+            position = index.get_loc(first_title)
+            height = table.rowheight * len(index) + 10
+            table.set_yviews('moveto', position * table.rowheight / height)
+
+    def _refresh_library_display(self):
+        """download again the inventory of the cloud and update the display
+
+        """
+        self._run_job('update', self.controller.invalidate_online_books)
 
     def _upload_all(self):
         """upload the whole library
 
         """
-        self.controller.sync_upload()
-        self._update_library_display()
+        self._run_job(
+                'upload', self.controller.sync_upload, cancellable=True)
+
+    def _sync_changes(self):
+        """upload the new books, the modified books and the modified
+        metadata
+
+        """
+        self._run_job(
+                'sync',
+                lambda: self.controller.sync_upload(delta=True),
+                cancellable=True,
+                )
 
     def _upload_one(self):
         """upload selected book
@@ -201,8 +384,11 @@ class CalibrolinoGUIView(View, tkinter.Tk):
         rowdata = self._library_table.getSelectedRowData()
         index = rowdata.index
         title = index.values[0]
-        self.controller.upload_book(title)
-        self._update_library_display()
+        self._run_job(
+                'upload',
+                lambda: self.controller.upload_book(title),
+                cancellable=True,
+                )
 
     def _delete_selected_book(self):
         """delete selected book from the cloud
@@ -211,14 +397,15 @@ class CalibrolinoGUIView(View, tkinter.Tk):
         rowdata = self._library_table.getSelectedRowData()
         index = rowdata.index
         title = index.values[0]
-        self.controller.delete_book(title)
-        self._update_library_display()
+        self._run_job('delete', lambda: self.controller.delete_book(title))
 
     def askokcancel(self, msg: str) -> bool:
-        return tkinter.messagebox.askokcancel(message=msg)
+        return self._worker.run_in_main_thread(
+                tkinter.messagebox.askokcancel, message=msg)
 
     def askyesno(self, msg: str) -> bool:
-        return tkinter.messagebox.askyesno(message=msg)
+        return self._worker.run_in_main_thread(
+                tkinter.messagebox.askyesno, message=msg)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,9 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
+from typing import TYPE_CHECKING
 
 
-from pandas import DataFrame
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 
 class Controller(metaclass=ABCMeta):
@@ -37,9 +39,77 @@ class Controller(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def sync_upload(self) -> None:
+    def get_uploaded_online_books(self) -> dict:
+        """get the online books uploaded by calibrolino, without the books
+        bought in the store
+        :returns: [title]: epub_id
+
+        """
+        pass
+
+    @abstractmethod
+    def invalidate_online_books(self):
+        """forget the cached inventory of the cloud, so that the next call
+        to get_online_books downloads it again
+
+        """
+        pass
+
+    @abstractmethod
+    def subscribe_progress(self, callback):
+        """receive the progress of the uploads
+
+        :callback: function called with each ProgressEvent of the uploads
+
+        """
+        pass
+
+    @abstractmethod
+    def cancel(self):
+        """stop the running sync before the next book. it can be called
+        from any thread
+
+        """
+        pass
+
+    @abstractmethod
+    def clear_cancel(self):
+        """forget a cancel of a previous job, before starting a new one
+
+        """
+        pass
+
+    @abstractmethod
+    def get_sync_plan(self, delta: bool = True):
+        """compare the local books with the ledger (reconciled with the
+        cloud if needed), without uploading anything
+
+        :delta: if False, only the missing books are planned
+        :returns: dict of list of books, see SyncLedger.get_changes. None if
+        the cloud can not be used
+
+        """
+        pass
+
+    @abstractmethod
+    def run_sync(self, changes: dict, max_workers: int = 1) -> bool:
+        """upload the changes of get_sync_plan, without asking
+
+        :max_workers: number of books uploaded at the same time
+        :returns: False if the sync was cancelled before its end
+        :raises: CalibrolinoException if an upload failed
+
+        """
+        pass
+
+    @abstractmethod
+    def sync_upload(self, max_workers: int = 1, delta: bool = False) -> None:
         """upload all local books that are not yet online
 
+        :max_workers: number of books uploaded at the same time
+        :delta: if True, also upload again the books whose file changed and
+        the metadata of the books whose metadata changed
+
         """
         pass
 
@@ -62,10 +132,12 @@ class Controller(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def get_full_library(self) -> tuple[DataFrame, dict, dict]:
+    def get_full_library(self, include_online: bool) -> 'DataFrame':
         """read local db and online cloud to get a library of all books
-        :returns: table with title, local (True/False), online (True/False)
-        and local and online books
+        :include_online: if False, the inventory of the cloud is not used
+        :returns: table indexed by title with local (True/False), online
+        (True/False), book_id, uuid, publicationId, size, last_modified
+        and stale_metadata
 
         """
         pass
@@ -1,14 +1,35 @@
+import os
+import sys
 import logging
 import argparse
 
 
-from calibrolino.apps import CalibrolinoShellApp, CalibrolinoTkinterApp
+from calibrolino.profiling import PROFILE_ENV_VAR, parse_profile_options
+from calibrolino.profiling import start_profiling, stop_profiling
+from calibrolino.profiling import span, write_report
+
+
+def positive_int(value) -> int:
+    """type of the argparse options that take a number of at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+                f'{value!r} is not an integer of at least 1')
+    return number
 
 
 def start_calibrolino():
     parser = argparse.ArgumentParser(
             prog='calibrolino',
             description='sync calibre library to mytolino',
+            epilog=(
+                f'profiling can also be set with the {PROFILE_ENV_VAR} '
+                'environment variable, e.g. '
+                f'{PROFILE_ENV_VAR}=memory,pstats=calibrolino.pstats,'
+                'report=calibrolino_profile.txt'),
             )
 
     parser.add_argument(
@@ -25,11 +46,143 @@ def start_calibrolino():
             help='use text mode (no GUI)',
             )
 
+    parser.add_argument(
+            '--rate',
+            type=float,
+            metavar='N',
+            help=(
+                'send at most N requests per second to the cloud on average '
+                '(default 4), 0 for no limit'),
+            )
+
+    parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='time the phases of calibrolino and print them at exit',
+            )
+
+    parser.add_argument(
+            '--profile-memory',
+            action='store_true',
+            help='profile and measure the memory with tracemalloc',
+            )
+
+    parser.add_argument(
+            '--profile-pstats',
+            metavar='PATH',
+            help='profile and run cProfile, its stats are written in PATH',
+            )
+
+    parser.add_argument(
+            '--profile-report',
+            metavar='PATH',
+            help='profile and write the report in PATH instead of stderr',
+            )
+
+    subparsers = parser.add_subparsers(
+            dest='command',
+            title='commands',
+            description=(
+                'run one command without interaction and print a json '
+                'summary, e.g. for a scheduled sync. without command, the '
+                'GUI (or the text mode) is started'),
+            )
+
+    sync_parser = subparsers.add_parser(
+            'sync',
+            help='upload the changes of the calibre library',
+            )
+    sync_parser.add_argument(
+            '-j',
+            '--jobs',
+            type=positive_int,
+            default=1,
+            help='number of books uploaded at the same time',
+            )
+    sync_parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only print what would be uploaded',
+            )
+    sync_parser.add_argument(
+            '--limit',
+            type=int,
+            metavar='N',
+            help='upload at most N books',
+            )
+    sync_parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='only upload the books that are not on the cloud',
+            )
+
+    subparsers.add_parser(
+            'status',
+            help='count the local, online and modified books',
+            )
+
+    delete_parser = subparsers.add_parser(
+            'delete',
+            help='delete books from the cloud',
+            )
+    delete_parser.add_argument(
+            '--missing-locally',
+            action='store_true',
+            help='delete the books that are not in the calibre library',
+            )
+    delete_parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only print what would be deleted',
+            )
+    delete_parser.add_argument(
+            '--limit',
+            type=int,
+            metavar='N',
+            help='delete at most N books',
+            )
+
     args = parser.parse_args()
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
-    if args.textmode:
-        app = CalibrolinoShellApp()
-    else:
-        app = CalibrolinoTkinterApp()
-    app.start()
+
+    options = parse_profile_options(os.environ.get(PROFILE_ENV_VAR))
+    profile = any((
+            options['profile'],
+            args.profile,
+            args.profile_memory,
+            args.profile_pstats,
+            args.profile_report,
+            ))
+    if profile:
+        start_profiling(
+                pstats_path=args.profile_pstats or options['pstats_path'],
+                trace_memory=args.profile_memory or options['trace_memory'],
+                )
+    exit_code = None
+    try:
+        with span('app.import'):
+            from calibrolino.apps import CalibrolinoShellApp
+            from calibrolino.apps import CalibrolinoTkinterApp
+            from calibrolino.apps import CalibrolinoBatchApp
+        rate_limiter = None
+        if args.rate is not None:
+            from calibrolino.retry import RateLimiter
+            rate_limiter = RateLimiter(rate=args.rate or None)
+        with span('app.init'):
+            if args.command is not None:
+                app = CalibrolinoBatchApp(
+                        args.command, args, rate_limiter=rate_limiter)
+            elif args.textmode:
+                app = CalibrolinoShellApp(rate_limiter=rate_limiter)
+            else:
+                app = CalibrolinoTkinterApp(rate_limiter=rate_limiter)
+        exit_code = app.start()
+    finally:
+        if profile:
+            write_report(
+                    stop_profiling(),
+                    args.profile_report or options['report_path'],
+                    )
+    if args.command is not None:
+        sys.exit(exit_code)
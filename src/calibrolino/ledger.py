@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+import xdg_base_dirs
+
+
+BOOK_MISSING = 'missing'
+BOOK_FILE_CHANGED = 'file'
+BOOK_METADATA_CHANGED = 'metadata'
+BOOK_UNCHANGED = 'unchanged'
+
+
+def get_metadata_fingerprint(book: dict) -> str:
+    """hash of the metadata of a book that are uploaded to the cloud
+
+    :book: dict of a book from CalibreDBReader
+    :returns: hex digest
+
+    """
+    metadata = dict(
+            full_title=book['full_title'],
+            authors=book['authors'],
+            publishers=book['publishers'],
+            tags=book['tags'],
+            status=book['status'],
+            isbn=book['isbn'],
+            issued=book['issued'],
+            languages=book['languages'],
+            has_cover=book['has_cover'],
+            )
+    data = json.dumps(metadata, sort_keys=True).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_file_hash(path) -> str:
+    """sha256 of the content of a file
+
+    :returns: hex digest, None if the file does not exist
+
+    """
+    file_hash = hashlib.sha256()
+    try:
+        with open(path, 'rb') as myfile:
+            for chunk in iter(lambda: myfile.read(1 << 20), b''):
+                file_hash.update(chunk)
+    except OSError:
+        return None
+    return file_hash.hexdigest()
+
+
+def get_file_stat(path) -> tuple:
+    """size and mtime of a file
+
+    :returns: (size, mtime), (None, None) if the file does not exist
+
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime
+
+
+class SyncLedger(object):
+
+    """small sqlite db that maps the calibre books to the books uploaded
+    on the cloud, so that a sync can be prepared without downloading the
+    inventory of the cloud"""
+
+    _reconcile_interval = 7 * 24 * 3600.
+    _columns = dict(
+            uuid='TEXT PRIMARY KEY',
+            book_id='INTEGER',
+            full_title='TEXT',
+            publication_id='TEXT',
+            uploaded_at='REAL',
+            file_size='INTEGER',
+            file_mtime='REAL',
+            metadata_fingerprint='TEXT',
+            last_modified='TEXT',
+            file_hash='TEXT',
+            )
+
+    def __init__(self, name='default', path=None):
+        """
+        :name: name of the ledger (for example partner and username)
+        :path: path of the db. default is in the xdg data dir of calibrolino
+
+        """
+        if path is None:
+            folder = os.path.join(xdg_base_dirs.xdg_data_home(), 'calibrolino')
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f'ledger_{name}.db')
+        self._path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute('PRAGMA journal_mode = WAL')
+        self._con.execute('PRAGMA synchronous = NORMAL')
+        self._create_tables()
+
+    def _create_tables(self):
+        columns = ', '.join(
+                f'{name} {column_type}'
+                for name, column_type in self._columns.items())
+        column_names = ', '.join(self._columns)
+        placeholders = ', '.join('?' * len(self._columns))
+        self._insert_sql = (
+                f'INSERT OR REPLACE INTO books ({column_names}) '
+                f'VALUES ({placeholders})')
+        with self._lock, self._con:
+            self._con.execute(f'CREATE TABLE IF NOT EXISTS books ({columns})')
+            res = self._con.execute('PRAGMA table_info(books)')
+            existing_columns = {row['name'] for row in res}
+            for name, column_type in self._columns.items():
+                if name not in existing_columns:
+                    sql = f'ALTER TABLE books ADD COLUMN {name} {column_type}'
+                    self._con.execute(sql)
+            self._con.executescript("""
+            CREATE INDEX IF NOT EXISTS books_publication_idx
+                ON books (publication_id);
+            CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value
+            );
+            CREATE TABLE IF NOT EXISTS uploads_in_progress (
+                uuid TEXT PRIMARY KEY,
+                publication_id TEXT,
+                steps TEXT NOT NULL DEFAULT '',
+                started_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS obsolete_copies (
+                publication_id TEXT PRIMARY KEY
+            );
+            """)
+
+    def close(self):
+        self._con.close()
+
+    @property
+    def entries(self) -> dict:
+        """all the books of the ledger (uuid: dict of the row)"""
+        with self._lock:
+            res = self._con.execute('SELECT * FROM books')
+            return {row['uuid']: dict(row) for row in res}
+
+    @property
+    def publication_ids(self) -> set:
+        """ids of all the copies uploaded by calibrolino that the ledger
+        knows: the books of the ledger (including the books removed from
+        calibre), the uploads in progress and the obsolete copies"""
+        with self._lock:
+            res = self._con.execute("""
+            SELECT publication_id FROM books
+            UNION SELECT publication_id FROM uploads_in_progress
+            UNION SELECT publication_id FROM obsolete_copies
+            """)
+            return {
+                    row['publication_id'] for row in res
+                    if row['publication_id'] is not None}
+
+    def get(self, uuid):
+        """
+        :uuid: uuid of the book in calibre
+        :returns: dict of the row of the book or None
+
+        """
+        with self._lock:
+            res = self._con.execute(
+                    'SELECT * FROM books WHERE uuid = ?', (uuid,))
+            row = res.fetchone()
+        return dict(row) if row is not None else None
+
+    def _get_info(self, key, default=None):
+        res = self._con.execute('SELECT value FROM info WHERE key = ?', (key,))
+        row = res.fetchone()
+        return default if row is None else row['value']
+
+    def _set_info(self, key, value):
+        self._con.execute(
+                'INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)',
+                (key, value))
+
+    def _get_row(self, book, publication_id, uploaded_at, hash_file=True):
+        """
+        :hash_file: if False, the file is not read and its hash is NULL
+        (see _classify)
+
+        """
+        file_size, file_mtime = get_file_stat(book['file_path'])
+        file_hash = get_file_hash(book['file_path']) if hash_file else None
+        return (
+                book['uuid'],
+                book['book_id'],
+                book['full_title'],
+                publication_id,
+                uploaded_at,
+                file_size,
+                file_mtime,
+                get_metadata_fingerprint(book),
+                book['last_modified'],
+                file_hash,
+                )
+
+    def record_uploads(self, books, uploaded_books):
+        """save the books that were uploaded
+
+        :books: list of books (dict from CalibreDBReader)
+        :uploaded_books: dict (full_title: publication id)
+
+        """
+        now = time.time()
+        rows = [
+                self._get_row(book, uploaded_books[book['full_title']], now)
+                for book in books if book['full_title'] in uploaded_books]
+        with self._lock, self._con:
+            self._con.executemany(self._insert_sql, rows)
+
+    def get_progress(self, book: dict) -> tuple:
+        """progress of an upload that was interrupted
+
+        :book: dict of a book from CalibreDBReader
+        :returns: publication id (None if the file was not uploaded) and
+        set of the steps that are done
+
+        """
+        with self._lock:
+            res = self._con.execute(
+                    'SELECT * FROM uploads_in_progress WHERE uuid = ?',
+                    (book['uuid'],))
+            row = res.fetchone()
+        if row is None:
+            return None, set()
+        steps = set(row['steps'].split(',')) - {''}
+        return row['publication_id'], steps
+
+    def save_step(self, book: dict, step: str, publication_id):
+        """save that a step of the upload of a book is done
+
+        :book: dict of a book from CalibreDBReader
+        :step: name of the step (see TolinoCloud)
+        :publication_id: id of the book on the cloud
+
+        """
+        with self._lock, self._con:
+            self._con.execute("""
+            INSERT INTO uploads_in_progress
+                (uuid, publication_id, steps, started_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (uuid) DO UPDATE SET
+                publication_id = excluded.publication_id,
+                steps = steps || ',' || excluded.steps
+            """, (book['uuid'], publication_id, step, time.time()))
+
+    def finish(self, book: dict, publication_id):
+        """all the steps of the upload of a book are done: the book is
+        saved in the ledger. if it replaces a copy of the book with
+        another id, this copy becomes obsolete (see obsolete_copies)
+
+        :book: dict of a book from CalibreDBReader
+        :publication_id: id of the book on the cloud
+
+        """
+        row = self._get_row(book, publication_id, time.time())
+        with self._lock, self._con:
+            res = self._con.execute(
+                    'SELECT publication_id FROM books WHERE uuid = ?',
+                    (book['uuid'],))
+            old_row = res.fetchone()
+            if old_row is not None and old_row[0] not in (
+                    None, publication_id):
+                self._con.execute(
+                        'INSERT OR IGNORE INTO obsolete_copies VALUES (?)',
+                        (old_row[0],))
+            self._con.execute(self._insert_sql, row)
+            self._con.execute(
+                    'DELETE FROM uploads_in_progress WHERE uuid = ?',
+                    (book['uuid'],))
+
+    @property
+    def obsolete_copies(self) -> list:
+        """publication ids of old copies of books that must be deleted
+        from the cloud. an id that is still the copy of a book in the
+        ledger is never given (e.g. an id added before its replacement was
+        uploaded)"""
+        with self._lock:
+            res = self._con.execute("""
+            SELECT publication_id FROM obsolete_copies
+            WHERE publication_id NOT IN (
+                SELECT publication_id FROM books
+                WHERE publication_id IS NOT NULL)
+            """)
+            return [row['publication_id'] for row in res]
+
+    def add_obsolete_copies(self, publication_ids):
+        """mark copies as obsolete. finish does it when a book is
+        replaced"""
+        with self._lock, self._con:
+            self._con.executemany(
+                    'INSERT OR IGNORE INTO obsolete_copies VALUES (?)',
+                    [(publication_id,) for publication_id in publication_ids])
+
+    def forget(self, publication_id):
+        """remove a book that was deleted from the cloud
+
+        :publication_id: id of the book on the cloud
+
+        """
+        with self._lock, self._con:
+            self._con.execute(
+                    'DELETE FROM books WHERE publication_id = ?',
+                    (publication_id,))
+            self._con.execute(
+                    'DELETE FROM obsolete_copies WHERE publication_id = ?',
+                    (publication_id,))
+
+    def get_missing_books(self, local_books: dict) -> list:
+        """
+        :local_books: dict of books of CalibreDBReader
+        :returns: list of the local books that are not in the ledger
+
+        """
+        entries = self.entries
+        return [
+                book for book in local_books.values()
+                if book['uuid'] not in entries]
+
+    def classify(self, book: dict) -> str:
+        """compare a local book with the ledger. the file is hashed only
+        if only its mtime changed (its new mtime is saved if the content is
+        the same), the metadata fingerprint is computed only if
+        last_modified changed. a book found by reconcile has no hash: it is
+        considered as changed if its mtime changed
+
+        :book: dict of a book from CalibreDBReader
+        :returns: BOOK_MISSING, BOOK_FILE_CHANGED, BOOK_METADATA_CHANGED
+        or BOOK_UNCHANGED
+
+        """
+        return self._classify(book, self.get(book['uuid']))
+
+    def _classify(self, book, entry):
+        if entry is None:
+            return BOOK_MISSING
+        file_stat = get_file_stat(book['file_path'])
+        if file_stat != (entry['file_size'], entry['file_mtime']):
+            if file_stat[0] != entry['file_size']:
+                return BOOK_FILE_CHANGED
+            if entry['file_hash'] is None:
+                return BOOK_FILE_CHANGED
+            file_hash = get_file_hash(book['file_path'])
+            if file_hash != entry['file_hash']:
+                return BOOK_FILE_CHANGED
+            self._set_file_mtime(entry['uuid'], file_stat[1])
+        if book['last_modified'] != entry['last_modified']:
+            fingerprint = get_metadata_fingerprint(book)
+            if fingerprint != entry['metadata_fingerprint']:
+                return BOOK_METADATA_CHANGED
+        return BOOK_UNCHANGED
+
+    def _set_file_mtime(self, uuid, file_mtime):
+        with self._lock, self._con:
+            self._con.execute(
+                    'UPDATE books SET file_mtime = ? WHERE uuid = ?',
+                    (file_mtime, uuid))
+
+    def get_changes(self, local_books: dict) -> dict:
+        """sort the local books according to what must be sent to the cloud
+
+        :local_books: dict of books of CalibreDBReader
+        :returns: dict with the keys BOOK_MISSING, BOOK_FILE_CHANGED,
+        BOOK_METADATA_CHANGED and BOOK_UNCHANGED, and lists of books as
+        values
+
+        """
+        entries = self.entries
+        changes = {
+                BOOK_MISSING: list(),
+                BOOK_FILE_CHANGED: list(),
+                BOOK_METADATA_CHANGED: list(),
+                BOOK_UNCHANGED: list(),
+                }
+        for book in local_books.values():
+            change = self._classify(book, entries.get(book['uuid']))
+            changes[change].append(book)
+        return changes
+
+    def needs_reconcile(self) -> bool:
+        """True if the ledger was never compared with the inventory of the
+        cloud, or not since _reconcile_interval"""
+        with self._lock:
+            last_reconcile = self._get_info('last_reconcile')
+        if last_reconcile is None:
+            return True
+        return time.time() - last_reconcile > self._reconcile_interval
+
+    def request_reconcile(self):
+        """the ledger may be wrong (for example after an interrupted
+        upload), a reconcile should be done before the next sync"""
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM info WHERE key = 'last_reconcile'")
+
+    def reconcile(self, local_books: dict, uploaded_books: dict):
+        """make the ledger match the inventory of the cloud. the local books
+        found on the cloud are added (considered as up to date if they were
+        not in the ledger), the books that are not on the cloud anymore
+        are removed.
+
+        :local_books: dict of books of CalibreDBReader
+        :uploaded_books: dict of books on the cloud (full_title: book id)
+
+        """
+        entries = self.entries
+        now = time.time()
+        rows = list()
+        for full_title, book in local_books.items():
+            publication_id = uploaded_books.get(full_title)
+            if publication_id is None:
+                continue
+            entry = entries.get(book['uuid'])
+            if entry is None or entry['publication_id'] != publication_id:
+                rows.append(self._get_row(
+                    book, publication_id, now, hash_file=False))
+        publication_ids = set(uploaded_books.values())
+        removed = [
+                (uuid,) for uuid, entry in entries.items()
+                if entry['publication_id'] not in publication_ids]
+        with self._lock, self._con:
+            self._con.executemany(self._insert_sql, rows)
+            self._con.executemany('DELETE FROM books WHERE uuid = ?', removed)
+            # the interrupted uploads whose file is not on the cloud anymore
+            # start again from the upload of the file
+            res = self._con.execute(
+                    'SELECT uuid, publication_id FROM uploads_in_progress')
+            self._con.executemany(
+                    'DELETE FROM uploads_in_progress WHERE uuid = ?',
+                    [(row['uuid'],) for row in res
+                     if row['publication_id'] not in publication_ids])
+            self._set_info('last_reconcile', now)
@@ -0,0 +1,442 @@
+"""books of the calibre library in memory. a book is a compact BookRecord
+and the books are found in a LibraryIndex in O(1) by book_id, uuid, full
+title, isbn, tag, author, series or status. the index is updated with each
+book that is added, removed or modified, instead of building lookups on the
+books dict."""
+
+
+import os
+import sys
+import logging
+import datetime
+from collections.abc import Mapping
+
+
+SECONDARY_KEYS = ('isbn', 'tag', 'author', 'series', 'status')
+
+
+def normalize_isbn(isbn):
+    """
+    :returns: isbn without hyphens and spaces, in upper case (for the X
+    of isbn-10). None if the isbn is empty
+
+    """
+    if not isbn:
+        return None
+    isbn = ''.join(isbn.split()).replace('-', '').upper()
+    return isbn or None
+
+
+# one tuple for each combination of names (e.g. the languages), shared by
+# the books
+_names_tuples = dict()
+
+
+def intern_names(names) -> tuple:
+    """
+    :names: list of names (authors, tags...), or None
+    :returns: tuple of the interned names. the books share one string per
+    name and one tuple per combination of names
+
+    """
+    if not names:
+        return ()
+    names = tuple(map(sys.intern, names))
+    return _names_tuples.setdefault(names, names)
+
+
+class BookRecord(Mapping):
+
+    """a book of the library, read like the dict of the book (see KEYS).
+    the values are stored in slots and the lists of names are tuples of
+    interned strings. the paths of the file and of the cover are built on
+    access from the library folder (shared by all the books), the folder
+    of the book, the file name and the format. issued is computed from
+    pubdate"""
+
+    KEYS = (
+            'title',
+            'full_title',
+            'authors',
+            'uuid',
+            'file_path',
+            'size',
+            'publishers',
+            'series_index',
+            'serie_name',
+            'tags',
+            'status',
+            'isbn',
+            'pubdate',
+            'issued',
+            'languages',
+            'cover_path',
+            'has_cover',
+            'last_modified',
+            'book_id',
+            )
+    _stored_keys = (
+            'title',
+            'full_title',
+            'authors',
+            'uuid',
+            'size',
+            'publishers',
+            'series_index',
+            'serie_name',
+            'tags',
+            'status',
+            'isbn',
+            'pubdate',
+            'languages',
+            'has_cover',
+            'last_modified',
+            'book_id',
+            )
+    _key_set = frozenset(KEYS)
+    _name_keys = frozenset(('authors', 'publishers', 'tags', 'languages'))
+    _derived_keys = frozenset(('file_path', 'cover_path', 'issued'))
+    __slots__ = _stored_keys + (
+            '_library_folder', '_folder', '_file_name', '_format')
+
+    def __init__(self, library_folder, folder, file_name, file_format,
+                 **values):
+        """
+        :library_folder: folder of the calibre library
+        :folder: folder of the book, relative to the library folder
+        :file_name: name of the file of the book, without extension
+        :file_format: format of the file (e.g. EPUB)
+        :values: the other values of KEYS, without the derived values
+        (paths and issued). the lists of names are interned
+
+        """
+        self._library_folder = sys.intern(library_folder)
+        self._folder = folder
+        self._file_name = file_name
+        self._format = sys.intern(file_format.lower())
+        self.title = values['title']
+        self.full_title = values['full_title']
+        self.authors = intern_names(values['authors'])
+        self.uuid = values['uuid']
+        self.size = values['size']
+        self.publishers = intern_names(values['publishers'])
+        self.series_index = values['series_index']
+        serie_name = values['serie_name']
+        self.serie_name = serie_name and sys.intern(serie_name)
+        self.tags = intern_names(values['tags'])
+        status = values['status']
+        self.status = None if status is None else intern_names(status)
+        self.isbn = values['isbn']
+        self.pubdate = sys.intern(values['pubdate'])
+        self.languages = intern_names(values['languages'])
+        self.has_cover = values['has_cover']
+        self.last_modified = values['last_modified']
+        self.book_id = values['book_id']
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+    @property
+    def file_path(self) -> str:
+        return os.path.join(
+                self._library_folder,
+                self._folder,
+                f'{self._file_name}.{self._format}',
+                )
+
+    @property
+    def cover_path(self) -> str:
+        return os.path.join(self._library_folder, self._folder, 'cover.jpg')
+
+    @property
+    def issued(self) -> int:
+        """timestamp of pubdate"""
+        return int(datetime.datetime.fromisoformat(self.pubdate).timestamp())
+
+    def __getitem__(self, key):
+        if key not in self._key_set:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._key_set or key in self._derived_keys:
+            raise KeyError(key)
+        if key in self._name_keys:
+            value = intern_names(value)
+        elif key == 'status':
+            value = intern_names(value) if value is not None else None
+        elif key in ('serie_name', 'pubdate') and value is not None:
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f'BookRecord({self.book_id}, {self.full_title!r})'
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+
+def get_deep_size(obj) -> int:
+    """memory (bytes) used by an object and all the objects it refers to
+    through containers, dicts, BookRecord and LibraryIndex. an object
+    referred to several times (e.g. an interned string) is counted once
+
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, BookRecord):
+            stack.extend(obj.__getstate__())
+        elif isinstance(obj, LibraryIndex):
+            stack.append(obj.__dict__)
+    return size
+
+
+def _get_index_values(book, key):
+    """values of a book in the index of key"""
+    if key == 'isbn':
+        isbn = normalize_isbn(book['isbn'])
+        return () if isbn is None else (isbn,)
+    elif key == 'tag':
+        return book['tags']
+    elif key == 'author':
+        return book['authors']
+    elif key == 'series':
+        serie_name = book['serie_name']
+        return () if serie_name is None else (serie_name,)
+    elif key == 'status':
+        return book['status'] or ()
+    raise KeyError(key)
+
+
+class LibraryIndex(object):
+
+    """books of the library with an index on each key. the book_id and the
+    uuid are unique. several books can have the same full title: titles
+    gives the book with the lowest book_id for each title, and find gives
+    all of them. the indexes of SECONDARY_KEYS are built by the first find
+    or count of their key, then kept up to date. the books must be
+    modified through the index (update, add_tag and remove_tag)"""
+
+    def __init__(self, books=()):
+        """
+        :books: iterable of books (BookRecord or dict)
+
+        """
+        self._by_id = dict()
+        self._by_uuid = dict()
+        self._titles = dict()
+        # books of the titles shared by several books (full_title: dict of
+        # book_id: book)
+        self._duplicates = dict()
+        self._secondary = dict()
+        for book in books:
+            self.add(book)
+
+    def __getstate__(self):
+        # the other indexes are rebuilt, which is faster than unpickling
+        return dict(books=list(self._by_id.values()))
+
+    def __setstate__(self, state):
+        self.__init__(state['books'])
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, book_id):
+        return book_id in self._by_id
+
+    @property
+    def titles(self) -> dict:
+        """dict of books (full_title: book), with one book per title. it
+        is updated by the index and must not be modified"""
+        return self._titles
+
+    def get(self, book_id, default=None):
+        return self._by_id.get(book_id, default)
+
+    def get_by_uuid(self, uuid, default=None):
+        return self._by_uuid.get(uuid, default)
+
+    def find(self, key, value) -> list:
+        """
+        :key: title or one of SECONDARY_KEYS
+        :value: full title, isbn, name of tag, author, series or status
+        :returns: list of the books with this value
+
+        """
+        if key == 'title':
+            if value in self._duplicates:
+                return list(self._duplicates[value].values())
+            book = self._titles.get(value)
+            return list() if book is None else [book]
+        if key == 'isbn':
+            value = normalize_isbn(value)
+        return list(self._get_secondary(key).get(value, dict()).values())
+
+    def count(self, key) -> dict:
+        """
+        :key: one of SECONDARY_KEYS
+        :returns: dict (value: number of books with this value)
+
+        """
+        return {
+                value: len(books)
+                for value, books in self._get_secondary(key).items()}
+
+    def duplicate_titles(self) -> dict:
+        """
+        :returns: dict (full_title: list of books) of the titles shared by
+        several books
+
+        """
+        return {
+                full_title: list(books.values())
+                for full_title, books in self._duplicates.items()}
+
+    def _get_secondary(self, key):
+        """index of key (value: dict of book_id: book), built if needed"""
+        secondary = self._secondary.get(key)
+        if secondary is None:
+            if key not in SECONDARY_KEYS:
+                raise KeyError(key)
+            secondary = dict()
+            for book_id, book in self._by_id.items():
+                for value in _get_index_values(book, key):
+                    secondary.setdefault(value, dict())[book_id] = book
+            self._secondary[key] = secondary
+        return secondary
+
+    def add(self, book):
+        """add a book, or replace the book with the same book_id"""
+        book_id = book['book_id']
+        if book_id in self._by_id:
+            self.discard(book_id)
+        other_book = self._by_uuid.get(book['uuid'])
+        if other_book is not None:
+            logging.warning(
+                    f"books {other_book['book_id']} and {book_id} have the "
+                    f"same uuid {book['uuid']}")
+        self._by_id[book_id] = book
+        self._by_uuid[book['uuid']] = book
+        full_title = book['full_title']
+        title_book = self._titles.setdefault(full_title, book)
+        if title_book is not book:
+            duplicates = self._duplicates.setdefault(
+                    full_title, {title_book['book_id']: title_book})
+            duplicates[book_id] = book
+            if book_id < title_book['book_id']:
+                self._titles[full_title] = book
+        for key, secondary in self._secondary.items():
+            for value in _get_index_values(book, key):
+                secondary.setdefault(value, dict())[book_id] = book
+
+    def discard(self, book_id):
+        """remove a book
+
+        :returns: the removed book, None if there was no book with this id
+
+        """
+        book = self._by_id.pop(book_id, None)
+        if book is None:
+            return None
+        if self._by_uuid.get(book['uuid']) is book:
+            del self._by_uuid[book['uuid']]
+        full_title = book['full_title']
+        duplicates = self._duplicates.get(full_title)
+        if duplicates is None:
+            del self._titles[full_title]
+        else:
+            del duplicates[book_id]
+            self._titles[full_title] = duplicates[min(duplicates)]
+            if len(duplicates) == 1:
+                del self._duplicates[full_title]
+        for key in self._secondary:
+            for value in _get_index_values(book, key):
+                self._remove_value(key, value, book_id)
+        return book
+
+    def _remove_value(self, key, value, book_id):
+        secondary = self._secondary.get(key)
+        if secondary is None:
+            return
+        books = secondary.get(value)
+        if books is not None:
+            books.pop(book_id, None)
+            if not books:
+                del secondary[value]
+
+    def update(self, book_id, **values):
+        """modify the values of a book and its place in the indexes
+
+        :values: new values of the book (e.g. last_modified)
+        :raises: KeyError if there is no book with this id
+
+        """
+        book = self._by_id[book_id]
+        indexed = {
+                'book_id', 'uuid', 'full_title', 'isbn', 'tags', 'authors',
+                'serie_name', 'status'}
+        if indexed.isdisjoint(values):
+            book.update(values)
+        else:
+            self.discard(book_id)
+            book.update(values)
+            self.add(book)
+
+    def add_tag(self, book_id, tag_name) -> bool:
+        """
+        :returns: False if the book already has the tag
+        :raises: KeyError if there is no book with this id
+
+        """
+        book = self._by_id[book_id]
+        if tag_name in book['tags']:
+            return False
+        book['tags'] = (*book['tags'], tag_name)
+        secondary = self._secondary.get('tag')
+        if secondary is not None:
+            secondary.setdefault(tag_name, dict())[book_id] = book
+        return True
+
+    def remove_tag(self, book_id, tag_name) -> bool:
+        """
+        :returns: False if the book does not have the tag
+        :raises: KeyError if there is no book with this id
+
+        """
+        book = self._by_id[book_id]
+        if tag_name not in book['tags']:
+            return False
+        book['tags'] = tuple(
+                name for name in book['tags'] if name != tag_name)
+        self._remove_value('tag', tag_name, book_id)
+        return True
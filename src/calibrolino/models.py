@@ -1,18 +1,37 @@
 #!/usr/bin/env python
 
 import os
+import asyncio
 import json
+import re
+import logging
+import pickle
 import sqlite3
 import sys
 import datetime
+import time
 from pathlib import Path
 import subprocess
+import tempfile
+import threading
+import functools
+from types import MappingProxyType
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 from pytolino.tolino_cloud import Client, PytolinoException
+from requests import RequestException
 import xdg_base_dirs
 
 
+from calibrolino.retry import RetryPolicy, RateLimiter
+from calibrolino.ledger import get_file_stat
+from calibrolino.progress import ProgressTracker
+from calibrolino.profiling import span
+from calibrolino.library import LibraryIndex, BookRecord
+
+
 class CalibrolinoException(Exception):
     pass
 
@@ -21,43 +40,211 @@ class TolinoCloudException(Exception):
     pass
 
 
+TAG_ADD = 'add'
+TAG_REMOVE = 'remove'
+
+
+class CalibreDBConnections(object):
+
+    """connections to the calibre db. each thread reads with its own read
+    only connection, writes go through short-lived connections. the
+    connection of a thread is closed when another thread opens a
+    connection after the end of the thread, or by release."""
+
+    def __init__(self, db_path, busy_timeout=5., read_from_copy=False):
+        """
+        :db_path: path to the calibre db
+        :busy_timeout: time in s to wait for a lock held by another process
+        (for example the calibre GUI) before failing
+        :read_from_copy: if True, reads are done on a consistent copy of the
+        db made with the backup api of sqlite (see update_copy)
+
+        """
+        self._db_path = db_path
+        self._busy_timeout = busy_timeout
+        self._read_from_copy = read_from_copy
+        self._copy_path = None
+        # copies replaced by update_copy, removed when no thread reads them
+        self._old_copies = list()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # read connections (thread: (connection, path))
+        self._readers = dict()
+        if read_from_copy:
+            self.update_copy()
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        """read only connection of the current thread. after update_copy,
+        the connection of the thread is reopened on the new copy"""
+        path = self._copy_path if self._read_from_copy else self._db_path
+        con, con_path = getattr(self._local, 'reader', (None, None))
+        if con is not None and con_path == path:
+            return con
+        thread = threading.current_thread()
+        with self._lock:
+            if con is not None:
+                con.close()
+                del self._readers[thread]
+            self._close_finished_readers()
+            con = self._connect(path, read_only=True)
+            self._readers[thread] = con, path
+            self._remove_unused_copies()
+        self._local.reader = con, path
+        return con
+
+    def release(self):
+        """close the read connection of the current thread"""
+        con, path = getattr(self._local, 'reader', (None, None))
+        if con is None:
+            return
+        with self._lock:
+            con.close()
+            del self._readers[threading.current_thread()]
+            self._remove_unused_copies()
+        self._local.reader = None, None
+
+    def _close_finished_readers(self):
+        finished_threads = [
+                thread for thread in self._readers if not thread.is_alive()]
+        for thread in finished_threads:
+            con, path = self._readers.pop(thread)
+            con.close()
+
+    @property
+    def read_from_copy(self) -> bool:
+        return self._read_from_copy
+
+    def _connect(self, path, read_only):
+        if read_only:
+            uri = f'{Path(path).as_uri()}?mode=ro'
+        else:
+            uri = f'{Path(path).as_uri()}?mode=rw'
+        con = sqlite3.connect(
+                uri,
+                uri=True,
+                timeout=self._busy_timeout,
+                check_same_thread=False,
+                )
+        con.row_factory = sqlite3.Row
+        return con
+
+    @contextmanager
+    def writer(self):
+        """short-lived connection to write in the db. the changes are
+        committed at the exit of the context (or rolled back if an
+        exception is raised)"""
+        con = self._connect(self._db_path, read_only=False)
+        # the triggers of calibre on the books table call this function,
+        # which is only defined inside calibre
+        con.create_function(
+                'title_sort', 1, lambda title: title, deterministic=True)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def update_copy(self):
+        """make a new copy of the db with the backup api. each thread reads
+        the new copy from its next use of reader: the connections that other
+        threads are reading from are not closed"""
+        fd, copy_path = tempfile.mkstemp(
+                prefix='calibrolino_', suffix='.db')
+        os.close(fd)
+        source = self._connect(self._db_path, read_only=True)
+        destination = sqlite3.connect(copy_path)
+        try:
+            source.backup(destination)
+        finally:
+            destination.close()
+            source.close()
+        with self._lock:
+            if self._copy_path is not None:
+                self._old_copies.append(self._copy_path)
+            self._copy_path = copy_path
+            self._remove_unused_copies()
+
+    def _remove_unused_copies(self):
+        used_paths = {path for con, path in self._readers.values()}
+        for path in list(self._old_copies):
+            if path not in used_paths:
+                _remove_file(path)
+                self._old_copies.remove(path)
+
+    def close(self):
+        """close all the connections and remove the copies"""
+        with self._lock:
+            for con, path in self._readers.values():
+                con.close()
+            self._readers = dict()
+            for path in self._old_copies + [self._copy_path]:
+                if path is not None:
+                    _remove_file(path)
+            self._old_copies = list()
+            self._copy_path = None
+        self._local = threading.local()
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 class CalibreDBReader(object):
 
     """prepare and upload the calibre library to the cloud"""
     _calibre_db_command = 'calibredb'
-    _calibre_db_table = [
-            'books',
-            'data',
-            'series',
-            'books_series_link',
-            'tags',
-            'books_tags_link',
-            'authors',
-            'books_authors_link',
-            'publishers',
-            'books_publishers_link',
-            'languages',
-            'books_languages_link',
-            'custom_columns',
-            ]
-
     _accepted_formats = {'EPUB'}
     _column_status_name = 'status'
+    _sql_chunk_size = 500
+    _calibre_db_chunk_size = 200
+    _snapshot_fn = 'library_snapshot.pickle'
+    _snapshot_version = 6
+
+    @property
+    def books(self) -> MappingProxyType:
+        """a read only dictionnory of books (keys are the titles). each book
+        is a BookRecord, read like a dict, with the metadata of the book and
+        the file path to the book. if several books have the same title,
+        the one with the lowest id is given (see index)"""
+        return MappingProxyType(self._index.titles)
 
     @property
-    def books(self) -> dict:
-        """a dictionnory of books (keys are the titles). each book dict
-        contains metadata of the books and file path to book"""
-        return self._books
+    def index(self) -> LibraryIndex:
+        """index of all the books by id, uuid, title, isbn, tag, author,
+        series and status"""
+        return self._index
 
-    def __init__(self):
+    def __init__(self, use_snapshot=True, busy_timeout=5.,
+                 read_from_copy=False):
         """
         finds the calibre db and connect to it
+
+        :use_snapshot: if True, the books are loaded from the snapshot
+        saved on the disk by the last session and only the changes made
+        in calibre since then are read
+        :busy_timeout: time in s to wait when calibre locks the db
+        :read_from_copy: read a consistent copy of the db instead of the db
+        itself (see CalibreDBConnections)
+
         """
 
-        self._get_calibre_db()
-        self._load_db()
-        self.read_db()
+        self._fingerprint = None
+        self._use_snapshot = use_snapshot
+        self._busy_timeout = busy_timeout
+        self._read_from_copy = read_from_copy
+        self._pending_tag_changes = list()
+        # tags of the books before the pending changes (book_id: tags)
+        self._tags_before_changes = dict()
+        with span('calibre.config'):
+            self._get_calibre_db()
+        with span('calibre.connect'):
+            self._load_db()
+        if not (use_snapshot and self._load_snapshot()):
+            self.read_db()
 
     def _get_calibre_db(self):
         """search in home calibre db
@@ -80,15 +267,19 @@ class CalibreDBReader(object):
                     'could not found the calibre db. is calibre installed?')
 
     def _load_db(self):
-        con = sqlite3.connect(self._db_path)
-        cur = con.cursor()
-        con.row_factory = sqlite3.Row
-
-        self._con = con
-        self._cur = cur
+        self._db = CalibreDBConnections(
+                self._db_path,
+                busy_timeout=self._busy_timeout,
+                read_from_copy=self._read_from_copy,
+                )
 
     def _close_db(self):
-        self._con.close()
+        self._db.close()
+
+    @property
+    def _con(self) -> sqlite3.Connection:
+        """read only connection of the current thread"""
+        return self._db.reader
 
     def _get_table(self, table_name):
         """load the book table from the calibre db
@@ -96,30 +287,144 @@ class CalibreDBReader(object):
 
         """
         sql = f'SELECT * from {table_name}'
-        res = self._con.execute(sql)
-        table = res.fetchall()
+        with span(f'calibre.table.{table_name}'):
+            res = self._con.execute(sql)
+            table = res.fetchall()
 
         return table
 
+    def _get_file_fingerprint(self):
+        """mtime and size of the db file and of its wal file"""
+        fingerprint = list()
+        for path in (self._db_path, f'{self._db_path}-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                fingerprint.append(None)
+            else:
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(fingerprint)
+
+    def _get_fingerprint(self):
+        """cheap summary of the state of the calibre db: the file
+        fingerprint and the data_version pragma, which changes when another
+        connection commits to the db"""
+        res = self._con.execute('PRAGMA data_version')
+        data_version = res.fetchone()[0]
+        return self._get_file_fingerprint() + (data_version,)
+
+    def _get_snapshot_path(self):
+        folder = os.path.join(xdg_base_dirs.xdg_cache_home(), 'calibrolino')
+        return os.path.join(folder, self._snapshot_fn)
+
+    @span('calibre.snapshot_save')
+    def _save_snapshot(self):
+        """save the books on the disk, to be loaded by the next session.
+        the snapshot is a header (version, db path and fingerprint) followed
+        by the books, so that the books of another version are never
+        unpickled. it is not saved while tag changes are not committed: the
+        next session would load tags that are not in the calibre db"""
+        if not self._use_snapshot or self._pending_tag_changes:
+            return
+        header = dict(
+                version=self._snapshot_version,
+                db_path=self._db_path,
+                file_fingerprint=self._fingerprint[:-1],
+                )
+        data = dict(
+                index=self._index,
+                book_versions=self._book_versions,
+                tags=self._tags,
+                )
+        path = self._get_snapshot_path()
+        tmp_path = f'{path}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as myfile:
+                pickle.dump(header, myfile, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(data, myfile, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    @span('calibre.snapshot_load')
+    def _load_snapshot(self) -> bool:
+        """load the books saved by the last session. if the calibre db
+        changed since then, the changes are read with refresh
+
+        :returns: False if there is no valid snapshot for this db
+
+        """
+        # an old or corrupted snapshot can raise about anything while it is
+        # unpickled, it is then ignored
+        try:
+            with open(self._get_snapshot_path(), 'rb') as myfile:
+                header = pickle.load(myfile)
+                if not isinstance(header, dict):
+                    return False
+                if header.get('version') != self._snapshot_version:
+                    return False
+                if header.get('db_path') != self._db_path:
+                    return False
+                data = pickle.load(myfile)
+            index = data['index']
+            book_versions = data['book_versions']
+            tags = data['tags']
+        except Exception as e:
+            logging.debug(f'the snapshot of the library is ignored: {e!r}')
+            return False
+        if not isinstance(index, LibraryIndex):
+            return False
+
+        self._index = index
+        self._book_versions = book_versions
+        self._tags = tags
+        self._find_status_column()
+        fingerprint = self._get_fingerprint()
+        if header['file_fingerprint'] == fingerprint[:-1]:
+            self._fingerprint = fingerprint
+        else:
+            self.refresh()
+        return True
+
     def add_book(self, fp: Path, **options):
         """add a book to the library
 
         :fp: path to book file
         :options: accepted options are:
             authors, cover, isbn, language, series, series-index, tags, title
+        :returns: id of the new book, None if calibre did not add it
 
         """
-        self._close_db()
-        cmd = 'add'
-        arg = fp.as_posix()
+        book_ids = self.add_books([fp], **options)
+        return book_ids[0] if book_ids else None
+
+    def add_books(self, fps, **options) -> list:
+        """add many books to the library with one calibredb call per
+        _calibre_db_chunk_size files. the library is refreshed once at the
+        end
+
+        :fps: list of paths to book files
+        :options: options given to all the books, see add_book
+        :returns: list of the ids of the new books
+
+        """
+        fps = list(fps)
         options_list = list()
         for option, value in options.items():
-            option_i = [f'--{option}', f'{value}']
-            options_list = options_list + option_i
-        full_cmd = [self._calibre_db_command, cmd] + options_list + [arg]
-        subprocess.run(full_cmd)
-        self._load_db()
-        self.read_db()
+            options_list += [f'--{option}', f'{value}']
+        book_ids = list()
+        self._close_db()
+        try:
+            for i in range(0, len(fps), self._calibre_db_chunk_size):
+                chunk = fps[i:i + self._calibre_db_chunk_size]
+                args = [fp.as_posix() for fp in chunk]
+                output = self._run_calibre_db('add', options_list + args)
+                book_ids += _parse_added_book_ids(output)
+        finally:
+            self._load_db()
+            self.refresh()
+        return book_ids
 
     def remove_book(self, book_title):
         """delete a book from the library
@@ -127,17 +432,49 @@ class CalibreDBReader(object):
         :book_id:
 
         """
+        self.remove_books([book_title])
+
+    def remove_books(self, book_titles):
+        """delete many books from the library with one calibredb call per
+        _calibre_db_chunk_size books. the library is refreshed once at the
+        end
+
+        :book_titles: list of full titles of the books
+
+        """
+        book_ids = list()
+        for book_title in book_titles:
+            if book_title not in self.books:
+                raise CalibrolinoException(
+                        f'no book in the library with this title: '
+                        f'{book_title}')
+            book_ids.append(str(self.books[book_title]['book_id']))
         self._close_db()
-        if book_title not in self._books:
+        try:
+            for i in range(0, len(book_ids), self._calibre_db_chunk_size):
+                chunk = book_ids[i:i + self._calibre_db_chunk_size]
+                self._run_calibre_db('remove', [','.join(chunk)])
+        finally:
+            self._load_db()
+            self.refresh()
+
+    def _run_calibre_db(self, cmd, args):
+        """run a command of calibredb
+
+        :returns: standard output of calibredb
+
+        """
+        full_cmd = [self._calibre_db_command, cmd] + args
+        try:
+            result = subprocess.run(full_cmd, capture_output=True, text=True)
+        except OSError as e:
+            raise CalibrolinoException(f'could not run calibredb: {e}')
+        if result.returncode != 0:
             raise CalibrolinoException(
-                    'no book in the library with this title')
-        book_id = str(self._books[book_title]['book_id'])
-        cmd = 'remove'
-        arg = book_id
-        full_cmd = [self._calibre_db_command, cmd, arg]
-        subprocess.run(full_cmd)
-        self._load_db()
-        self.read_db()
+                    f'calibredb {cmd} failed: {result.stderr.strip()}')
+        if result.stderr:
+            logging.warning(result.stderr.strip())
+        return result.stdout
 
     def add_tag(self, book: dict, tag_name: str):
         """add tag to a book. change will not be saved before a commit
@@ -146,26 +483,9 @@ class CalibreDBReader(object):
         :tag_name:
 
         """
-        if tag_name in self.books[book['title']]['tags']:
+        if tag_name in self._get_book(book['book_id'])['tags']:
             raise CalibrolinoException('tag is already on this book')
-        book_id = book['book_id']
-        if tag_name not in self._tags:
-            tag_id = self._create_tag(tag_name)
-        tag_id = self._tags[tag_name]
-        table_name = 'books_tags_link'
-        sql = f"""
-        INSERT INTO {table_name} (book, tag)
-        VALUES ({book_id}, {tag_id});
-        """
-        res = self._con.execute(sql)
-        book = self._books[book['title']]
-        book['tags'].append(tag_name)
-
-    def commit(self):
-        """save changes to the db
-
-        """
-        self._con.commit()
+        self._queue_tag_changes([(book['book_id'], TAG_ADD, tag_name)])
 
     def rm_tag(self, book, tag_name):
         """rm tag from a book. change will not be saved before a commit
@@ -174,179 +494,434 @@ class CalibreDBReader(object):
         :tag_name:
         """
 
-        if tag_name not in self.books[book['title']]['tags']:
+        if tag_name not in self._get_book(book['book_id'])['tags']:
             raise CalibrolinoException('no such tag in this book')
-        book_id = book['book_id']
-        tag_id = self._tags[tag_name]
-        table_name = 'books_tags_link'
-        sql = f"""
-        DELETE FROM {table_name}
-        WHERE book={book_id} AND tag={tag_id};
+        self._queue_tag_changes([(book['book_id'], TAG_REMOVE, tag_name)])
+
+    def apply_tag_changes(self, changes) -> int:
+        """add and remove tags of many books in one transaction. the
+        missing tags are created and the tags that are not used anymore
+        are deleted. the books are updated in memory without reading the
+        db again
+
+        :changes: iterable of (book_id, TAG_ADD or TAG_REMOVE, tag_name).
+        adding a tag that the book already has or removing a tag that it
+        does not have is ignored
+        :returns: number of changes applied
+
         """
-        res = self._con.execute(sql)
+        count = self._queue_tag_changes(changes)
+        self.commit()
+        return count
 
-        table_name = 'books_tags_link'
-        sql = f"""
-        SELECT * FROM {table_name}
-        WHERE tag={tag_id};
-        """
-        res = self._con.execute(sql)
-        if res.fetchone() is None:
-            table_name = 'tags'
-            sql = f"""
-            DELETE FROM {table_name}
-            WHERE name='{tag_name}';
-            """
-            res = self._con.execute(sql)
-            del self._tags[tag_name]
-        book = self._books[book['title']]
-        book['tags'].remove(tag_name)
+    def commit(self):
+        """save changes to the db. if they cannot be written, the books
+        in memory are restored and the changes are discarded
 
-    def _create_tag(self, tag_name):
-        table_name = 'tags'
-        sql = f"""
-        INSERT INTO {table_name} (name)
-        VALUES ('{tag_name}');
         """
-        res = self._con.execute(sql)
-        self._get_all_tables()
-        self._create_tags_dict()
+        if self._pending_tag_changes:
+            try:
+                self._write_tag_changes(self._pending_tag_changes)
+            except sqlite3.Error as e:
+                for book_id, tags in self._tags_before_changes.items():
+                    if book_id in self._index:
+                        self._index.update(book_id, tags=tags)
+                raise CalibrolinoException(
+                        f'could not save the tags in the calibre db: {e}')
+            finally:
+                self._pending_tag_changes = list()
+                self._tags_before_changes = dict()
+        self._save_snapshot()
+
+    def _get_book(self, book_id):
+        book = self._index.get(book_id)
+        if book is None:
+            raise CalibrolinoException(
+                    f'no book in the library with id {book_id}')
+        return book
+
+    def _queue_tag_changes(self, changes):
+        """apply the changes to the books in memory and keep them for the
+        next commit
 
-    def _get_all_tables(self):
+        :returns: number of changes that modified a book
 
-        self._tables = dict()
+        """
+        changes = list(changes)
+        for book_id, action, tag_name in changes:
+            if action not in (TAG_ADD, TAG_REMOVE):
+                raise CalibrolinoException(f'unknown tag action: {action}')
+            self._get_book(book_id)
+        count = 0
+        for book_id, action, tag_name in changes:
+            self._tags_before_changes.setdefault(
+                    book_id, self._index.get(book_id)['tags'])
+            if action == TAG_ADD:
+                changed = self._index.add_tag(book_id, tag_name)
+            else:
+                changed = self._index.remove_tag(book_id, tag_name)
+            if not changed:
+                continue
+            self._pending_tag_changes.append((book_id, action, tag_name))
+            count += 1
+        return count
+
+    def _reapply_tag_changes(self, book_ids):
+        """apply again the pending tag changes to books read again from the
+        db (see refresh), so that they are not lost before the commit. the
+        tags read from the db are the tags restored if the commit fails.
+        the changes of the books removed from calibre are dropped
+
+        :book_ids: ids of the books read again or removed
 
-        for table_name in self._calibre_db_table:
-            self._tables[table_name] = self._get_table(table_name)
+        """
+        book_ids = set(book_ids)
+        pending = list()
+        dropped = set()
+        reapplied = set()
+        for book_id, action, tag_name in self._pending_tag_changes:
+            if book_id not in book_ids:
+                pending.append((book_id, action, tag_name))
+                continue
+            book = self._index.get(book_id)
+            if book is None:
+                self._tags_before_changes.pop(book_id, None)
+                dropped.add(book_id)
+                continue
+            if book_id not in reapplied:
+                reapplied.add(book_id)
+                self._tags_before_changes[book_id] = book['tags']
+            if action == TAG_ADD:
+                self._index.add_tag(book_id, tag_name)
+            else:
+                self._index.remove_tag(book_id, tag_name)
+            pending.append((book_id, action, tag_name))
+        if dropped:
+            logging.warning(
+                    f'{len(dropped)} books with tag changes not committed '
+                    'were removed from calibre, their changes are dropped')
+        self._pending_tag_changes = pending
+
+    @span('calibre.write_tags')
+    def _write_tag_changes(self, changes):
+        """write the tag changes in one transaction. last_modified of the
+        books is updated, like calibre does, so that the changes are seen
+        by the sync
+
+        """
+        net_changes = dict()
+        for book_id, action, tag_name in changes:
+            key = (book_id, tag_name)
+            if key in net_changes:
+                del net_changes[key]
+            else:
+                net_changes[key] = action
+        added = [key for key, action in net_changes.items()
+                 if action == TAG_ADD]
+        removed = [key for key, action in net_changes.items()
+                   if action == TAG_REMOVE]
+        tag_names = list({tag_name for book_id, tag_name in net_changes})
+        book_ids = {book_id for book_id, tag_name in net_changes}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        last_modified = now.isoformat(sep=' ')
+        tags = dict()
+
+        with self._db.writer() as con:
+            con.executemany(
+                    'INSERT OR IGNORE INTO tags (name) VALUES (?)',
+                    {(tag_name,) for book_id, tag_name in added})
+            con.executemany("""
+            INSERT OR IGNORE INTO books_tags_link (book, tag)
+            SELECT ?, id FROM tags WHERE name = ?
+            """, added)
+            con.executemany("""
+            DELETE FROM books_tags_link
+            WHERE book = ? AND tag = (SELECT id FROM tags WHERE name = ?)
+            """, removed)
+            con.executemany("""
+            DELETE FROM tags
+            WHERE name = ? AND NOT EXISTS (
+                SELECT 1 FROM books_tags_link WHERE tag = tags.id)
+            """, {(tag_name,) for book_id, tag_name in removed})
+            con.executemany(
+                    'UPDATE books SET last_modified = ? WHERE id = ?',
+                    [(last_modified, book_id) for book_id in book_ids])
+            for i in range(0, len(tag_names), self._sql_chunk_size):
+                chunk = tag_names[i:i + self._sql_chunk_size]
+                placeholders = ', '.join('?' * len(chunk))
+                res = con.execute(
+                        f'SELECT id, name FROM tags '
+                        f'WHERE name IN ({placeholders})', chunk)
+                tags.update((row['name'], row['id']) for row in res)
+
+        for tag_name in tag_names:
+            self._tags.pop(tag_name, None)
+        self._tags.update(tags)
+        for book_id in book_ids:
+            self._index.update(book_id, last_modified=last_modified)
+            self._book_versions[book_id] = last_modified
+
+    def _find_status_column(self):
+        """look for the optional status custom column"""
         try:
-            table_name = self._add_custom_column_table(self._column_status_name)
+            table_name = self._get_custom_column_table(
+                    self._column_status_name)
         except CalibrolinoException:
             self._status_is_defined = False
         else:
             self._status_is_defined = True
             self._status_table_name = table_name
 
-    def _add_custom_column_table(self, column_name):
+    def _get_custom_column_table(self, column_name):
 
-        custom_column_id = None
-        for custom_column in self._tables['custom_columns']:
-            if custom_column['name'] == column_name:
-                custom_column_id = custom_column['id']
-        if custom_column_id is None:
+        sql = 'SELECT id FROM custom_columns WHERE name = ?'
+        row = self._con.execute(sql, (column_name,)).fetchone()
+        if row is None:
             raise CalibrolinoException
-        table_name = f'custom_column_{custom_column_id}'
-        table_names = table_name, f'books_{table_name}_link'
-        for table_name in table_names:
-            self._tables[table_name] = self._get_table(table_name)
+        table_name = f'custom_column_{row["id"]}'
         return table_name
 
     def _create_tags_dict(self):
         self._tags = dict()
-        metadata_tables = self._tables['tags']
+        metadata_tables = self._get_table('tags')
         for row in metadata_tables:
             self._tags[row['name']] = row['id']
 
+    def _get_books_sql(self):
+        """build the query that gives one row per book with an accepted
+        format, with the metadata of the link tables concatenated in one
+        column (see _split_names). the names keep the order of the links,
+        like calibre (e.g. the first author is the main author): they are
+        sorted in a subquery, since sqlite has no order by in aggregates"""
+
+        def names_array(table, column, link_column, order='link.id'):
+            return f"""(
+                SELECT group_concat(name, char(31)) FROM (
+                    SELECT {table}.{column} AS name
+                    FROM books_{table}_link AS link
+                    JOIN {table} ON {table}.id = link.{link_column}
+                    WHERE link.book = books.id
+                    ORDER BY {order}))"""
+
+        formats = ', '.join(f"'{fmt}'" for fmt in self._accepted_formats)
+        if self._status_is_defined:
+            status = names_array(self._status_table_name, 'value', 'value')
+        else:
+            status = 'NULL'
+        sql = f"""
+        SELECT
+            books.id AS book_id,
+            books.title AS title,
+            books.uuid AS uuid,
+            books.path AS path,
+            books.series_index AS series_index,
+            books.isbn AS isbn,
+            books.pubdate AS pubdate,
+            books.has_cover AS has_cover,
+            books.last_modified AS last_modified,
+            data.name AS file_name,
+            data.format AS format,
+            data.uncompressed_size AS size,
+            (
+                SELECT series.name
+                FROM books_series_link
+                JOIN series ON series.id = books_series_link.series
+                WHERE books_series_link.book = books.id
+                LIMIT 1) AS serie_name,
+            {names_array('authors', 'name', 'author')} AS authors,
+            {names_array('publishers', 'name', 'publisher')} AS publishers,
+            {names_array('tags', 'name', 'tag')} AS tags,
+            {names_array(
+                'languages', 'lang_code', 'lang_code',
+                'link.item_order, link.id')} AS languages,
+            {status} AS status
+        FROM books
+        JOIN data ON data.id = (
+            SELECT max(id) FROM data
+            WHERE data.book = books.id AND data.format IN ({formats}))
+        """
+        return sql
+
+    def _iter_book_rows(self, book_ids=None):
+        """stream the rows of the books query
+
+        :book_ids: if not None, only these books are read
+
+        """
+        sql = self._get_books_sql()
+        if book_ids is None:
+            yield from self._con.execute(sql)
+            return
+
+        book_ids = list(book_ids)
+        for start in range(0, len(book_ids), self._sql_chunk_size):
+            chunk = book_ids[start:start + self._sql_chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            sql_chunk = f'{sql} WHERE books.id IN ({placeholders})'
+            yield from self._con.execute(sql_chunk, chunk)
+
+    @span('calibre.books_dict')
     def _create_books_dict(self):
 
-        files_data = {row['book']: row for row in self._tables['data']}
-
-        data_names = dict()
-        metadata = dict()
-        datas = [
-                ('series', 'name', 'series'),
-                ('tags', 'name', 'tag'),
-                ('authors', 'name', 'author'),
-                ('publishers', 'name', 'publisher'),
-                ('languages', 'lang_code', 'lang_code'),
-                ]
-        if self._status_is_defined:
-            datas.append(
-                    (self._status_table_name, 'value', 'value')
+        self._index = LibraryIndex()
+        self._add_books(self._iter_book_rows())
+
+    def _add_books(self, book_rows):
+        """create the books from the rows of the books query and add them
+        to the index"""
+
+        for book_row in book_rows:
+            title = book_row['title']
+            serie_name = book_row['serie_name']
+            series_index = book_row['series_index']
+            if serie_name is not None:
+                full_title = get_serie_title(title, series_index, serie_name)
+            else:
+                full_title = title
+            status = book_row['status']
+            if status is not None:
+                status = _split_names(status)
+
+            book = BookRecord(
+                    self._db_folder,
+                    book_row['path'],
+                    book_row['file_name'],
+                    book_row['format'],
+                    title=title,
+                    full_title=full_title,
+                    authors=_split_names(book_row['authors']),
+                    uuid=book_row['uuid'],
+                    size=book_row['size'],
+                    publishers=_split_names(book_row['publishers']),
+                    series_index=series_index,
+                    serie_name=serie_name,
+                    tags=_split_names(book_row['tags']),
+                    status=status,
+                    isbn=book_row['isbn'],
+                    pubdate=book_row['pubdate'],
+                    languages=_split_names(book_row['languages']),
+                    has_cover=book_row['has_cover'],
+                    last_modified=book_row['last_modified'],
+                    book_id=book_row['book_id'],
                     )
-        for data, column_name0, column_name in datas:
-            data_names[data] = dict()
-            for row in self._tables[data]:
-                data_names[data][row['id']] = row[column_name0]
-            metadata[data] = dict()
-            table_link_name = f'books_{data}_link'
-            for row in self._tables[table_link_name]:
-                book_id = row['book']
-                data_id = row[column_name]
-                metadata_value = data_names[data][data_id]
-                if book_id not in metadata[data]:
-                    metadata[data][book_id] = [metadata_value]
-                else:
-                    metadata[data][book_id].append(metadata_value)
-
-        self._books = dict()
-
-        for book_row in self._tables['books']:
-            book_id = book_row['id']
-            file_data = files_data[book_id]
-            book_format = file_data['format']
-            if book_format in self._accepted_formats:
-                file_path=self._get_file_path(book_row, file_data)
-                title = book_row['title']
-                serie_name=metadata['series'].get(book_id)
-                series_index=book_row['series_index']
-                if serie_name is not None:
-                    serie_name = serie_name[0]
-                    full_title = get_serie_title(title, series_index, serie_name)
-                else:
-                    full_title = title
-                if self._status_is_defined:
-                    status = metadata[self._status_table_name].get(book_id)
-                else:
-                    status = None
-                cover_path = self._get_cover_path(book_row, file_data)
-
-                issued_datetime = datetime.datetime.fromisoformat(book_row['pubdate'])
-                issued_timestamps = int(issued_datetime.timestamp())
-
-                book = dict(
-                        title=title,
-                        full_title=full_title,
-                        authors=metadata['authors'].get(book_id, []),
-                        uuid=book_row['uuid'],
-                        file_path=file_path,
-                        publishers=metadata['publishers'].get(book_id, []),
-                        series_index=series_index,
-                        serie_name=serie_name,
-                        tags=metadata['tags'].get(book_id, []),
-                        status=status,
-                        isbn=book_row['isbn'],
-                        pubdate=book_row['pubdate'],
-                        issued=issued_timestamps,
-                        languages=metadata['languages'].get(book_id, []),
-                        cover_path=cover_path,
-                        has_cover=book_row['has_cover'],
-                        last_modified=book_row['last_modified'],
-                        book_id=book_id,
-                        )
-                self._books[full_title] = book
-
-    def _get_file_path(self, book, data):
-        sub_folder = book['path']
-        filename = f"{data['name']}.{data['format'].lower()}"
-        path = os.path.join(self._db_folder, sub_folder, filename)
-        return path
-
-    def _get_cover_path(self, book, data):
-        sub_folder = book['path']
-        filename = 'cover.jpg'
-        path = os.path.join(self._db_folder, sub_folder, filename)
-        return path
+            self._index.add(book)
+
+    def _discard_book(self, book_id):
+        """remove a book from the index"""
+        self._index.discard(book_id)
+
+    def _warn_duplicate_titles(self):
+        duplicates = self._index.duplicate_titles()
+        if duplicates:
+            logging.warning(
+                    f'{len(duplicates)} titles are shared by several books, '
+                    'only the book with the lowest id of each title is '
+                    f"synced: {', '.join(list(duplicates)[:5])}")
+
+    def _get_book_versions(self):
+        """last modification time of every book in the calibre db"""
+        sql = 'SELECT id, last_modified FROM books'
+        with span('calibre.table.books'):
+            res = self._con.execute(sql)
+            versions = {row['id']: row['last_modified'] for row in res}
+        return versions
 
+    @span('calibre.read_db')
     def read_db(self):
         """
         load the calibre db and create a list of the books with metadata
 
         """
 
-        self._get_all_tables()
+        fingerprint = self._get_fingerprint()
+        self._find_status_column()
         self._create_books_dict()
+        self._reapply_tag_changes(
+                book_id for book_id, _, _ in self._pending_tag_changes)
+        self._warn_duplicate_titles()
+        self._create_tags_dict()
+        self._book_versions = self._get_book_versions()
+        self._fingerprint = fingerprint
+        self._save_snapshot()
+
+    @span('calibre.refresh')
+    def refresh(self) -> bool:
+        """
+        update the list of books with the changes made in the calibre db
+        since the last load. only the books that were added, removed or
+        modified (according to their last_modified) are read again.
+
+        :returns: True if the library changed
+
+        """
+        fingerprint = self._get_fingerprint()
+        if fingerprint == self._fingerprint:
+            return False
+        if self._db.read_from_copy:
+            self._db.update_copy()
+
+        versions = self._get_book_versions()
+        removed = self._book_versions.keys() - versions.keys()
+        changed = [
+                book_id for book_id, last_modified in versions.items()
+                if self._book_versions.get(book_id) != last_modified]
+        for book_id in removed:
+            self._discard_book(book_id)
+        for book_id in changed:
+            self._discard_book(book_id)
+        if changed:
+            self._find_status_column()
+            with span('calibre.books_dict'):
+                self._add_books(self._iter_book_rows(changed))
+            self._warn_duplicate_titles()
+        if self._pending_tag_changes:
+            self._reapply_tag_changes(removed | set(changed))
         self._create_tags_dict()
 
+        self._book_versions = versions
+        self._fingerprint = fingerprint
+        self._save_snapshot()
+        return bool(removed or changed)
+
+
+def _parse_added_book_ids(output):
+    """ids of the books added by calibredb add, found in its output
+    (Added book ids: 1, 2, 3)"""
+    book_ids = list()
+    for match in re.finditer(r'Added book ids: ([\d, ]+)', output):
+        book_ids += [int(i) for i in match.group(1).split(',') if i.strip()]
+    return book_ids
+
+
+def _split_names(value):
+    """split the names concatenated by group_concat in the books query"""
+    if value is None:
+        return []
+    return value.split('\x1f')
+
+
+def get_cloud_metadata(book):
+    """metadata of a book in the format of pytolino.Client.upload_metadata
+
+    """
+    language = book['languages'][0] if book['languages'] else ''
+    metadata = dict(
+            title=book['full_title'],
+            isbn=book['isbn'],
+            language=language,
+            publisher=', '.join(book['publishers']),
+            issued=book['issued'],
+            author=', '.join(book['authors']),
+            )
+    return metadata
+
+
+def _get_upload_names(book):
+    """titles that the cloud may give to a book just uploaded: its titles
+    and the name of its file, without the extension"""
+    file_name = os.path.splitext(os.path.basename(book['file_path']))[0]
+    return frozenset((book['full_title'], book['title'], file_name))
+
 
 def get_serie_title(title, serie_index, serie_name):
     new_title = f'{serie_name}: {serie_index} - {title}'
@@ -357,74 +932,468 @@ class TolinoCloud(object):
 
     """Docstring for TolinoCloud. """
 
-    def __init__(self, partner, username, password):
+    def __init__(self, partner, username, password, inventory_ttl=300.,
+                 retry_policy=None, rate_limiter=None):
         """
         create instance of pytolino.Client
         :partner: str: address of tolino cloud partner
         :username: str
         :password: str
+        :inventory_ttl: time in s during which the inventory downloaded from
+        the cloud is reused
+        :retry_policy: RetryPolicy used for the requests to the cloud.
+        default is RetryPolicy()
+        :rate_limiter: RateLimiter in front of all the requests to the
+        cloud. default is RateLimiter()
         """
 
         self._password = password
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+        self._retry_policy = retry_policy
+        self._rate_limiter = rate_limiter
+        self._inventory_ttl = inventory_ttl
+        self._inventory_lock = threading.Lock()
+        self._uploaded_books = None
+        # ids of all the books of the inventory (several books can have
+        # the same title) and ids of the books uploaded by this instance
+        self._publication_ids = set()
+        self._own_uploads = set()
+        # names (see _get_upload_names) of the books being uploaded
+        self._uploading = list()
+        self._inventory_time = 0.
+        # changes (uploaded, deleted) made while inventories are downloaded,
+        # they are applied to the downloaded inventories
+        self._downloads = 0
+        self._inventory_changes = list()
+        self._session_lock = threading.Lock()
+        self._session = 0
+        self._login_count = 0
+        self._login_time = 0.
         try:
             self._client = Client(server_name=partner, username=username)
         except PytolinoException as e:
             raise TolinoCloudException(str(e))
 
+    @property
+    def client(self) -> Client:
+        """pytolino Client that sends the requests. use request to send
+        them with the session, retry policy and rate limiter of this
+        instance"""
+        return self._client
+
+    @property
+    def login_stats(self) -> dict:
+        """number of logins done with this instance and total time (s)
+        spent in them"""
+        return dict(count=self._login_count, time=self._login_time)
+
+    def _session_is_valid(self):
+        if not self._session:
+            return False
+        try:
+            self._client.raise_for_access_expiration()
+        except PytolinoException:
+            return False
+        else:
+            return True
+
+    def _login(self, rejected_session=None):
+        """login only if there is no session yet, if the access token
+        expired or if the server rejected the current session
+
+        :rejected_session: session that was used for a failed request
+        :returns: current session
+
+        """
+        with self._session_lock:
+            rejected = rejected_session == self._session
+            if rejected or not self._session_is_valid():
+                start = time.perf_counter()
+                with span('cloud.login'):
+                    self._client.login(self._password)
+                duration = time.perf_counter() - start
+                self._login_time += duration
+                self._login_count += 1
+                logging.info(
+                        f'login {self._login_count} took {duration:.2f}s')
+                self._session += 1
+            return self._session
+
+    def _call(self, method, *args, retry_policy=None, **kwargs):
+        """call a method of the client with a valid session, after waiting
+        for the rate limiter. a failed request is retried according to the
+        retry policy, the first retry is done with a new session
+
+        :retry_policy: RetryPolicy of this call instead of the one of the
+        instance
+
+        """
+        if retry_policy is None:
+            retry_policy = self._retry_policy
+        session = None
+        rejected_session = None
+
+        @functools.wraps(method)
+        def attempt():
+            nonlocal session
+            session = self._login(rejected_session)
+            self._rate_limiter.acquire()
+            try:
+                return method(*args, **kwargs)
+            except RequestException as e:
+                raise PytolinoException(str(e)) from e
+
+        def on_error(error, retry):
+            nonlocal rejected_session
+            rejected_session = session if retry == 0 else None
+
+        return retry_policy.call(
+                attempt,
+                exceptions=(PytolinoException,),
+                on_error=on_error,
+                )
+
+    def request(self, method, *args, **kwargs):
+        """send a request with a method of the client (see _call)
+
+        :method: method of client, e.g. client.add_cover
+        :returns: result of the method
+        :raises: CalibrolinoException if the request failed
+
+        """
+        try:
+            return self._call(method, *args, **kwargs)
+        except PytolinoException as e:
+            raise CalibrolinoException(str(e))
+
+    def upload_file(self, book):
+        """upload the file of a book, without its collections, cover and
+        metadata. the upload is not idempotent: a failed request may still
+        have created the book on the cloud. before a retry, the inventory is
+        downloaded: a book with the title or the file name of the book, that
+        was not in the cached inventory before the first attempt and that is
+        not claimed by another upload, is the book of the failed request. it
+        is not uploaded again
+
+        :returns: id of the book on the cloud
+        :raises: CalibrolinoException if the upload failed or if the book of
+        a failed request cannot be identified
+
+        """
+        names = _get_upload_names(book)
+        with self._inventory_lock:
+            if self._uploaded_books is None:
+                known_ids = None
+            else:
+                known_ids = set(self._publication_ids)
+            self._uploading.append(names)
+        failed = False
+
+        def upload():
+            if failed:
+                book_id = self._find_lost_upload(book, names, known_ids)
+                if book_id is not None:
+                    return book_id
+            book_id = self._call(
+                    self._client.upload,
+                    book['file_path'],
+                    retry_policy=RetryPolicy(max_retries=0),
+                    )
+            with self._inventory_lock:
+                self._own_uploads.add(book_id)
+            return book_id
+
+        def on_error(error, retry):
+            nonlocal failed
+            failed = True
+
+        try:
+            return self._retry_policy.call(
+                    upload,
+                    exceptions=(PytolinoException,),
+                    on_error=on_error,
+                    )
+        except PytolinoException as e:
+            raise CalibrolinoException(str(e))
+        finally:
+            with self._inventory_lock:
+                self._uploading.remove(names)
+
+    def _find_lost_upload(self, book, names, known_ids):
+        """look in the inventory for a book created by a failed upload of
+        book (see upload_file). the book found is claimed with the lock of
+        the inventory, so that no other upload can take it
+
+        :names: names of the book (see _get_upload_names)
+        :known_ids: ids of the cached inventory before the first attempt,
+        None if there was no cached inventory
+        :returns: id of the book on the cloud, None if the failed upload did
+        not create it
+        :raises: CalibrolinoException if a book with these names was created
+        but it cannot be known whether it is the book of the failed upload
+
+        """
+        inventory = self._call(self._client.get_inventory)
+        with self._inventory_lock:
+            new_ids = [
+                    item['publicationId'] for item in inventory
+                    if item['epubMetaData']['title'] in names
+                    and item['publicationId'] not in self._own_uploads
+                    and (known_ids is None
+                         or item['publicationId'] not in known_ids)]
+            if not new_ids:
+                return None
+            # the upload of this book is in _uploading
+            other_uploads = sum(
+                    1 for other in self._uploading if other & names) - 1
+            if known_ids is None or len(new_ids) > 1 or other_uploads:
+                raise CalibrolinoException(
+                        f'could not know if {book["full_title"]} was '
+                        'uploaded by a failed request')
+            book_id = new_ids[0]
+            self._own_uploads.add(book_id)
+        logging.info(
+                f'{book["full_title"]} was uploaded by a failed request')
+        return book_id
+
     def get_uploaded_books(self):
-        """connect to the cloud and get the books that where already uploaded
+        """connect to the cloud and get the books that where already uploaded.
+        the inventory is downloaded again only if it is older than
+        inventory_ttl or if it was invalidated
         :returns: dict of uploaded books (full_title: books_id)
 
         """
+        with self._inventory_lock:
+            age = time.monotonic() - self._inventory_time
+            if self._uploaded_books is not None and age < self._inventory_ttl:
+                return dict(self._uploaded_books)
         try:
-            self._client.login(self._password)
+            self._login()
         except PytolinoException as e:
             raise CalibrolinoException(str(e))
-        else:
+        with self._inventory_lock:
+            self._downloads += 1
+            first_change = len(self._inventory_changes)
+        try:
             try:
-                inventory = self._client.get_inventory()
+                with span('cloud.inventory'):
+                    inventory = self._call(self._client.get_inventory)
                 uploaded_books = dict()
                 for book in inventory:
                     full_title = book['epubMetaData']['title']
                     book_id = book['publicationId']
                     uploaded_books[full_title] = book_id
-                return uploaded_books
             except PytolinoException as e:
                 raise TolinoCloudException(str(e))
+            with self._inventory_lock:
+                self._uploaded_books = uploaded_books
+                self._publication_ids = {
+                        book['publicationId'] for book in inventory}
+                self._inventory_time = time.monotonic()
+                # the server may have answered before the end of uploads or
+                # deletions of other threads
+                for uploaded, deleted in (
+                        self._inventory_changes[first_change:]):
+                    self._apply_change(uploaded, deleted)
+                return dict(self._uploaded_books)
+        finally:
+            with self._inventory_lock:
+                self._downloads -= 1
+                if not self._downloads:
+                    self._inventory_changes.clear()
+
+    def invalidate_inventory(self):
+        """forget the inventory, it will be downloaded at the next call of
+        get_uploaded_books"""
+        with self._inventory_lock:
+            self._uploaded_books = None
+
+    def add_to_inventory(self, uploaded_books: dict):
+        """add books uploaded without upload_books to the cached inventory
+
+        :uploaded_books: dict (full_title: book id)
 
-    def upload_books(self, books):
+        """
+        self._update_inventory(uploaded=uploaded_books)
+
+    def _update_inventory(self, uploaded=None, deleted=None):
+        """keep the inventory up to date with our own changes
+
+        :uploaded: dict of uploaded books (full_title: books_id)
+        :deleted: id of a deleted book
+
+        """
+        with self._inventory_lock:
+            if self._downloads:
+                self._inventory_changes.append((uploaded, deleted))
+            if self._uploaded_books is not None:
+                self._apply_change(uploaded, deleted)
+
+    def _apply_change(self, uploaded, deleted):
+        """apply a change to the cached inventory, with _inventory_lock"""
+        if uploaded is not None:
+            self._uploaded_books.update(uploaded)
+            self._publication_ids.update(uploaded.values())
+        if deleted is not None:
+            self._publication_ids.discard(deleted)
+            self._uploaded_books = {
+                    full_title: book_id
+                    for full_title, book_id in self._uploaded_books.items()
+                    if book_id != deleted}
+
+    def upload_books(self, books, max_workers=1, checkpoint=None,
+                     progress=None):
         """upload to the cloud the selected books
 
         :books: list of books (dict with metada and path to the file)
+        :max_workers: number of books uploaded at the same time. if it is
+        more than one, the collections, cover and metadata of a book are
+        also uploaded in parallel once the book file is uploaded
+        :checkpoint: if not None, object that saves the progress of each
+        step of each book, so that an interrupted upload can be resumed
+        (see SyncLedger.get_progress, save_step and finish). if a resumed
+        upload fails, checkpoint.request_reconcile is called: the copy of
+        the book may have been deleted from the cloud
+        :progress: ProgressTracker that receives the events of the upload.
+        if it is cancelled, the books that are not started yet are skipped
+        :returns: dict of uploaded books (full_title: books_id)
 
         """
+        if progress is None:
+            progress = ProgressTracker()
         try:
-            self._client.login(self._password)
+            self._login()
         except PytolinoException as e:
             raise CalibrolinoException(str(e))
+        progress.start_batch(books)
+        try:
+            if max_workers == 1:
+                uploaded_books = dict()
+                for book in books:
+                    if progress.cancelled:
+                        break
+                    book_id = self._upload_book(
+                            book, checkpoint=checkpoint, progress=progress)
+                    uploaded_books[book['full_title']] = book_id
+                return uploaded_books
+            else:
+                return self._upload_books_concurrently(
+                        books, max_workers, checkpoint, progress)
+        finally:
+            progress.finish_batch()
+
+    def _upload_books_concurrently(self, books, max_workers, checkpoint,
+                                   progress):
+        """upload the books with a pool of max_workers threads. the first
+        error or a cancel of the progress cancels the books that are not
+        started yet"""
+        uploaded_books = dict()
+        books_executor = ThreadPoolExecutor(max_workers)
+        steps_executor = ThreadPoolExecutor(max_workers)
+        try:
+            futures = {
+                    books_executor.submit(
+                        self._upload_book,
+                        book,
+                        steps_executor,
+                        checkpoint,
+                        progress,
+                        ): book
+                    for book in books}
+            for future in as_completed(futures):
+                if progress.cancelled:
+                    for other_future in futures:
+                        other_future.cancel()
+                if future.cancelled():
+                    continue
+                book_id = future.result()
+                uploaded_books[futures[future]['full_title']] = book_id
+        finally:
+            books_executor.shutdown(cancel_futures=True)
+            steps_executor.shutdown(cancel_futures=True)
+        return uploaded_books
+
+    def _get_upload_steps(self):
+        """steps done after the upload of the file of a book"""
+        return dict(
+                collection=self._add_to_collection,
+                cover=self._upload_cover,
+                metadata=self._upload_meta,
+                )
+
+    def _upload_book(self, book, steps_executor=None, checkpoint=None,
+                     progress=None):
+        """upload the file of a book, then its collections, cover and
+        metadata (in parallel if an executor is given). the steps already
+        done according to the checkpoint are skipped.
+
+        :returns: id of the book on the cloud
+
+        """
+        if progress is None:
+            progress = ProgressTracker()
+        progress.book_started(book)
+        try:
+            book_id = self._send_book(
+                    book, steps_executor, checkpoint, progress)
+        except Exception as e:
+            progress.book_failed(book, e)
+            raise
+        progress.book_finished(book)
+        return book_id
+
+    def _send_book(self, book, steps_executor, checkpoint, progress):
+        """see _upload_book"""
+        if checkpoint is not None:
+            book_id, done_steps = checkpoint.get_progress(book)
         else:
-            for book in books:
-                title = book['title']
-                print(f'uploading {title}')
-                file_path = book['file_path']
-                try:
-                    book_id = self._client.upload(file_path)
-                except PytolinoException as e:
-                    raise CalibrolinoException(str(e))
-                else:
-                    try:
-                        self._add_to_collection(book, book_id)
-                    except PytolinoException as e:
-                        raise CalibrolinoException(str(e))
-                    try:
-                        self._upload_cover(book, book_id)
-                    except PytolinoException as e:
-                        raise CalibrolinoException(str(e))
-                    try:
-                        self._upload_meta(book, book_id)
-                    except PytolinoException as e:
-                        raise CalibrolinoException(str(e))
-                    print('book uploaded')
+            book_id, done_steps = None, set()
+        resumed = book_id is not None
+        if book_id is None:
+            file_path = book['file_path']
+            start = time.perf_counter()
+            with span('cloud.upload.file'):
+                book_id = self.upload_file(book)
+            duration = time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save_step(book, 'upload', book_id)
+            progress.bytes_sent(book, get_file_stat(file_path)[0] or 0)
+            progress.step_finished(book, 'upload', duration)
+
+        def run_step(name, step):
+            start = time.perf_counter()
+            with span(f'cloud.upload.{name}'):
+                step(book, book_id)
+            duration = time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save_step(book, name, book_id)
+            progress.step_finished(book, name, duration)
+
+        steps = [
+                (name, step)
+                for name, step in self._get_upload_steps().items()
+                if name not in done_steps]
+        try:
+            if steps_executor is None:
+                for name, step in steps:
+                    run_step(name, step)
+            else:
+                futures = [
+                        steps_executor.submit(run_step, name, step)
+                        for name, step in steps]
+                for future in futures:
+                    future.result()
+        except PytolinoException as e:
+            if resumed:
+                checkpoint.request_reconcile()
+            raise CalibrolinoException(str(e))
+        if checkpoint is not None:
+            checkpoint.finish(book, book_id)
+        self._update_inventory(uploaded={book['full_title']: book_id})
+        return book_id
 
     def _add_to_collection(self, book, book_id):
         """
@@ -433,12 +1402,11 @@ class TolinoCloud(object):
         """
         tags = book['tags']
         for tag in tags:
-            self._client.add_to_collection(book_id, tag)
+            self._call(self._client.add_to_collection, book_id, tag)
         statuses = book['status']
         if statuses is not None:
             for status in statuses:
-                self._client.add_to_collection(book_id, status)
-
+                self._call(self._client.add_to_collection, book_id, status)
 
     def upload_metadata(self, book, book_id):
         """upload the metadata and cover of a book,
@@ -446,10 +1414,10 @@ class TolinoCloud(object):
         :book_id: ref on the cloud pointing to the book"""
 
         title = book['title']
-        print(f'uploading {title} on id={book_id}')
+        logging.info(f'uploading the metadata of {title} on id={book_id}')
 
         try:
-            self._client.login(self._password)
+            self._login()
         except PytolinoException as e:
             raise CalibrolinoException(str(e))
         else:
@@ -465,14 +1433,16 @@ class TolinoCloud(object):
         :book_id: ref on the cloud pointing to the book"""
 
         try:
-            self._client.login(self._password)
+            self._login()
         except PytolinoException as e:
             raise CalibrolinoException(str(e))
         else:
             try:
-                self._client.delete_ebook(book_id)
+                with span('cloud.delete'):
+                    self._call(self._client.delete_ebook, book_id)
             except PytolinoException as e:
                 raise CalibrolinoException(str(e))
+            self._update_inventory(deleted=book_id)
 
     def _upload_cover(self, book, book_id):
         """private method to upload the cover
@@ -481,23 +1451,205 @@ class TolinoCloud(object):
         """
         if book['has_cover']:
             cover_path = book['cover_path']
-            self._client.add_cover(book_id, cover_path)
+            self._call(self._client.add_cover, book_id, cover_path)
 
     def _upload_meta(self, book, book_id):
         """private method that upload the metadata
 
         """
-        full_title = book['full_title']
-        language = book['languages'][0] if book['languages'] else ''
-        metadata = dict(
-                title=full_title,
-                isbn=book['isbn'],
-                language=language,
-                publisher=', '.join(book['publishers']),
-                issued=book['issued'],
-                author=', '.join(book['authors']),
+        metadata = get_cloud_metadata(book)
+        self._call(self._client.upload_metadata, book_id, **metadata)
+
+
+class AsyncTolinoCloud(object):
+
+    """asyncio interface of a TolinoCloud. the requests of pytolino are
+    blocking, they run in a pool of threads and a semaphore keeps at most
+    max_concurrency of them in flight. the session, inventory cache,
+    retry policy and rate limiter of the TolinoCloud are shared."""
+
+    def __init__(self, tolino_cloud: TolinoCloud, max_concurrency=8):
+        """
+        :tolino_cloud: TolinoCloud used for the requests
+        :max_concurrency: maximum number of requests sent at the same time
+
+        """
+        self._cloud = tolino_cloud
+        self._client = tolino_cloud.client
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_concurrency)
+        self._semaphores = dict()
+
+    def close(self):
+        """stop the threads of the executor"""
+        self._executor.shutdown(cancel_futures=True)
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._semaphores = {loop: semaphore}
+        return semaphore
+
+    async def _run(self, function, *args, **kwargs):
+        """run a blocking function in the executor"""
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                    self._executor,
+                    functools.partial(function, *args, **kwargs),
+                    )
+
+    async def _request(self, method, *args, **kwargs):
+        """send a request with a method of the client (see
+        TolinoCloud.request)"""
+        return await self._run(self._cloud.request, method, *args, **kwargs)
+
+    async def get_uploaded_books(self) -> dict:
+        """see TolinoCloud.get_uploaded_books"""
+        return await self._run(self._cloud.get_uploaded_books)
+
+    async def delete_book(self, book_id):
+        """see TolinoCloud.delete_book"""
+        await self._run(self._cloud.delete_book, book_id)
+
+    async def upload_metadata(self, book, book_id):
+        """upload the collections, cover and metadata of a book. all the
+        requests are sent at the same time
+
+        :book: dict with title, file path an metadata of the book
+        :book_id: ref on the cloud pointing to the book
+
+        """
+        await _gather(*(
+            step(book, book_id) for step in self._get_upload_steps().values()))
+
+    async def upload_books(self, books, checkpoint=None,
+                           progress=None) -> dict:
+        """upload the books, all of them at the same time within the limit
+        of max_concurrency requests. the first error cancels the other
+        uploads. the uploads are stopped by cancelling the task, not by
+        ProgressTracker.cancel
+
+        :books: list of books (dict with metada and path to the file)
+        :checkpoint: see TolinoCloud.upload_books
+        :progress: ProgressTracker that receives the events of the upload
+        :returns: dict of uploaded books (full_title: books_id)
+
+        """
+        if progress is None:
+            progress = ProgressTracker()
+        progress.start_batch(books)
+        try:
+            book_ids = await _gather(*(
+                self._upload_book(book, checkpoint, progress)
+                for book in books))
+        finally:
+            progress.finish_batch()
+        return {
+                book['full_title']: book_id
+                for book, book_id in zip(books, book_ids)}
+
+    def _get_upload_steps(self):
+        """steps done after the upload of the file of a book"""
+        return dict(
+                collection=self._add_to_collection,
+                cover=self._upload_cover,
+                metadata=self._upload_meta,
                 )
-        self._client.upload_metadata(book_id, **metadata)
+
+    async def _add_to_collection(self, book, book_id):
+        collections = list(book['tags'])
+        if book['status'] is not None:
+            collections += book['status']
+        await _gather(*(
+            self._request(self._client.add_to_collection, book_id, collection)
+            for collection in collections))
+
+    async def _upload_cover(self, book, book_id):
+        if book['has_cover']:
+            await self._request(
+                    self._client.add_cover, book_id, book['cover_path'])
+
+    async def _upload_meta(self, book, book_id):
+        metadata = get_cloud_metadata(book)
+        await self._request(self._client.upload_metadata, book_id, **metadata)
+
+    async def _upload_book(self, book, checkpoint, progress):
+        """upload the file of a book, then its collections, cover and
+        metadata at the same time. the steps already done according to the
+        checkpoint are skipped.
+
+        :returns: id of the book on the cloud
+
+        """
+        progress.book_started(book)
+        try:
+            book_id = await self._send_book(book, checkpoint, progress)
+        except Exception as e:
+            progress.book_failed(book, e)
+            raise
+        progress.book_finished(book)
+        return book_id
+
+    async def _send_book(self, book, checkpoint, progress):
+        """see _upload_book"""
+        if checkpoint is not None:
+            book_id, done_steps = checkpoint.get_progress(book)
+        else:
+            book_id, done_steps = None, set()
+        resumed = book_id is not None
+        if book_id is None:
+            file_path = book['file_path']
+            start = time.perf_counter()
+            with span('cloud.upload.file'):
+                book_id = await self._run(self._cloud.upload_file, book)
+            duration = time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save_step(book, 'upload', book_id)
+            progress.bytes_sent(book, get_file_stat(file_path)[0] or 0)
+            progress.step_finished(book, 'upload', duration)
+
+        async def run_step(name, step):
+            start = time.perf_counter()
+            with span(f'cloud.upload.{name}'):
+                await step(book, book_id)
+            duration = time.perf_counter() - start
+            if checkpoint is not None:
+                checkpoint.save_step(book, name, book_id)
+            progress.step_finished(book, name, duration)
+
+        try:
+            await _gather(*(
+                run_step(name, step)
+                for name, step in self._get_upload_steps().items()
+                if name not in done_steps))
+        except CalibrolinoException:
+            if resumed:
+                checkpoint.request_reconcile()
+            raise
+        if checkpoint is not None:
+            checkpoint.finish(book, book_id)
+        self._cloud.add_to_inventory({book['full_title']: book_id})
+        return book_id
+
+
+async def _gather(*coroutines):
+    """run the coroutines at the same time. if one fails, the others are
+    cancelled and the error is raised
+
+    :returns: list of the results
+
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 
 if __name__ == '__main__':
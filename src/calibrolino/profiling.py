@@ -0,0 +1,268 @@
+"""timing of the phases of calibrolino (config discovery, db load, table
+reads, login, inventory, upload steps...), to put numbers on the slow syncs
+seen on the machines of the users. profiling is off by default: span() does
+nothing until start_profiling is called."""
+
+
+import os
+import sys
+import time
+import logging
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+PROFILE_ENV_VAR = 'CALIBROLINO_PROFILE'
+
+
+class Span(object):
+
+    """time spent in one phase"""
+
+    def __init__(self, name, start, duration, thread_name):
+        """
+        :name: name of the phase
+        :start: time (s) of the start of the phase, relative to the start of
+        the profiler
+        :duration: time (s) spent in the phase
+        :thread_name: name of the thread that ran the phase
+
+        """
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.thread_name = thread_name
+
+    def __repr__(self):
+        return f'Span({self.name}, {self.duration:.4f}s)'
+
+
+class PhaseProfiler(object):
+
+    """records the spans of the phases, from any thread. optionally runs
+    cProfile (on the thread that starts the profiler) and tracemalloc"""
+
+    def __init__(self, pstats_path=None, trace_memory=False):
+        """
+        :pstats_path: if not None, cProfile runs during the profiling and
+        its stats are written in this file (see pstats)
+        :trace_memory: if True, tracemalloc measures the peak of memory and
+        the memory allocated by each phase. the allocations of the other
+        threads during a phase are counted too
+
+        """
+        self._pstats_path = pstats_path
+        self._trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._spans = list()
+        self._memory = dict()
+        self._peak_memory = None
+        self._cprofile = None
+        self._start_time = None
+        self._duration = None
+
+    @property
+    def spans(self) -> list:
+        """list of the recorded Span"""
+        with self._lock:
+            return list(self._spans)
+
+    @property
+    def peak_memory(self):
+        """peak of traced memory (bytes), None if memory is not traced"""
+        if self._trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        return self._peak_memory
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self._pstats_path is not None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        """stop the profiling and write the pstats file"""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._pstats_path)
+            self._cprofile = None
+        if self._trace_memory and tracemalloc.is_tracing():
+            self._peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self._duration = time.perf_counter() - self._start_time
+
+    @contextmanager
+    def span(self, name):
+        """record the time spent in the block as a phase
+
+        :name: name of the phase
+
+        """
+        tracing = self._trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            memory_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            span = Span(
+                    name,
+                    start - self._start_time,
+                    duration,
+                    threading.current_thread().name,
+                    )
+            with self._lock:
+                self._spans.append(span)
+                if tracing:
+                    allocated = tracemalloc.get_traced_memory()[0]
+                    allocated -= memory_start
+                    self._memory[name] = self._memory.get(name, 0) + allocated
+            logging.debug(f'{name} took {duration:.4f}s')
+
+    def summary(self) -> dict:
+        """
+        :returns: dict (name of phase: dict of count, total, mean and max
+        time in s and memory allocated in bytes or None), in the order of
+        the first span of each phase
+
+        """
+        summary = dict()
+        for span in self.spans:
+            phase = summary.setdefault(
+                    span.name, dict(count=0, total=0., max=0.))
+            phase['count'] += 1
+            phase['total'] += span.duration
+            phase['max'] = max(phase['max'], span.duration)
+        with self._lock:
+            memory = dict(self._memory)
+        for name, phase in summary.items():
+            phase['mean'] = phase['total'] / phase['count']
+            phase['memory'] = memory.get(name)
+        return summary
+
+    def report(self) -> str:
+        """
+        :returns: table of the phases, with the total time and peak memory
+
+        """
+        lines = [
+                f"{'phase':<28} {'count':>6} {'total':>10} {'mean':>10} "
+                f"{'max':>10}"]
+        for name, phase in self.summary().items():
+            line = (f"{name:<28} {phase['count']:>6} "
+                    f"{phase['total']:>9.4f}s {phase['mean']:>9.4f}s "
+                    f"{phase['max']:>9.4f}s")
+            if phase['memory'] is not None:
+                line += f" {phase['memory'] / 2 ** 20:>+9.2f}MiB"
+            lines.append(line)
+        if self._duration is not None:
+            lines.append(f'total time: {self._duration:.4f}s')
+        if self.peak_memory is not None:
+            lines.append(
+                    f'peak memory: {self.peak_memory / 2 ** 20:.2f}MiB')
+        if self._pstats_path is not None:
+            lines.append(f'cProfile stats: {self._pstats_path}')
+        return '\n'.join(lines)
+
+
+_profiler = None
+
+
+def get_profiler():
+    """
+    :returns: the running PhaseProfiler, None if profiling is off
+
+    """
+    return _profiler
+
+
+def start_profiling(pstats_path=None, trace_memory=False) -> PhaseProfiler:
+    """start to record the phases of calibrolino
+
+    :pstats_path: see PhaseProfiler
+    :trace_memory: see PhaseProfiler
+    :returns: the new PhaseProfiler
+
+    """
+    global _profiler
+    profiler = PhaseProfiler(pstats_path, trace_memory)
+    profiler.start()
+    _profiler = profiler
+    return profiler
+
+
+def stop_profiling():
+    """
+    :returns: the stopped PhaseProfiler, None if profiling was off
+
+    """
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+@contextmanager
+def span(name):
+    """record the time spent in the block if profiling is on
+
+    :name: name of the phase
+
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.span(name):
+            yield
+
+
+def parse_profile_options(value) -> dict:
+    """read the profiling options from the value of PROFILE_ENV_VAR: a
+    comma separated list of 1 (phase timings), memory (tracemalloc),
+    pstats=<path> (cProfile) and report=<path> (file of the report
+    instead of stderr). an empty value means no profiling
+
+    :returns: dict of profile, trace_memory, pstats_path and report_path
+
+    """
+    options = dict(
+            profile=False,
+            trace_memory=False,
+            pstats_path=None,
+            report_path=None,
+            )
+    for item in (value or '').split(','):
+        item = item.strip()
+        key, _, path = item.partition('=')
+        if not item or item == '0':
+            continue
+        options['profile'] = True
+        if key == 'memory':
+            options['trace_memory'] = True
+        elif key == 'pstats' and path:
+            options['pstats_path'] = os.path.expanduser(path)
+        elif key == 'report' and path:
+            options['report_path'] = os.path.expanduser(path)
+    return options
+
+
+def write_report(profiler: PhaseProfiler, report_path=None):
+    """write the report of the profiler in a file or on stderr
+
+    :report_path: path of the file, None for stderr
+
+    """
+    report = profiler.report()
+    if report_path is None:
+        print(report, file=sys.stderr)
+    else:
+        with open(report_path, 'w') as myfile:
+            myfile.write(f'{report}\n')
@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+
+
+from calibrolino.ledger import get_file_stat
+
+
+BATCH_STARTED = 'batch_started'
+BOOK_STARTED = 'book_started'
+STEP_FINISHED = 'step_finished'
+BYTES_SENT = 'bytes_sent'
+BOOK_FINISHED = 'book_finished'
+BOOK_FAILED = 'book_failed'
+BATCH_FINISHED = 'batch_finished'
+
+
+class ProgressEvent(object):
+
+    """event sent by a ProgressTracker to its subscribers"""
+
+    def __init__(self, kind, stats, book=None, step=None, duration=None,
+                 size=None, error=None):
+        """
+        :kind: BATCH_STARTED, BOOK_STARTED, STEP_FINISHED, BYTES_SENT,
+        BOOK_FINISHED, BOOK_FAILED or BATCH_FINISHED
+        :stats: counters of the batch when the event happened (see
+        ProgressTracker.stats)
+        :book: dict of the book concerned by the event
+        :step: name of the finished step (upload, collection, cover or
+        metadata)
+        :duration: time (s) spent in the step, the book or the batch
+        :size: number of bytes sent
+        :error: exception that made the upload of the book fail
+
+        """
+        self.kind = kind
+        self.stats = stats
+        self.book = book
+        self.step = step
+        self.duration = duration
+        self.size = size
+        self.error = error
+
+    def __repr__(self):
+        title = self.book['full_title'] if self.book is not None else None
+        return f'ProgressEvent({self.kind}, {title}, step={self.step})'
+
+
+class ProgressTracker(object):
+
+    """counts the progress of a batch of uploads (books, bytes, throughput
+    and eta) and sends a ProgressEvent to the subscribers at each change.
+    the events can be sent from the threads that upload the books. the
+    batch can be cancelled from any thread: the uploads stop before the
+    next book."""
+
+    def __init__(self):
+        self._subscribers = list()
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._reset(list())
+
+    def _reset(self, books):
+        self._books_total = len(books)
+        self._bytes_total = sum(
+                get_file_stat(book['file_path'])[0] or 0 for book in books)
+        self._books_done = 0
+        self._books_failed = 0
+        self._bytes_sent = 0
+        self._start_time = time.monotonic()
+        self._book_start_times = dict()
+
+    def subscribe(self, callback):
+        """
+        :callback: function called with each ProgressEvent
+
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """ask the uploads to stop before the next book. the books in
+        progress are finished"""
+        self._cancel_event.set()
+
+    def clear_cancel(self):
+        """accept new uploads after a cancel"""
+        self._cancel_event.clear()
+
+    @property
+    def stats(self) -> dict:
+        """counters of the current batch: books_total, books_done,
+        books_failed, bytes_total, bytes_sent, elapsed (s), books_per_min,
+        bytes_per_s, eta (s, None if unknown) and cancelled"""
+        with self._lock:
+            return self._get_stats()
+
+    def _get_stats(self):
+        elapsed = time.monotonic() - self._start_time
+        books_per_min = 60 * self._books_done / elapsed if elapsed else 0.
+        bytes_per_s = self._bytes_sent / elapsed if elapsed else 0.
+        books_left = (
+                self._books_total - self._books_done - self._books_failed)
+        if bytes_per_s and self._bytes_total:
+            eta = max(0, self._bytes_total - self._bytes_sent) / bytes_per_s
+        elif books_per_min:
+            eta = 60 * books_left / books_per_min
+        else:
+            eta = None
+        return dict(
+                books_total=self._books_total,
+                books_done=self._books_done,
+                books_failed=self._books_failed,
+                bytes_total=self._bytes_total,
+                bytes_sent=self._bytes_sent,
+                elapsed=elapsed,
+                books_per_min=books_per_min,
+                bytes_per_s=bytes_per_s,
+                eta=eta,
+                cancelled=self._cancel_event.is_set(),
+                )
+
+    def _send(self, kind, **kwargs):
+        """create the event with the current stats and send it. the
+        counters must be updated before, under the lock"""
+        with self._lock:
+            event = ProgressEvent(kind, self._get_stats(), **kwargs)
+        for callback in list(self._subscribers):
+            try:
+                callback(event)
+            except Exception:
+                logging.exception(f'progress subscriber failed on {event}')
+
+    def start_batch(self, books):
+        """
+        :books: list of the books that will be uploaded
+
+        """
+        with self._lock:
+            self._reset(books)
+        self._send(BATCH_STARTED)
+
+    def book_started(self, book):
+        with self._lock:
+            self._book_start_times[book['uuid']] = time.monotonic()
+        self._send(BOOK_STARTED, book=book)
+
+    def step_finished(self, book, step, duration):
+        self._send(STEP_FINISHED, book=book, step=step, duration=duration)
+
+    def bytes_sent(self, book, size):
+        with self._lock:
+            self._bytes_sent += size
+        self._send(BYTES_SENT, book=book, size=size)
+
+    def _get_book_duration(self, book):
+        start_time = self._book_start_times.pop(book['uuid'], None)
+        if start_time is None:
+            return None
+        return time.monotonic() - start_time
+
+    def book_finished(self, book):
+        with self._lock:
+            self._books_done += 1
+            duration = self._get_book_duration(book)
+        self._send(BOOK_FINISHED, book=book, duration=duration)
+
+    def book_failed(self, book, error):
+        with self._lock:
+            self._books_failed += 1
+            duration = self._get_book_duration(book)
+        self._send(BOOK_FAILED, book=book, duration=duration, error=error)
+
+    def finish_batch(self):
+        with self._lock:
+            duration = time.monotonic() - self._start_time
+        self._send(BATCH_FINISHED, duration=duration)
+
+
+def format_stats(stats: dict) -> str:
+    """short text with the progress of a batch (see ProgressTracker.stats)
+
+    """
+    text = (
+            f"{stats['books_done']}/{stats['books_total']} books, "
+            f"{stats['books_per_min']:.1f} books/min, "
+            f"{stats['bytes_per_s'] / 1e6:.2f} MB/s")
+    if stats['books_failed']:
+        text = f"{text}, {stats['books_failed']} failed"
+    if stats.get('cancelled'):
+        text = f'{text}, cancelled'
+    elif stats['eta'] is not None:
+        text = f"{text}, eta {stats['eta']:.0f}s"
+    return text
@@ -0,0 +1,109 @@
+import time
+import random
+import logging
+import threading
+
+
+class RetryPolicy(object):
+
+    """exponential backoff with jitter between the attempts of a request"""
+
+    def __init__(
+            self,
+            max_retries=4,
+            base_delay=0.5,
+            max_delay=30.,
+            jitter=True,
+            ):
+        """
+        :max_retries: number of retries after the first attempt
+        :base_delay: delay (s) before the first retry. it is doubled at
+        each retry
+        :max_delay: maximum delay (s) between two attempts
+        :jitter: if True, the delay is random between 0 and the backoff
+        (full jitter), so that parallel requests do not retry together
+
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, retry: int) -> float:
+        """
+        :retry: number of the retry, starting from 0
+        :returns: time (s) to wait before this retry
+
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** retry)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def call(self, method, *args, exceptions=(Exception,), on_error=None,
+             **kwargs):
+        """call a method and retry it if it raises one of exceptions. the
+        last exception is raised if all the attempts fail
+
+        :exceptions: tuple of exceptions considered as transient errors
+        :on_error: function called with the exception and the number of the
+        retry before waiting
+
+        """
+        for retry in range(self.max_retries + 1):
+            try:
+                return method(*args, **kwargs)
+            except exceptions as e:
+                if retry == self.max_retries:
+                    raise
+                delay = self.get_delay(retry)
+                logging.warning(
+                        f'{getattr(method, "__name__", method)} failed '
+                        f'({e}), retry {retry + 1} in {delay:.2f}s')
+                if on_error is not None:
+                    on_error(e, retry)
+                time.sleep(delay)
+
+
+class RateLimiter(object):
+
+    """token bucket shared by the threads that send requests to a server"""
+
+    def __init__(self, rate=4., burst=8):
+        """
+        :rate: average number of requests per second. None to disable
+        the limiter
+        :burst: number of requests that can be sent at once after a pause
+
+        """
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def _fill(self, now):
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+
+    def acquire(self) -> float:
+        """wait until a request can be sent
+
+        :returns: time (s) spent waiting
+
+        """
+        if self._rate is None:
+            return 0.
+        with self._lock:
+            now = time.monotonic()
+            self._fill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,414 @@
+"""local stand-in of the tolino cloud, to test and benchmark the sync
+without a partner account. it implements the endpoints used by pytolino
+(token, inventory, upload, cover, metadata, collections and delete) with
+configurable latency, bandwidth, errors and throttling"""
+
+
+import re
+import json
+import socket
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+from calibrolino.models import TolinoCloud
+
+
+_PATHS = dict(
+        token='/auth/oauth2/token',
+        inventory='/rest/inventory/delta',
+        upload='/rest/upload',
+        cover='/rest/cover',
+        meta='/rest/meta',
+        sync_data='/rest/sync-data',
+        delete='/rest/deletecontent',
+        devices='/rest/handshake/devices/list',
+        )
+_FILENAME_REGEX = re.compile(rb'filename="([^"]*)"')
+# endpoints of the login, without authorization and injected errors
+_LOGIN_ENDPOINTS = ('token', 'devices')
+
+
+class StandinConfig(object):
+
+    """behaviour of the stand-in server"""
+
+    def __init__(
+            self,
+            latency=0.,
+            latency_jitter=0.,
+            bandwidth=None,
+            error_rate=0.,
+            throttle_rate=None,
+            token_lifetime=3600,
+            seed=None,
+            ):
+        """
+        :latency: time (s) added to each request
+        :latency_jitter: random time (s) between 0 and latency_jitter added
+        to the latency
+        :bandwidth: bytes/s at which the bodies of the requests are read.
+        None for no limit
+        :error_rate: probability that a request fails with a 503 error
+        :throttle_rate: number of requests per second accepted, the others
+        are answered with 429 errors. None for no limit. the login requests
+        (token and devices) are never throttled nor failed: pytolino would
+        fall back to its browser login
+        :token_lifetime: time (s) before an access token expires
+        :seed: seed of the random errors and jitter
+
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.token_lifetime = token_lifetime
+        self.seed = seed
+
+
+class StandinState(object):
+
+    """books, tokens and statistics of the stand-in server"""
+
+    def __init__(self, config: StandinConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.books = dict()
+        self.tokens = dict()
+        self.revision = 0
+        self.next_id = 0
+        self.requests = dict()
+        self.errors = dict()
+        self.latencies = list()
+        self._throttle_window = list()
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return f'standin-{self.next_id}'
+
+    def new_token(self):
+        token = f'token-{self.new_id()}'
+        with self.lock:
+            self.tokens[token] = time.time() + self.config.token_lifetime
+        return token
+
+    def is_authorized(self, token):
+        with self.lock:
+            expiration_time = self.tokens.get(token)
+        return expiration_time is not None and expiration_time > time.time()
+
+    def is_throttled(self):
+        """sliding window of one second over the accepted requests"""
+        if self.config.throttle_rate is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = [t for t in self._throttle_window if now - t < 1.]
+            throttled = len(window) >= self.config.throttle_rate
+            if not throttled:
+                window.append(now)
+            self._throttle_window = window
+        return throttled
+
+    def draw_error(self):
+        with self.lock:
+            return self.random.random() < self.config.error_rate
+
+    def draw_latency(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.config.latency_jitter)
+        return self.config.latency + jitter
+
+    def record(self, endpoint, duration, status):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if status >= 400:
+                self.errors[status] = self.errors.get(status, 0) + 1
+            self.latencies.append(duration)
+
+    @property
+    def stats(self) -> dict:
+        """number of requests per endpoint, number of errors per status
+        and server-side latencies (s)"""
+        with self.lock:
+            return dict(
+                    requests=dict(self.requests),
+                    errors=dict(self.errors),
+                    latencies=list(self.latencies),
+                    )
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = dict()
+            self.errors = dict()
+            self.latencies = list()
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+
+    """answer the requests of pytolino like the tolino cloud"""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def _state(self) -> StandinState:
+        return self.server.state
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def _read_body(self):
+        """read the body of the request at the configured bandwidth"""
+        length = int(self.headers.get('Content-Length', 0))
+        bandwidth = self._state.config.bandwidth
+        chunks = list()
+        remaining = length
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1 << 16))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            chunks.append(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+        return b''.join(chunks)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self._read_body()
+        endpoint = next(
+                (name for name, path in _PATHS.items() if path == url.path),
+                None)
+        state = self._state
+        time.sleep(state.draw_latency())
+        if endpoint is None:
+            status, data = 404, dict(error='not found')
+        elif endpoint in _LOGIN_ENDPOINTS:
+            status, data = getattr(self, f'_{endpoint}')(method, query, body)
+        elif state.is_throttled():
+            status, data = 429, dict(error='too many requests')
+        elif state.draw_error():
+            status, data = 503, dict(error='service unavailable')
+        elif not state.is_authorized(self.headers.get('t_auth_token')):
+            status, data = 401, dict(error='unauthorized')
+        else:
+            handler = getattr(self, f'_{endpoint}')
+            status, data = handler(method, query, body)
+        self._send_json(status, data)
+        state.record(endpoint, time.perf_counter() - start, status)
+
+    def _token(self, method, query, body):
+        return 200, dict(
+                access_token=self._state.new_token(),
+                refresh_token=self._state.new_id(),
+                expires_in=self._state.config.token_lifetime,
+                refresh_expires_in=30 * 24 * 3600,
+                )
+
+    def _devices(self, method, query, body):
+        device = dict(deviceId='standin-device', deviceLastUsage=0)
+        return 200, dict(deviceListResponse=dict(devices=[device]))
+
+    def _inventory(self, method, query, body):
+        inventory = dict(edata=list(), ebook=list())
+        with self._state.lock:
+            for book_id, book in self._state.books.items():
+                part = 'ebook' if book.get('purchased') else 'edata'
+                inventory[part].append(dict(
+                    publicationId=book_id,
+                    deliverableId=book_id,
+                    epubMetaData=dict(
+                        title=book['metadata'].get('title'),
+                        identifier=book_id,
+                        ),
+                    ))
+        return 200, dict(PublicationInventory=inventory)
+
+    def _upload(self, method, query, body):
+        match = _FILENAME_REGEX.search(body)
+        name = match.group(1).decode() if match else ''
+        title = name.rsplit('.', 1)[0]
+        book_id = self._state.new_id()
+        with self._state.lock:
+            self._state.books[book_id] = dict(
+                    metadata=dict(title=title, deliverableId=book_id),
+                    collections=set(),
+                    size=len(body),
+                    cover=False,
+                    )
+        return 200, dict(metadata=dict(deliverableId=book_id))
+
+    def _get_book(self, book_id):
+        with self._state.lock:
+            return self._state.books.get(book_id)
+
+    def _cover(self, method, query, body):
+        match = re.search(rb'name="deliverableId"\r\n\r\n([^\r]*)', body)
+        book = self._get_book(match.group(1).decode()) if match else None
+        if book is None:
+            return 404, dict(error='no such book')
+        book['cover'] = True
+        return 200, dict()
+
+    def _meta(self, method, query, body):
+        if method == 'GET':
+            book = self._get_book(query.get('deliverableId'))
+            if book is None:
+                return 404, dict(error='no such book')
+            return 200, dict(metadata=dict(book['metadata']))
+        metadata = json.loads(body)['uploadMetaData']
+        book = self._get_book(metadata.get('deliverableId'))
+        if book is None:
+            return 404, dict(error='no such book')
+        book['metadata'].update(metadata)
+        return 200, dict()
+
+    def _sync_data(self, method, query, body):
+        patches = json.loads(body).get('patches', list())
+        answers = list()
+        with self._state.lock:
+            for patch in patches:
+                book_id = patch['path'].split('/')[2]
+                book = self._state.books.get(book_id)
+                if book is None:
+                    continue
+                self._state.revision += 1
+                value = dict(patch['value'], revision=self._state.revision)
+                if patch['op'] == 'add':
+                    book['collections'].add(value['name'])
+                else:
+                    book['collections'].discard(value['name'])
+                answers.append(dict(patch, value=value))
+            revision = self._state.revision
+        return 200, dict(revision=revision, patches=answers)
+
+    def _delete(self, method, query, body):
+        with self._state.lock:
+            book = self._state.books.pop(query.get('deliverableId'), None)
+        if book is None:
+            return 404, dict(error='no such book')
+        return 200, dict()
+
+
+class StandinServer(object):
+
+    """stand-in of the tolino cloud running in a thread"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        """
+        :config: StandinConfig. default has no latency nor errors
+        :host: address of the server
+        :port: port of the server, 0 for a free port
+
+        """
+        if config is None:
+            config = StandinConfig()
+        self.state = StandinState(config)
+        self._server = ThreadingHTTPServer((host, port), StandinRequestHandler)
+        self._server.daemon_threads = True
+        self._server.state = self.state
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_purchased_book(self, title) -> str:
+        """add a book bought in the store of the partner. it is in the
+        ebook part of the inventory, the uploads are in the edata part
+
+        :returns: id of the book
+
+        """
+        book_id = self.state.new_id()
+        with self.state.lock:
+            self.state.books[book_id] = dict(
+                    metadata=dict(title=title, deliverableId=book_id),
+                    collections=set(),
+                    size=0,
+                    cover=True,
+                    purchased=True,
+                    )
+        return book_id
+
+    def point_client(self, client):
+        """send the requests of a pytolino.Client to this server. the client
+        gets a refresh token, so that its login only renews the access
+        token and does not open a browser
+
+        :client: pytolino Client
+
+        """
+        client._token_url = f'{self.url}{_PATHS["token"]}'
+        client._inventory_url = f'{self.url}{_PATHS["inventory"]}'
+        client._upload_url = f'{self.url}{_PATHS["upload"]}'
+        client._cover_url = f'{self.url}{_PATHS["cover"]}'
+        client._meta_url = f'{self.url}{_PATHS["meta"]}'
+        client._sync_data_url = f'{self.url}{_PATHS["sync_data"]}'
+        client._delete_url = f'{self.url}{_PATHS["delete"]}'
+        client._refresh_token = self.state.new_id()
+        client._refresh_expiration_time = time.time() + 30 * 24 * 3600
+        client._access_expiration_time = 0
+        client._hardware_id = 'standin-device'
+
+    def create_tolino_cloud(self, **kwargs) -> TolinoCloud:
+        """
+        :kwargs: arguments of TolinoCloud other than the credentials
+        :returns: TolinoCloud connected to this server
+
+        """
+        tolino_cloud = TolinoCloud(
+                'orellfuessli', 'standin@example.com', 'password', **kwargs)
+        self.point_client(tolino_cloud.client)
+        return tolino_cloud
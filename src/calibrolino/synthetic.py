@@ -0,0 +1,364 @@
+"""generate calibre libraries with fake books, for tests and benchmarks"""
+
+
+import os
+import json
+import uuid
+import random
+import sqlite3
+import datetime
+
+
+_SCHEMA = """
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL DEFAULT 'Unknown' COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    pubdate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    series_index REAL NOT NULL DEFAULT 1.0,
+    author_sort TEXT COLLATE NOCASE,
+    isbn TEXT DEFAULT '' COLLATE NOCASE,
+    lccn TEXT DEFAULT '' COLLATE NOCASE,
+    path TEXT NOT NULL DEFAULT '',
+    flags INTEGER NOT NULL DEFAULT 1,
+    uuid TEXT,
+    has_cover BOOL DEFAULT 0,
+    last_modified TIMESTAMP NOT NULL DEFAULT '2000-01-01 00:00:00+00:00'
+);
+CREATE TABLE data (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    format TEXT NOT NULL COLLATE NOCASE,
+    uncompressed_size INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE(book, format)
+);
+CREATE TABLE authors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE(name)
+);
+CREATE TABLE books_authors_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    author INTEGER NOT NULL,
+    UNIQUE(book, author)
+);
+CREATE TABLE publishers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE(name)
+);
+CREATE TABLE books_publishers_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    publisher INTEGER NOT NULL,
+    UNIQUE(book)
+);
+CREATE TABLE series (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    sort TEXT COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE (name)
+);
+CREATE TABLE books_series_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    series INTEGER NOT NULL,
+    UNIQUE(book)
+);
+CREATE TABLE tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE (name)
+);
+CREATE TABLE books_tags_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    tag INTEGER NOT NULL,
+    UNIQUE(book, tag)
+);
+CREATE TABLE languages (
+    id INTEGER PRIMARY KEY,
+    lang_code TEXT NOT NULL COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE(lang_code)
+);
+CREATE TABLE books_languages_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    lang_code INTEGER NOT NULL,
+    item_order INTEGER NOT NULL DEFAULT 0,
+    UNIQUE(book, lang_code)
+);
+CREATE TABLE custom_columns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    name TEXT NOT NULL,
+    datatype TEXT NOT NULL,
+    mark_for_delete BOOL DEFAULT 0 NOT NULL,
+    editable BOOL DEFAULT 1 NOT NULL,
+    display TEXT DEFAULT '{}' NOT NULL,
+    is_multiple BOOL DEFAULT 0 NOT NULL,
+    normalized BOOL NOT NULL,
+    UNIQUE(label)
+);
+CREATE INDEX authors_idx ON books (author_sort COLLATE NOCASE);
+CREATE INDEX books_idx ON books (sort COLLATE NOCASE);
+CREATE INDEX data_idx ON data (book);
+CREATE INDEX formats_idx ON data (format);
+CREATE INDEX books_authors_link_aidx ON books_authors_link (author);
+CREATE INDEX books_authors_link_bidx ON books_authors_link (book);
+CREATE INDEX books_publishers_link_aidx ON books_publishers_link (publisher);
+CREATE INDEX books_publishers_link_bidx ON books_publishers_link (book);
+CREATE INDEX books_series_link_aidx ON books_series_link (series);
+CREATE INDEX books_series_link_bidx ON books_series_link (book);
+CREATE INDEX books_tags_link_aidx ON books_tags_link (tag);
+CREATE INDEX books_tags_link_bidx ON books_tags_link (book);
+CREATE INDEX books_languages_link_aidx ON books_languages_link (lang_code);
+CREATE INDEX books_languages_link_bidx ON books_languages_link (book);
+"""
+
+_CUSTOM_COLUMN_SCHEMA = """
+CREATE TABLE custom_column_{id} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    value TEXT NOT NULL COLLATE NOCASE,
+    link TEXT NOT NULL DEFAULT '',
+    UNIQUE(value)
+);
+CREATE TABLE books_custom_column_{id}_link (
+    id INTEGER PRIMARY KEY,
+    book INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    UNIQUE(book, value)
+);
+CREATE INDEX books_custom_column_{id}_link_aidx
+    ON books_custom_column_{id}_link (value);
+CREATE INDEX books_custom_column_{id}_link_bidx
+    ON books_custom_column_{id}_link (book);
+"""
+
+_LANGUAGES = ['eng', 'fra', 'deu', 'ita', 'spa']
+
+
+def write_calibre_config(config_home, library_folder):
+    """write the config file of calibre that points to the library, as
+    CalibreDBReader looks for it
+
+    :config_home: folder used as XDG_CONFIG_HOME
+    :library_folder: folder of the library
+
+    """
+    folder = os.path.join(config_home, 'calibre')
+    os.makedirs(folder, exist_ok=True)
+    config_path = os.path.join(folder, 'global.py.json')
+    with open(config_path, 'w') as myfile:
+        json.dump(dict(library_path=os.path.abspath(library_folder)), myfile)
+
+
+def create_library(
+        library_folder,
+        n_books=1000,
+        n_authors=None,
+        n_tags=50,
+        n_series=None,
+        n_publishers=20,
+        n_status_columns=1,
+        n_statuses=4,
+        write_files=True,
+        file_size=1024,
+        seed=0,
+        ):
+    """create a calibre library with fake books: metadata.db and, if
+    write_files, the folders with an epub and a cover for each book
+
+    :library_folder: folder of the library. must not contain a metadata.db
+    :n_books: number of books
+    :n_authors: number of authors, default n_books // 5
+    :n_tags: number of tags
+    :n_series: number of series, default n_books // 20
+    :n_publishers: number of publishers
+    :n_status_columns: number of text custom columns. the first one is
+    named status, like the column used by CalibreDBReader
+    :n_statuses: number of values of each status column
+    :write_files: write the book and cover files (slow for large libraries)
+    :file_size: size in bytes of each fake epub
+    :seed: seed of the random generator, the same seed gives the same
+    library
+    :returns: path of metadata.db
+
+    """
+    if n_authors is None:
+        n_authors = max(1, n_books // 5)
+    if n_series is None:
+        n_series = max(1, n_books // 20)
+    rng = random.Random(seed)
+    os.makedirs(library_folder, exist_ok=True)
+    db_path = os.path.join(library_folder, 'metadata.db')
+    if os.path.exists(db_path):
+        raise FileExistsError(db_path)
+
+    con = sqlite3.connect(db_path)
+    try:
+        con.executescript(_SCHEMA)
+        _create_names(con, n_authors, n_tags, n_series, n_publishers)
+        status_tables = _create_status_columns(
+                con, n_status_columns, n_statuses)
+        _create_books(
+                con,
+                rng,
+                library_folder,
+                n_books,
+                n_authors,
+                n_tags,
+                n_series,
+                n_publishers,
+                status_tables,
+                n_statuses,
+                write_files,
+                file_size,
+                )
+        con.commit()
+    finally:
+        con.close()
+    return db_path
+
+
+def _create_names(con, n_authors, n_tags, n_series, n_publishers):
+    con.executemany(
+            'INSERT INTO authors (id, name, sort) VALUES (?, ?, ?)',
+            ((i, f'Author {i}', f'{i}, Author')
+             for i in range(1, n_authors + 1)))
+    con.executemany(
+            'INSERT INTO tags (id, name) VALUES (?, ?)',
+            ((i, f'tag {i}') for i in range(1, n_tags + 1)))
+    con.executemany(
+            'INSERT INTO series (id, name, sort) VALUES (?, ?, ?)',
+            ((i, f'Series {i}', f'Series {i}')
+             for i in range(1, n_series + 1)))
+    con.executemany(
+            'INSERT INTO publishers (id, name, sort) VALUES (?, ?, ?)',
+            ((i, f'Publisher {i}', f'Publisher {i}')
+             for i in range(1, n_publishers + 1)))
+    con.executemany(
+            'INSERT INTO languages (id, lang_code) VALUES (?, ?)',
+            enumerate(_LANGUAGES, 1))
+
+
+def _create_status_columns(con, n_status_columns, n_statuses):
+    """
+    :returns: names of the link tables of the status columns
+
+    """
+    tables = list()
+    for i in range(n_status_columns):
+        name = 'status' if i == 0 else f'status_{i}'
+        res = con.execute("""
+        INSERT INTO custom_columns (label, name, datatype, normalized)
+        VALUES (?, ?, 'text', 1)
+        """, (name, name))
+        column_id = res.lastrowid
+        con.executescript(_CUSTOM_COLUMN_SCHEMA.format(id=column_id))
+        con.executemany(
+                f'INSERT INTO custom_column_{column_id} (id, value) '
+                f'VALUES (?, ?)',
+                ((j, f'{name} {j}') for j in range(1, n_statuses + 1)))
+        tables.append(f'books_custom_column_{column_id}_link')
+    return tables
+
+
+_INSERT_SQL = dict(
+        books="""
+        INSERT INTO books (id, title, sort, pubdate, series_index,
+            author_sort, isbn, path, uuid, has_cover, last_modified)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        data=(
+            'INSERT INTO data (book, format, uncompressed_size, name) '
+            'VALUES (?, ?, ?, ?)'),
+        authors='INSERT INTO books_authors_link (book, author) VALUES (?, ?)',
+        tags='INSERT INTO books_tags_link (book, tag) VALUES (?, ?)',
+        series='INSERT INTO books_series_link (book, series) VALUES (?, ?)',
+        publishers=(
+            'INSERT INTO books_publishers_link (book, publisher) '
+            'VALUES (?, ?)'),
+        languages=(
+            'INSERT INTO books_languages_link (book, lang_code) '
+            'VALUES (?, ?)'),
+        )
+_CHUNK_SIZE = 10000
+
+
+def _create_books(con, rng, library_folder, n_books, n_authors, n_tags,
+                  n_series, n_publishers, status_tables, n_statuses,
+                  write_files, file_size):
+    """insert the books by chunks, so that a large library does not need
+    to be held in memory"""
+    insert_sql = dict(_INSERT_SQL)
+    for table in status_tables:
+        insert_sql[table] = f'INSERT INTO {table} (book, value) VALUES (?, ?)'
+    rows = {name: list() for name in insert_sql}
+    start = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    for book_id in range(1, n_books + 1):
+        title = f'Book {book_id}'
+        authors = rng.sample(
+                range(1, n_authors + 1), min(n_authors, rng.randint(1, 3)))
+        author_name = f'Author {authors[0]}'
+        path = f'{author_name}/{title} ({book_id})'
+        has_cover = rng.random() < 0.8
+        pubdate = start + datetime.timedelta(days=rng.randrange(9000))
+        last_modified = pubdate + datetime.timedelta(
+                seconds=rng.randrange(10 ** 8))
+        rows['books'].append((
+                book_id,
+                title,
+                title,
+                pubdate.isoformat(sep=' '),
+                float(rng.randint(1, 20)),
+                f'{authors[0]}, Author',
+                f'978{rng.randrange(10 ** 10):010d}',
+                path,
+                str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                has_cover,
+                last_modified.isoformat(sep=' '),
+                ))
+        file_name = f'{title} - {author_name}'
+        rows['data'].append((book_id, 'EPUB', file_size, file_name))
+        rows['authors'] += [(book_id, author) for author in authors]
+        n_book_tags = min(n_tags, rng.randint(0, 5))
+        rows['tags'] += [
+                (book_id, tag)
+                for tag in rng.sample(range(1, n_tags + 1), n_book_tags)]
+        if n_series and rng.random() < 0.3:
+            rows['series'].append((book_id, rng.randint(1, n_series)))
+        if n_publishers:
+            rows['publishers'].append(
+                    (book_id, rng.randint(1, n_publishers)))
+        rows['languages'].append((book_id, rng.randint(1, len(_LANGUAGES))))
+        for table in status_tables:
+            if n_statuses and rng.random() < 0.5:
+                rows[table].append((book_id, rng.randint(1, n_statuses)))
+        if write_files:
+            _write_book_files(
+                    library_folder, path, file_name, has_cover, file_size)
+        if book_id % _CHUNK_SIZE == 0 or book_id == n_books:
+            for name, sql in insert_sql.items():
+                con.executemany(sql, rows[name])
+                rows[name] = list()
+
+
+def _write_book_files(library_folder, path, file_name, has_cover, file_size):
+    folder = os.path.join(library_folder, path)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, f'{file_name}.epub'), 'wb') as myfile:
+        myfile.write(b'\0' * file_size)
+    if has_cover:
+        with open(os.path.join(folder, 'cover.jpg'), 'wb') as myfile:
+            myfile.write(b'\xff\xd8\xff\xd9')
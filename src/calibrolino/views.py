@@ -1,7 +1,30 @@
+import sys
+import json
+import signal
 import getpass
+import logging
+from contextlib import redirect_stdout
 
 
 from calibrolino.interfaces import View, Controller
+from calibrolino.progress import BOOK_STARTED, BOOK_FINISHED, BOOK_FAILED
+from calibrolino.progress import BATCH_FINISHED, format_stats
+from calibrolino.ledger import BOOK_MISSING, BOOK_FILE_CHANGED
+from calibrolino.ledger import BOOK_METADATA_CHANGED, BOOK_UNCHANGED
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NOT_CONFIGURED = 3
+EXIT_CANCELLED = 4
+
+_CHANGE_NAMES = {
+        BOOK_MISSING: 'missing',
+        BOOK_FILE_CHANGED: 'file_changed',
+        BOOK_METADATA_CHANGED: 'metadata_changed',
+        BOOK_UNCHANGED: 'unchanged',
+        }
 
 
 class CalibrolinoShellView(View):
@@ -38,6 +61,10 @@ class CalibrolinoShellView(View):
                     display='upload all the calibre library',
                     method=self._upload_all,
                     ),
+                '5': dict(
+                    display='upload the changes of the calibre library',
+                    method=self._sync_changes,
+                    ),
                 '3': dict(
                     display='upload only one book',
                     method=self._upload_one,
@@ -56,6 +83,7 @@ class CalibrolinoShellView(View):
     def start(self):
 
         print(self._welcome_msg)
+        self.controller.subscribe_progress(self._show_progress)
         self._local_books = self.controller.local_books
         while self._running:
             self._print_menu()
@@ -70,6 +98,22 @@ class CalibrolinoShellView(View):
                 print('please select a valid option')
             print('===')
 
+    def _show_progress(self, event):
+        """print the progress of the uploads
+
+        :event: ProgressEvent
+
+        """
+        if event.kind == BOOK_STARTED:
+            print(f"uploading {event.book['full_title']}")
+        elif event.kind == BOOK_FINISHED:
+            print(f'book uploaded ({format_stats(event.stats)})')
+        elif event.kind == BOOK_FAILED:
+            print(f"upload of {event.book['full_title']} failed: "
+                  f'{event.error}')
+        elif event.kind == BATCH_FINISHED:
+            print(f'{format_stats(event.stats)} in {event.duration:.0f}s')
+
     def _print_menu(self):
         for key, element in self._menu.items():
             print(key, element['display'])
@@ -79,7 +123,7 @@ class CalibrolinoShellView(View):
         print(credentials)
 
     def _show_full_library(self):
-        library = self.controller.get_full_library()
+        library = self.controller.get_full_library(include_online=True)
         print(library)
 
     def _change_credentials(self):
@@ -116,6 +160,13 @@ class CalibrolinoShellView(View):
         """
         self.controller.sync_upload()
 
+    def _sync_changes(self):
+        """upload the new books, the modified books and the modified
+        metadata
+
+        """
+        self.controller.sync_upload(delta=True)
+
     def _upload_one(self):
         """upload only one book (for a test)
 
@@ -169,6 +220,204 @@ class CalibrolinoShellView(View):
         return True if answer.lower()=='yes' else False
 
 
+def limit_changes(changes: dict, limit=None) -> dict:
+    """keep at most limit books of a sync plan: first the missing books,
+    then the modified files, then the modified metadata
+
+    :changes: dict of list of books, see SyncLedger.get_changes
+    :limit: maximum number of books, None for no limit
+    :returns: dict of list of books with the same keys
+
+    """
+    if limit is None:
+        return changes
+    limited = dict()
+    for change in (BOOK_MISSING, BOOK_FILE_CHANGED, BOOK_METADATA_CHANGED):
+        books = changes.get(change, list())[:max(limit, 0)]
+        limit -= len(books)
+        limited[change] = books
+    limited[BOOK_UNCHANGED] = changes.get(BOOK_UNCHANGED, list())
+    return limited
+
+
+class CalibrolinoBatchView(View):
+
+    """view without interaction, for the scheduled syncs (cron, systemd
+    timers...). it runs one command, never prompts (the command line is
+    the confirmation of the questions of the controller), prints a json
+    summary on stdout and the messages on stderr (with anything else
+    printed during the command). start returns the exit code"""
+
+    def __init__(self, command: str, options=None, output=None):
+        """
+        :command: sync, status or delete
+        :options: argparse namespace with the options of the command (jobs,
+        dry_run, limit, missing_only, missing_locally)
+        :output: file of the json summary, stdout by default
+
+        """
+        self._command = command
+        self._options = options
+        self._output = output or sys.stdout
+        self._infos = list()
+        self._errors = list()
+        self._stats = None
+        self._commands = dict(
+                sync=self._sync,
+                status=self._status,
+                delete=self._delete,
+                )
+
+    @property
+    def controller(self) -> Controller:
+        return self._controller
+
+    @controller.setter
+    def controller(self, value: Controller):
+        self._controller = value
+
+    def showinfo(self, msg: str):
+        logging.info(msg)
+        self._infos.append(str(msg))
+
+    def showerror(self, msg: str):
+        print('error!', msg, file=sys.stderr)
+        self._errors.append(str(msg))
+
+    def askokcancel(self, msg: str) -> bool:
+        logging.info(f'{msg}: ok')
+        return True
+
+    def askyesno(self, msg: str) -> bool:
+        logging.info(f'{msg}: yes')
+        return True
+
+    def _get_option(self, name, default=None):
+        return getattr(self._options, name, default)
+
+    def start(self) -> int:
+        """run the command and print its summary
+
+        :returns: exit code
+
+        """
+        summary = dict(command=self._command)
+        if self._errors:
+            # the controller could not read calibre or use the credentials
+            exit_code = EXIT_NOT_CONFIGURED
+        elif self.controller.credentials is None:
+            self.showerror('no credentials. run calibrolino once to set them')
+            exit_code = EXIT_NOT_CONFIGURED
+        else:
+            self.controller.subscribe_progress(self._show_progress)
+            with redirect_stdout(sys.stderr):
+                exit_code = self._commands[self._command](summary)
+        summary['exit_code'] = exit_code
+        summary['errors'] = self._errors
+        summary['messages'] = self._infos
+        json.dump(summary, self._output)
+        self._output.write('\n')
+        self._output.flush()
+        return exit_code
+
+    def _show_progress(self, event):
+        """log the progress of the uploads and keep the last counters"""
+        if event.kind == BOOK_FINISHED:
+            logging.info(f"uploaded {event.book['full_title']} "
+                         f'({format_stats(event.stats)})')
+        elif event.kind == BOOK_FAILED:
+            logging.warning(f"upload of {event.book['full_title']} failed: "
+                            f'{event.error}')
+        self._stats = event.stats
+
+    def _sync(self, summary) -> int:
+        """upload the changes of the library. SIGTERM cancels the sync
+        after the books in progress"""
+        missing_only = self._get_option('missing_only', False)
+        changes = self.controller.get_sync_plan(delta=not missing_only)
+        if changes is None:
+            return EXIT_FAILED
+        changes = limit_changes(changes, self._get_option('limit'))
+        summary['planned'] = {
+                _CHANGE_NAMES[change]: len(books)
+                for change, books in changes.items()}
+        if self._get_option('dry_run', False):
+            summary['dry_run'] = True
+            summary['books'] = {
+                    _CHANGE_NAMES[change]: [
+                        book['full_title'] for book in books]
+                    for change, books in changes.items()
+                    if change != BOOK_UNCHANGED}
+            return EXIT_OK
+        previous_handler = signal.signal(
+                signal.SIGTERM, lambda signum, frame: self.controller.cancel())
+        try:
+            completed = self.controller.run_sync(
+                    changes, max_workers=self._get_option('jobs', 1))
+        except Exception as e:
+            self.showerror(e)
+            completed = None
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+        if self._stats is not None:
+            summary['progress'] = self._stats
+        if completed is None:
+            return EXIT_FAILED
+        summary['completed'] = completed
+        return EXIT_OK if completed else EXIT_CANCELLED
+
+    def _status(self, summary) -> int:
+        """count the local books, the online books and the planned
+        changes, without uploading anything"""
+        local_books = self.controller.local_books
+        online_books = self.controller.get_online_books()
+        changes = self.controller.get_sync_plan(delta=True)
+        if self._errors or changes is None:
+            return EXIT_FAILED
+        summary['local_books'] = len(local_books)
+        summary['online_books'] = len(online_books)
+        summary['missing_locally'] = sum(
+                1 for title in online_books if title not in local_books)
+        summary['planned'] = {
+                _CHANGE_NAMES[change]: len(books)
+                for change, books in changes.items()}
+        return EXIT_OK
+
+    def _delete(self, summary) -> int:
+        """delete from the cloud the books uploaded by calibrolino that are
+        not in the calibre library anymore. the books bought in the store
+        and the uploads unknown to the sync ledger are kept"""
+        if not self._get_option('missing_locally', False):
+            self.showerror('nothing to delete. use --missing-locally')
+            return EXIT_USAGE
+        local_books = self.controller.local_books
+        online_books = self.controller.get_uploaded_online_books()
+        if self._errors:
+            return EXIT_FAILED
+        if not local_books and online_books:
+            self.showerror(
+                    'the calibre library is empty, refusing to delete all '
+                    'the online books')
+            return EXIT_NOT_CONFIGURED
+        titles = [title for title in online_books if title not in local_books]
+        limit = self._get_option('limit')
+        if limit is not None:
+            titles = titles[:max(limit, 0)]
+        summary['planned'] = titles
+        if self._get_option('dry_run', False):
+            summary['dry_run'] = True
+            return EXIT_OK
+        deleted = list()
+        for title in titles:
+            errors = len(self._errors)
+            self.controller.delete_book(title)
+            if len(self._errors) == errors:
+                deleted.append(title)
+        summary['deleted'] = deleted
+        summary['failed'] = [title for title in titles if title not in deleted]
+        return EXIT_FAILED if summary['failed'] else EXIT_OK
+
+
 if __name__ == '__main__':
     view = CalibrolinoShellView()
     answer = view.askyesno('are you sure?')
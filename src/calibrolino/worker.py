@@ -0,0 +1,133 @@
+"""runs the long operations of the GUI (login, inventory, uploads...) in a
+background thread, so that the window keeps redrawing and answering. tkinter
+must only be used from its own thread: the worker sends everything that
+touches the window (results, errors, dialogs, progress) through a queue that
+the tkinter thread empties with process_queue."""
+
+
+import queue
+import logging
+import threading
+
+
+class BackgroundWorker(object):
+
+    """runs one job at a time in a background thread. the callbacks of the
+    jobs are posted in a queue and run by the thread that calls
+    process_queue (the tkinter thread)"""
+
+    def __init__(self, on_error=None):
+        """
+        :on_error: function called in the main thread with the exception
+        raised by a job. by default the exception is logged
+
+        """
+        self._on_error = on_error
+        self._queue = queue.Queue()
+        self._main_thread = threading.current_thread()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._job_name = None
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return self._thread is not None
+
+    @property
+    def job_name(self):
+        """name of the running job, None if the worker is idle"""
+        with self._lock:
+            return self._job_name
+
+    def submit(self, name, function, on_done=None) -> bool:
+        """run the function in the background thread
+
+        :name: name of the job, for the display
+        :function: function without argument
+        :on_done: function called in the main thread with the result of the
+        function, if it did not raise
+        :returns: False if a job is already running (the function is not
+        run)
+
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._job_name = name
+            self._thread = threading.Thread(
+                    target=self._run,
+                    args=(function, on_done),
+                    name=f'calibrolino-{name}',
+                    daemon=True,
+                    )
+            self._thread.start()
+        return True
+
+    def _run(self, function, on_done):
+        try:
+            result = function()
+        except Exception as e:
+            logging.exception(f'job {self._job_name} failed')
+            self.post(self._finish, self._on_error, e)
+        else:
+            self.post(self._finish, on_done, result)
+
+    def _finish(self, callback, value):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._job_name = None
+        if thread is not None:
+            thread.join()
+        if callback is not None:
+            callback(value)
+
+    def post(self, callback, *args):
+        """run the callback in the main thread, at the next process_queue.
+        can be called from any thread
+
+        """
+        self._queue.put((callback, args))
+
+    def run_in_main_thread(self, function, *args, **kwargs):
+        """call the function in the main thread and wait for its result.
+        from the main thread, the function is called directly
+
+        :returns: the result of the function
+        :raises: the exception raised by the function
+
+        """
+        if threading.current_thread() is self._main_thread:
+            return function(*args, **kwargs)
+        done = threading.Event()
+        outcome = dict()
+
+        def call():
+            try:
+                outcome['result'] = function(*args, **kwargs)
+            except Exception as e:
+                outcome['error'] = e
+            finally:
+                done.set()
+
+        self.post(call)
+        done.wait()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    def process_queue(self):
+        """run the posted callbacks. must be called regularly by the main
+        thread (e.g. with tkinter after)
+
+        """
+        while True:
+            try:
+                callback, args = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback(*args)
+            except Exception:
+                logging.exception('callback of the worker failed')
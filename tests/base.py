@@ -0,0 +1,40 @@
+import os
+import unittest
+import tempfile
+from unittest import mock
+
+
+from calibrolino.synthetic import create_library, write_calibre_config
+
+
+class SyntheticLibraryTestCase(unittest.TestCase):
+
+    """base of the tests on a synthetic calibre library. the library is
+    created in a temporary folder, and the xdg dirs (calibre config,
+    snapshot, ledger) point to this folder, so that the tests never use the
+    real library nor the real snapshot"""
+
+    n_books = 20
+    # other arguments of create_library
+    library_options = dict()
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.folder = tmp_dir.name
+        self.library_folder = os.path.join(self.folder, 'library')
+        self.db_path = create_library(
+                self.library_folder,
+                n_books=self.n_books,
+                **self.library_options,
+                )
+        write_calibre_config(
+                os.path.join(self.folder, 'config'), self.library_folder)
+        environ = dict(
+                XDG_CONFIG_HOME=os.path.join(self.folder, 'config'),
+                XDG_CACHE_HOME=os.path.join(self.folder, 'cache'),
+                XDG_DATA_HOME=os.path.join(self.folder, 'data'),
+                )
+        environ_patch = mock.patch.dict(os.environ, environ)
+        environ_patch.start()
+        self.addCleanup(environ_patch.stop)
@@ -0,0 +1,88 @@
+import unittest
+
+
+from calibrolino.controllers import get_library_frame, LIBRARY_COLUMNS
+from calibrolino.controllers import diff_library_frames, apply_library_diff
+
+
+class TestLibraryFrame(unittest.TestCase):
+
+    """all test concerning the table of the full library. """
+
+    def setUp(self):
+        self.local_books = {
+                f'title {i}': dict(
+                    book_id=i,
+                    uuid=f'uuid-{i}',
+                    size=1000 + i,
+                    last_modified=f'2024-01-0{i}',
+                    )
+                for i in range(1, 5)}
+        self.online_books = {
+                'title 1': 'pub-1',
+                'title 2': 'pub-2',
+                'only online': 'pub-x',
+                }
+        self.ledger_entries = {
+                'uuid-1': dict(
+                    uuid='uuid-1',
+                    publication_id='pub-1',
+                    last_modified='2024-01-01',
+                    ),
+                'uuid-2': dict(
+                    uuid='uuid-2',
+                    publication_id='pub-2',
+                    last_modified='2023-12-31',
+                    ),
+                'uuid-3': dict(
+                    uuid='uuid-3',
+                    publication_id='pub-3',
+                    last_modified='2024-01-03',
+                    ),
+                }
+
+    def test_columns(self):
+        df = get_library_frame(
+                self.local_books, self.online_books, self.ledger_entries)
+        self.assertEqual(list(df.columns), list(LIBRARY_COLUMNS))
+        self.assertEqual(list(df.index), [
+            'title 1', 'title 2', 'title 3', 'title 4', 'only online'])
+        self.assertEqual(list(df['local']), [True] * 4 + [False])
+        self.assertEqual(
+                list(df['online']), [True, True, False, False, True])
+        self.assertEqual(df.at['title 3', 'publicationId'], 'pub-3')
+        self.assertEqual(df.at['only online', 'publicationId'], 'pub-x')
+        self.assertEqual(df.at['title 4', 'size'], 1004)
+        self.assertEqual(
+                list(df['stale_metadata']),
+                [False, True, False, False, False])
+
+    def test_empty(self):
+        df = get_library_frame(dict(), dict(), dict())
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), list(LIBRARY_COLUMNS))
+
+    def test_diff(self):
+        old = get_library_frame(
+                self.local_books, self.online_books, self.ledger_entries)
+        del self.local_books['title 4']
+        self.local_books['title 5'] = dict(
+                book_id=5, uuid='uuid-5', size=None, last_modified='')
+        self.local_books['title 1']['size'] = None
+        self.online_books['title 3'] = 'pub-3'
+        new = get_library_frame(
+                self.local_books, self.online_books, self.ledger_entries)
+        diff = diff_library_frames(old, new)
+        self.assertEqual(list(diff.added), ['title 5'])
+        self.assertEqual(list(diff.removed), ['title 4'])
+        self.assertEqual(list(diff.changed), ['title 1', 'title 3'])
+        self.assertFalse(diff_library_frames(new, new))
+        displayed = old.sort_index(ascending=False)
+        updated = apply_library_diff(displayed, new, diff)
+        self.assertEqual(list(updated.index), [
+            'title 3', 'title 2', 'title 1', 'only online', 'title 5'])
+        self.assertTrue(updated.sort_index().equals(new.sort_index()))
+
+
+if __name__ == '__main__':
+    unittest.main()
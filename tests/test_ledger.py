@@ -0,0 +1,168 @@
+import os
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+
+from calibrolino.ledger import SyncLedger, get_metadata_fingerprint
+from calibrolino.ledger import BOOK_MISSING, BOOK_FILE_CHANGED
+from calibrolino.ledger import BOOK_METADATA_CHANGED, BOOK_UNCHANGED
+
+
+def make_book(book_id, full_title, file_path):
+    return dict(
+            title=full_title,
+            full_title=full_title,
+            authors=['author'],
+            uuid=f'uuid-{book_id}',
+            file_path=file_path,
+            publishers=[],
+            series_index=1.0,
+            serie_name=None,
+            tags=['tag'],
+            status=None,
+            isbn='',
+            pubdate='2020-01-01 00:00:00+00:00',
+            issued=1577836800,
+            languages=['eng'],
+            cover_path='',
+            has_cover=0,
+            last_modified='2020-01-01 00:00:00+00:00',
+            book_id=book_id,
+            )
+
+
+class TestSyncLedger(unittest.TestCase):
+
+    """all test concerning SyncLedger. """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        folder = Path(self._tmp_dir.name)
+        self.ledger = SyncLedger(path=folder / 'ledger.db')
+        self.local_books = dict()
+        for i in range(3):
+            file_path = folder / f'book {i}.epub'
+            file_path.write_bytes(b'epub')
+            self.local_books[f'book {i}'] = make_book(
+                    i, f'book {i}', file_path)
+
+    def tearDown(self):
+        self.ledger.close()
+        self._tmp_dir.cleanup()
+
+    def test_record_uploads(self):
+        books = list(self.local_books.values())
+        self.ledger.record_uploads(books, {'book 0': 'p0'})
+        entry = self.ledger.get('uuid-0')
+        self.assertEqual(entry['publication_id'], 'p0')
+        self.assertEqual(entry['file_size'], 4)
+        missing = self.ledger.get_missing_books(self.local_books)
+        self.assertEqual(len(missing), 2)
+
+    def test_forget(self):
+        books = list(self.local_books.values())
+        self.ledger.record_uploads(books, {'book 0': 'p0'})
+        self.ledger.forget('p0')
+        self.assertIsNone(self.ledger.get('uuid-0'))
+
+    def test_reconcile(self):
+        self.assertTrue(self.ledger.needs_reconcile())
+        books = list(self.local_books.values())
+        self.ledger.record_uploads(books, {'book 0': 'p0'})
+        self.ledger.reconcile(self.local_books, {'book 1': 'p1'})
+        self.assertFalse(self.ledger.needs_reconcile())
+        self.assertIsNone(self.ledger.get('uuid-0'))
+        self.assertEqual(self.ledger.get('uuid-1')['publication_id'], 'p1')
+        self.ledger.request_reconcile()
+        self.assertTrue(self.ledger.needs_reconcile())
+
+    def test_classify(self):
+        books = list(self.local_books.values())
+        self.ledger.record_uploads(
+                books, {'book 0': 'p0', 'book 1': 'p1', 'book 2': 'p2'})
+        book_0, book_1, book_2 = books
+        Path(book_0['file_path']).write_bytes(b'new epub')
+        book_1['tags'].append('new tag')
+        book_1['last_modified'] = '2021-01-01 00:00:00+00:00'
+        self.assertEqual(self.ledger.classify(book_0), BOOK_FILE_CHANGED)
+        self.assertEqual(self.ledger.classify(book_1), BOOK_METADATA_CHANGED)
+        self.assertEqual(self.ledger.classify(book_2), BOOK_UNCHANGED)
+        self.ledger.forget('p2')
+        changes = self.ledger.get_changes(self.local_books)
+        self.assertEqual(changes[BOOK_MISSING], [book_2])
+
+    def test_classify_mtime(self):
+        book_0, book_1 = list(self.local_books.values())[:2]
+        self.ledger.record_uploads([book_0], {'book 0': 'p0'})
+        with mock.patch('calibrolino.ledger.get_file_hash') as get_file_hash:
+            self.ledger.reconcile(
+                    self.local_books, {'book 0': 'p0', 'book 1': 'p1'})
+            get_file_hash.assert_not_called()
+        self.assertIsNone(self.ledger.get('uuid-1')['file_hash'])
+        for book in (book_0, book_1):
+            stat = os.stat(book['file_path'])
+            os.utime(book['file_path'], (stat.st_atime, stat.st_mtime + 10))
+        # same content: the new mtime is saved
+        self.assertEqual(self.ledger.classify(book_0), BOOK_UNCHANGED)
+        file_mtime = os.stat(book_0['file_path']).st_mtime
+        self.assertEqual(self.ledger.get('uuid-0')['file_mtime'], file_mtime)
+        with mock.patch('calibrolino.ledger.get_file_hash') as get_file_hash:
+            self.assertEqual(self.ledger.classify(book_0), BOOK_UNCHANGED)
+            get_file_hash.assert_not_called()
+        # no hash to compare with
+        self.assertEqual(self.ledger.classify(book_1), BOOK_FILE_CHANGED)
+
+    def test_checkpoint(self):
+        book = self.local_books['book 0']
+        self.assertEqual(self.ledger.get_progress(book), (None, set()))
+        self.ledger.save_step(book, 'upload', 'p0')
+        self.ledger.save_step(book, 'cover', 'p0')
+        publication_id, steps = self.ledger.get_progress(book)
+        self.assertEqual(publication_id, 'p0')
+        self.assertEqual(steps, {'upload', 'cover'})
+        self.assertIsNone(self.ledger.get('uuid-0'))
+        self.ledger.finish(book, 'p0')
+        self.assertEqual(self.ledger.get_progress(book), (None, set()))
+        self.assertEqual(self.ledger.get('uuid-0')['publication_id'], 'p0')
+
+    def test_obsolete_copies(self):
+        book = self.local_books['book 0']
+        self.ledger.finish(book, 'p0')
+        self.assertEqual(self.ledger.obsolete_copies, [])
+        # an id marked before its replacement is uploaded is kept
+        self.ledger.add_obsolete_copies(['p0'])
+        self.assertEqual(self.ledger.obsolete_copies, [])
+        self.ledger.save_step(book, 'upload', 'p1')
+        self.assertEqual(self.ledger.obsolete_copies, [])
+        self.ledger.finish(book, 'p1')
+        self.assertEqual(self.ledger.obsolete_copies, ['p0'])
+        self.ledger.forget('p0')
+        self.assertEqual(self.ledger.obsolete_copies, [])
+
+    def test_publication_ids(self):
+        book_0, book_1, book_2 = self.local_books.values()
+        self.ledger.finish(book_0, 'p0')
+        self.ledger.save_step(book_1, 'upload', 'p1')
+        self.ledger.add_obsolete_copies(['p2'])
+        self.assertEqual(self.ledger.publication_ids, {'p0', 'p1', 'p2'})
+
+    def test_reconcile_progress(self):
+        book_0 = self.local_books['book 0']
+        book_1 = self.local_books['book 1']
+        self.ledger.save_step(book_0, 'upload', 'p0')
+        self.ledger.save_step(book_1, 'upload', 'p1')
+        self.ledger.reconcile(self.local_books, {'book 1': 'p1'})
+        self.assertEqual(self.ledger.get_progress(book_0), (None, set()))
+        self.assertEqual(self.ledger.get_progress(book_1), ('p1', {'upload'}))
+
+    def test_metadata_fingerprint(self):
+        book = self.local_books['book 0']
+        fingerprint = get_metadata_fingerprint(book)
+        book['tags'].append('new tag')
+        self.assertNotEqual(fingerprint, get_metadata_fingerprint(book))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+import os
+import time
+import pickle
+import sqlite3
+import unittest
+import threading
+
+
+from calibrolino.library import LibraryIndex, BookRecord, normalize_isbn
+from calibrolino.library import get_deep_size
+from calibrolino.models import CalibreDBReader, CalibrolinoException
+from calibrolino.models import CalibreDBConnections
+from calibrolino.models import TAG_ADD, TAG_REMOVE
+from tests.base import SyntheticLibraryTestCase
+
+
+def make_book(book_id, full_title, **values):
+    book = dict(
+            book_id=book_id,
+            uuid=f'uuid-{book_id}',
+            full_title=full_title,
+            isbn='',
+            tags=list(),
+            authors=['author'],
+            serie_name=None,
+            status=None,
+            last_modified='2024-01-01',
+            )
+    book.update(values)
+    return book
+
+
+class TestLibraryIndex(unittest.TestCase):
+
+    """all test concerning LibraryIndex. """
+
+    def setUp(self):
+        self.index = LibraryIndex([
+            make_book(3, 'same title', tags=['a'], isbn='978-3-16-148410-0'),
+            make_book(1, 'same title', tags=['a', 'b'], status=['read']),
+            make_book(2, 'other', serie_name='serie'),
+            ])
+
+    def test_lookups(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.get_by_uuid('uuid-2')['book_id'], 2)
+        self.assertEqual(self.index.titles['same title']['book_id'], 1)
+        self.assertEqual(
+                [book['book_id'] for book in self.index.find(
+                    'title', 'same title')],
+                [3, 1])
+        self.assertEqual(
+                self.index.find('isbn', '9783161484100')[0]['book_id'], 3)
+        self.assertEqual(len(self.index.find('tag', 'a')), 2)
+        self.assertEqual(len(self.index.find('series', 'serie')), 1)
+        self.assertEqual(len(self.index.find('status', 'read')), 1)
+        self.assertEqual(self.index.count('author'), dict(author=3))
+        self.assertEqual(list(self.index.duplicate_titles()), ['same title'])
+        self.assertEqual(normalize_isbn(' 0-306-40615-x '), '030640615X')
+
+    def test_mutations(self):
+        self.assertTrue(self.index.add_tag(2, 'a'))
+        self.assertFalse(self.index.add_tag(2, 'a'))
+        self.assertEqual(len(self.index.find('tag', 'a')), 3)
+        self.assertTrue(self.index.remove_tag(1, 'b'))
+        self.assertEqual(self.index.find('tag', 'b'), list())
+        self.assertNotIn('b', self.index.count('tag'))
+        self.index.update(2, full_title='new title', last_modified='x')
+        self.assertNotIn('other', self.index.titles)
+        self.assertEqual(self.index.titles['new title']['last_modified'], 'x')
+        self.index.discard(1)
+        self.assertEqual(self.index.titles['same title']['book_id'], 3)
+        self.assertEqual(self.index.find('status', 'read'), list())
+        self.index.discard(3)
+        self.assertNotIn('same title', self.index.titles)
+        self.assertIsNone(self.index.get_by_uuid('uuid-3'))
+        self.assertIsNone(self.index.discard(3))
+
+
+def make_record(book_id, **values):
+    record_values = dict(
+            title=f'title {book_id}',
+            full_title=f'title {book_id}',
+            authors=['author'],
+            uuid=f'uuid-{book_id}',
+            size=1000,
+            publishers=list(),
+            series_index=1.0,
+            serie_name=None,
+            tags=['tag'],
+            status=None,
+            isbn='',
+            pubdate='2020-01-01 00:00:00+00:00',
+            languages=['eng'],
+            has_cover=1,
+            last_modified='2024-01-01',
+            book_id=book_id,
+            )
+    record_values.update(values)
+    return BookRecord(
+            '/library', f'author/title {book_id} ({book_id})',
+            f'title {book_id} - author', 'EPUB', **record_values)
+
+
+class TestBookRecord(unittest.TestCase):
+
+    """all test concerning BookRecord. """
+
+    def test_dict(self):
+        book = make_record(1)
+        self.assertEqual(len(dict(book)), len(BookRecord.KEYS))
+        self.assertEqual(
+                book['file_path'],
+                '/library/author/title 1 (1)/title 1 - author.epub')
+        self.assertEqual(
+                book['cover_path'], '/library/author/title 1 (1)/cover.jpg')
+        self.assertEqual(book['issued'], 1577836800)
+        self.assertEqual(book['tags'], ('tag',))
+        self.assertIsNone(book.get('unknown'))
+        with self.assertRaises(KeyError):
+            book['file_path'] = 'other path'
+        book.update(dict(last_modified='2025-01-01'))
+        self.assertEqual(book['last_modified'], '2025-01-01')
+        self.assertEqual(pickle.loads(pickle.dumps(book)), book)
+
+    def test_shared_names(self):
+        books = [make_record(i, authors=[f'author {i % 2}']) for i in range(4)]
+        self.assertIs(books[0]['authors'], books[2]['authors'])
+        self.assertIs(books[0]['languages'], books[1]['languages'])
+        dict_books = [dict(book) for book in books]
+        self.assertLess(get_deep_size(books), get_deep_size(dict_books))
+
+
+class TestLibraryIndexOfReader(SyntheticLibraryTestCase):
+
+    """the index of CalibreDBReader follows the changes of calibre. """
+
+    def test_duplicate_title(self):
+        con = sqlite3.connect(self.db_path)
+        with con:
+            con.execute('DELETE FROM books_series_link WHERE book IN (1, 2)')
+            con.execute("UPDATE books SET title = 'twin' WHERE id IN (1, 2)")
+            con.execute(
+                    "UPDATE books SET last_modified = '2030-01-01 00:00:00' "
+                    'WHERE id IN (1, 2)')
+        con.close()
+        reader = CalibreDBReader()
+        self.assertEqual(len(reader.index), 20)
+        self.assertEqual(len(reader.index.find('title', 'twin')), 2)
+        self.assertEqual(reader.books['twin']['book_id'], 1)
+        book = reader.index.get(2)
+        self.assertIs(reader.index.get_by_uuid(book['uuid']), book)
+        reader.apply_tag_changes([(2, TAG_ADD, 'new tag')])
+        self.assertEqual(reader.index.find('tag', 'new tag'), [book])
+        self.assertIn('new tag', reader.books['twin']['tags'] + book['tags'])
+        with self.assertRaises(TypeError):
+            reader.books['other'] = book
+        reader = CalibreDBReader()
+        self.assertEqual(len(reader.index.find('tag', 'new tag')), 1)
+
+    def test_failed_tag_write(self):
+        reader = CalibreDBReader(busy_timeout=0.01)
+        book = next(book for book in reader.index if book['tags'])
+        tags = book['tags']
+        changes = [
+                (book['book_id'], TAG_ADD, 'new tag'),
+                (book['book_id'], TAG_REMOVE, tags[0]),
+                ]
+        con = sqlite3.connect(self.db_path)
+        con.execute('BEGIN EXCLUSIVE')
+        try:
+            with self.assertRaises(CalibrolinoException):
+                reader.apply_tag_changes(changes)
+        finally:
+            con.rollback()
+            con.close()
+        self.assertEqual(book['tags'], tags)
+        self.assertEqual(reader.index.find('tag', 'new tag'), [])
+        self.assertEqual(reader.apply_tag_changes(changes), 2)
+        self.assertEqual(reader.index.find('tag', 'new tag'), [book])
+
+
+class TestCalibreDBConnections(SyntheticLibraryTestCase):
+
+    """all test concerning the connections to the calibre db. """
+
+    n_books = 5
+
+    def count_books(self, con):
+        return con.execute('SELECT count(*) FROM books').fetchone()[0]
+
+    def add_book(self, db):
+        with db.writer() as con:
+            con.execute(
+                    "INSERT INTO books (title, uuid) VALUES ('new', 'new')")
+
+    def read_in_thread(self, db):
+        connections = list()
+        thread = threading.Thread(
+                target=lambda: connections.append(db.reader))
+        thread.start()
+        thread.join()
+        return connections[0]
+
+    def test_read_only(self):
+        db = CalibreDBConnections(self.db_path)
+        with self.assertRaises(sqlite3.OperationalError):
+            db.reader.execute('DELETE FROM books')
+        self.add_book(db)
+        self.assertEqual(self.count_books(db.reader), 6)
+        db.close()
+
+    def test_threads(self):
+        db = CalibreDBConnections(self.db_path)
+        con = self.read_in_thread(db)
+        self.assertIsNot(con, db.reader)
+        self.read_in_thread(db)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.count_books(con)
+        con = db.reader
+        db.release()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.count_books(con)
+        db.close()
+
+    def test_copy(self):
+        db = CalibreDBConnections(self.db_path, read_from_copy=True)
+        self.add_book(db)
+        self.assertEqual(self.count_books(db.reader), 5)
+        # a thread that is still reading the copy
+        reading = threading.Event()
+        done = threading.Event()
+        counts = list()
+
+        def read():
+            con = db.reader
+            reading.set()
+            done.wait()
+            counts.append(self.count_books(con))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        reading.wait()
+        old_copy = db._copy_path
+        db.update_copy()
+        self.assertEqual(self.count_books(db.reader), 6)
+        done.set()
+        thread.join()
+        self.assertEqual(counts, [5])
+        self.assertTrue(os.path.exists(old_copy))
+        self.read_in_thread(db)
+        self.assertFalse(os.path.exists(old_copy))
+        copy_path = db._copy_path
+        db.close()
+        self.assertFalse(os.path.exists(copy_path))
+
+    def test_busy_timeout(self):
+        db = CalibreDBConnections(self.db_path, busy_timeout=0.1)
+        con = sqlite3.connect(self.db_path)
+        con.execute('BEGIN EXCLUSIVE')
+        start = time.perf_counter()
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                self.add_book(db)
+        finally:
+            con.rollback()
+            con.close()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.1)
+        self.add_book(db)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,14 @@
+import os
+import sqlite3
 import unittest
 from pathlib import Path
+from unittest import mock
 
 
 from calibrolino.models import CalibreDBReader, get_serie_title, CalibrolinoException
+from calibrolino.models import TAG_ADD, TAG_REMOVE
+from calibrolino.models import _parse_added_book_ids
+from tests.base import SyntheticLibraryTestCase
 
 TEST_BOOK_TITLE = 'added by calibrolino'
 TEST_BOOK_FN = 'minimal-v3.epub'
@@ -60,6 +66,146 @@ class TestCalibreDBReader(unittest.TestCase):
         self.assertIn(serie_index, new_title)
 
 
+class TestCalibreDBReaderRefresh(SyntheticLibraryTestCase):
+
+    """refresh and snapshot of CalibreDBReader on a synthetic library. the
+    snapshot is written in a temporary cache dir. """
+
+    def change_library(self):
+        """add a copy of book 1, remove book 2 and rename book 3, like
+        calibre would do
+
+        :returns: id of the added book
+
+        """
+        last_modified = '2030-01-01 00:00:00+00:00'
+        con = sqlite3.connect(self.db_path)
+        with con:
+            res = con.execute("""
+            INSERT INTO books (title, sort, pubdate, series_index,
+                author_sort, isbn, path, uuid, has_cover, last_modified)
+            SELECT 'Added book', 'Added book', pubdate, series_index,
+                author_sort, isbn, path, 'added-uuid', has_cover, ?
+            FROM books WHERE id = 1
+            """, (last_modified,))
+            book_id = res.lastrowid
+            con.execute("""
+            INSERT INTO data (book, format, uncompressed_size, name)
+            SELECT ?, format, uncompressed_size, name FROM data WHERE book = 1
+            """, (book_id,))
+            con.execute("""
+            INSERT INTO books_authors_link (book, author)
+            SELECT ?, author FROM books_authors_link WHERE book = 1
+            ORDER BY id
+            """, (book_id,))
+            con.execute('DELETE FROM books WHERE id = 2')
+            con.execute(
+                    "UPDATE books SET title = 'Renamed book', "
+                    'last_modified = ? WHERE id = 3', (last_modified,))
+        con.close()
+        return book_id
+
+    def get_books(self, calibre_db_reader):
+        return {
+                book['book_id']: dict(book)
+                for book in calibre_db_reader.index}
+
+    def check_changes(self, calibre_db_reader, book_id):
+        index = calibre_db_reader.index
+        self.assertEqual(len(index), self.n_books)
+        self.assertEqual(index.get(book_id)['title'], 'Added book')
+        self.assertEqual(
+                index.get(book_id)['authors'], index.get(1)['authors'])
+        self.assertNotIn(2, index)
+        self.assertEqual(index.get(3)['title'], 'Renamed book')
+        self.assertEqual(
+                self.get_books(calibre_db_reader),
+                self.get_books(CalibreDBReader(use_snapshot=False)))
+
+    def check_refresh(self, calibre_db_reader):
+        books = self.get_books(calibre_db_reader)
+        self.assertFalse(calibre_db_reader.refresh())
+        self.assertEqual(self.get_books(calibre_db_reader), books)
+        book_id = self.change_library()
+        self.assertTrue(calibre_db_reader.refresh())
+        self.check_changes(calibre_db_reader, book_id)
+        self.assertFalse(calibre_db_reader.refresh())
+
+    def test_refresh(self):
+        self.check_refresh(CalibreDBReader(use_snapshot=False))
+
+    def test_refresh_from_copy(self):
+        self.check_refresh(
+                CalibreDBReader(use_snapshot=False, read_from_copy=True))
+
+    def test_snapshot(self):
+        snapshot_path = os.path.join(
+                self.folder, 'cache', 'calibrolino', 'library_snapshot.pickle')
+        books = self.get_books(CalibreDBReader())
+        self.assertTrue(os.path.exists(snapshot_path))
+        with mock.patch.object(CalibreDBReader, 'read_db') as read_db:
+            calibre_db_reader = CalibreDBReader()
+            read_db.assert_not_called()
+        self.assertEqual(self.get_books(calibre_db_reader), books)
+        # the changes made while calibrolino was closed are read
+        book_id = self.change_library()
+        with mock.patch.object(CalibreDBReader, 'read_db') as read_db:
+            calibre_db_reader = CalibreDBReader()
+            read_db.assert_not_called()
+        self.check_changes(calibre_db_reader, book_id)
+
+    def test_snapshot_pending_tags(self):
+        calibre_db_reader = CalibreDBReader()
+        book = calibre_db_reader.index.get(1)
+        calibre_db_reader.add_tag(book, 'pending tag')
+        self.change_library()
+        con = sqlite3.connect(self.db_path)
+        with con:
+            con.execute(
+                    "UPDATE books SET last_modified = '2030-01-02 00:00:00' "
+                    'WHERE id = 1')
+        con.close()
+        # book 1 is read again, its pending tag is kept
+        self.assertTrue(calibre_db_reader.refresh())
+        self.assertIn('pending tag', calibre_db_reader.index.get(1)['tags'])
+        # the snapshot has no tags that are not in the db
+        with mock.patch.object(CalibreDBReader, 'read_db') as read_db:
+            other_reader = CalibreDBReader()
+            read_db.assert_not_called()
+        self.assertNotIn('pending tag', other_reader.index.get(1)['tags'])
+        calibre_db_reader.commit()
+        for other_reader in (
+                CalibreDBReader(), CalibreDBReader(use_snapshot=False)):
+            self.assertIn('pending tag', other_reader.index.get(1)['tags'])
+
+    def test_invalid_snapshot(self):
+        snapshot_path = os.path.join(
+                self.folder, 'cache', 'calibrolino', 'library_snapshot.pickle')
+        books = self.get_books(CalibreDBReader())
+        for content in (
+                b'not a pickle',
+                # a snapshot whose classes cannot be imported anymore
+                b'cno_such_module\nBookRecord\n)R.',
+                ):
+            with open(snapshot_path, 'wb') as myfile:
+                myfile.write(content)
+            self.assertEqual(self.get_books(CalibreDBReader()), books)
+
+
+class TestCalibreDBOutput(unittest.TestCase):
+
+    """parsing of the output of calibredb"""
+
+    def test_parse_added_book_ids(self):
+        output = 'Added book ids: 12, 13, 14\n'
+        self.assertEqual(_parse_added_book_ids(output), [12, 13, 14])
+        output = (
+                'The following books were not added as they already exist '
+                'in the database (see --duplicates option):\n'
+                '  Some book\n')
+        self.assertEqual(_parse_added_book_ids(output), [])
+
+
 """ script tests """
 
 def add_tag_test(calibre_db):
@@ -83,6 +229,7 @@ def full_test():
     add_tag_test(calibre_db)
     rm_tag_test(calibre_db)
     calibre_db.commit()
+    apply_tag_changes_test(calibre_db)
     rm_book_test(calibre_db)
 
 def rm_tag_test(calibre_db):
@@ -99,6 +246,20 @@ def rm_tag_test(calibre_db):
             book = books[title]
             print('tags', book['tags'])
 
+def apply_tag_changes_test(calibre_db):
+    book = calibre_db.books[TEST_BOOK_TITLE]
+    book_id = book['book_id']
+    changes = [
+            (book_id, TAG_ADD, 'test1'),
+            (book_id, TAG_ADD, 'test2'),
+            (book_id, TAG_REMOVE, 'test1'),
+            ]
+    count = calibre_db.apply_tag_changes(changes)
+    print(f'{count} tag changes applied')
+    print('tags', calibre_db.books[TEST_BOOK_TITLE]['tags'])
+    calibre_db.apply_tag_changes([(book_id, TAG_REMOVE, 'test2')])
+    print('tags', calibre_db.books[TEST_BOOK_TITLE]['tags'])
+
 def add_book_test(calibre_db):
     calibre_db.add_book(test_book_fp, title=TEST_BOOK_TITLE)
 
@@ -0,0 +1,58 @@
+import os
+import pstats
+import unittest
+import tempfile
+
+
+from calibrolino.profiling import span, start_profiling, stop_profiling
+from calibrolino.profiling import get_profiler, parse_profile_options
+
+
+class TestProfiling(unittest.TestCase):
+
+    """all test concerning the profiling of the phases. """
+
+    def tearDown(self):
+        stop_profiling()
+
+    def test_span(self):
+        with span('off'):
+            pass
+        self.assertIsNone(get_profiler())
+        profiler = start_profiling(trace_memory=True)
+        for i in range(3):
+            with span('phase'):
+                data = bytearray(1 << 20)
+        with self.assertRaises(ValueError):
+            with span('failed'):
+                raise ValueError
+        self.assertIs(stop_profiling(), profiler)
+        summary = profiler.summary()
+        self.assertEqual(list(summary), ['phase', 'failed'])
+        self.assertEqual(summary['phase']['count'], 3)
+        self.assertGreaterEqual(profiler.peak_memory, len(data))
+        self.assertIn('phase', profiler.report())
+
+    def test_pstats(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'calibrolino.pstats')
+            start_profiling(pstats_path=path)
+            with span('phase'):
+                sorted(range(1000))
+            stop_profiling()
+            stats = pstats.Stats(path)
+            self.assertTrue(stats.total_calls)
+
+    def test_parse_profile_options(self):
+        self.assertFalse(parse_profile_options(None)['profile'])
+        self.assertFalse(parse_profile_options('0')['profile'])
+        self.assertTrue(parse_profile_options('1')['profile'])
+        options = parse_profile_options('memory, pstats=/tmp/a.pstats')
+        self.assertTrue(options['profile'])
+        self.assertTrue(options['trace_memory'])
+        self.assertEqual(options['pstats_path'], '/tmp/a.pstats')
+        self.assertIsNone(options['report_path'])
+
+
+if __name__ == '__main__':
+    unittest.main()
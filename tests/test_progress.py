@@ -0,0 +1,75 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+
+from calibrolino.progress import ProgressTracker, format_stats
+from calibrolino.progress import BATCH_STARTED, BOOK_STARTED, STEP_FINISHED
+from calibrolino.progress import BYTES_SENT, BOOK_FINISHED, BOOK_FAILED
+from calibrolino.progress import BATCH_FINISHED
+
+
+class TestProgressTracker(unittest.TestCase):
+
+    """all test concerning ProgressTracker. """
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.books = list()
+        for i in range(3):
+            file_path = Path(self._tmp_dir.name) / f'book{i}.epub'
+            file_path.write_bytes(b'x' * 100)
+            self.books.append(dict(
+                uuid=f'uuid-{i}',
+                full_title=f'book {i}',
+                file_path=file_path.as_posix(),
+                ))
+        self.tracker = ProgressTracker()
+        self.events = list()
+        self.tracker.subscribe(self.events.append)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_events(self):
+        book1, book2, book3 = self.books
+        self.tracker.start_batch(self.books)
+        self.tracker.book_started(book1)
+        self.tracker.bytes_sent(book1, 100)
+        self.tracker.step_finished(book1, 'upload', 0.1)
+        self.tracker.book_finished(book1)
+        self.tracker.book_started(book2)
+        self.tracker.book_failed(book2, ValueError('failed'))
+        self.tracker.finish_batch()
+        kinds = [event.kind for event in self.events]
+        self.assertEqual(kinds, [
+            BATCH_STARTED,
+            BOOK_STARTED,
+            BYTES_SENT,
+            STEP_FINISHED,
+            BOOK_FINISHED,
+            BOOK_STARTED,
+            BOOK_FAILED,
+            BATCH_FINISHED,
+            ])
+        stats = self.events[-1].stats
+        self.assertEqual(stats['books_total'], 3)
+        self.assertEqual(stats['books_done'], 1)
+        self.assertEqual(stats['books_failed'], 1)
+        self.assertEqual(stats['bytes_total'], 300)
+        self.assertEqual(stats['bytes_sent'], 100)
+        self.assertIsNotNone(stats['eta'])
+        self.assertIsNotNone(self.events[4].duration)
+        self.assertIn('1/3 books', format_stats(stats))
+
+    def test_failing_subscriber(self):
+        def fail(event):
+            raise ValueError('subscriber failed')
+
+        self.tracker.subscribe(fail)
+        self.tracker.start_batch(self.books)
+        self.assertEqual(len(self.events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
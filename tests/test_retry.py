@@ -0,0 +1,60 @@
+import time
+import unittest
+
+
+from calibrolino.retry import RetryPolicy, RateLimiter
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    """all test concerning RetryPolicy. """
+
+    def test_get_delay(self):
+        policy = RetryPolicy(base_delay=1., max_delay=5., jitter=False)
+        delays = [policy.get_delay(retry) for retry in range(5)]
+        self.assertEqual(delays, [1., 2., 4., 5., 5.])
+        policy.jitter = True
+        for retry in range(5):
+            self.assertLessEqual(policy.get_delay(retry), delays[retry])
+
+    def test_call(self):
+        policy = RetryPolicy(max_retries=2, base_delay=0.)
+        attempts = list()
+
+        def method():
+            attempts.append(None)
+            if len(attempts) < 3:
+                raise ValueError('transient')
+            return 'ok'
+
+        self.assertEqual(policy.call(method, exceptions=(ValueError,)), 'ok')
+        self.assertEqual(len(attempts), 3)
+        attempts.clear()
+        policy.max_retries = 1
+        with self.assertRaises(ValueError):
+            policy.call(method, exceptions=(ValueError,))
+        self.assertEqual(len(attempts), 2)
+        with self.assertRaises(KeyError):
+            policy.call(
+                    lambda: {}['a'], exceptions=(ValueError,))
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    """all test concerning RateLimiter. """
+
+    def test_acquire(self):
+        limiter = RateLimiter(rate=50., burst=5)
+        start = time.monotonic()
+        for i in range(5):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+        for i in range(10):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        limiter = RateLimiter(rate=None)
+        self.assertEqual(limiter.acquire(), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+import io
+import os
+import json
+import asyncio
+import argparse
+import unittest
+from unittest import mock
+from contextlib import redirect_stdout
+
+
+from calibrolino.models import CalibreDBReader, CalibrolinoException
+from calibrolino.models import AsyncTolinoCloud
+from calibrolino.standin import StandinServer, StandinConfig
+from calibrolino.standin import StandinRequestHandler
+from calibrolino.retry import RetryPolicy, RateLimiter
+from calibrolino.ledger import SyncLedger
+from calibrolino.controllers import CalibrolinoController
+from calibrolino.views import CalibrolinoBatchView
+from calibrolino.progress import ProgressTracker, BOOK_FINISHED
+from tests.base import SyntheticLibraryTestCase
+
+
+class TestStandinServer(SyntheticLibraryTestCase):
+
+    """all test concerning the stand-in of the tolino cloud. """
+
+    n_books = 5
+
+    def setUp(self):
+        SyntheticLibraryTestCase.setUp(self)
+        self.books = CalibreDBReader(use_snapshot=False).books
+
+    def test_sync(self):
+        with StandinServer() as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    rate_limiter=RateLimiter(rate=None))
+            tolino_cloud.upload_books(self.books.values(), max_workers=2)
+            # the inventory is downloaded only before a retry
+            self.assertNotIn('inventory', server.state.stats['requests'])
+            uploaded_books = tolino_cloud.get_uploaded_books()
+            self.assertEqual(set(uploaded_books), set(self.books))
+            for full_title, book_id in uploaded_books.items():
+                book = self.books[full_title]
+                online_book = server.state.books[book_id]
+                collections = set(book['tags']) | set(book['status'] or [])
+                self.assertEqual(online_book['collections'], collections)
+                self.assertEqual(online_book['cover'], book['has_cover'])
+            # nothing is printed on the json output of the batch commands
+            full_title, book_id = next(iter(uploaded_books.items()))
+            with redirect_stdout(io.StringIO()) as stdout:
+                tolino_cloud.upload_metadata(self.books[full_title], book_id)
+            self.assertEqual(stdout.getvalue(), '')
+            tolino_cloud.delete_book(next(iter(uploaded_books.values())))
+            tolino_cloud.invalidate_inventory()
+            self.assertEqual(len(tolino_cloud.get_uploaded_books()), 4)
+
+    def test_async_sync(self):
+        with StandinServer() as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    rate_limiter=RateLimiter(rate=None))
+            async_cloud = AsyncTolinoCloud(tolino_cloud, max_concurrency=4)
+            try:
+                books = list(self.books.values())
+                uploaded_books = asyncio.run(async_cloud.upload_books(books))
+                self.assertEqual(set(uploaded_books), set(self.books))
+                # the uploads are added to the inventory of the TolinoCloud
+                self.assertEqual(
+                        tolino_cloud.get_uploaded_books(), uploaded_books)
+                for full_title, book_id in uploaded_books.items():
+                    book = self.books[full_title]
+                    online_book = server.state.books[book_id]
+                    collections = (
+                            set(book['tags']) | set(book['status'] or []))
+                    self.assertEqual(online_book['collections'], collections)
+                    self.assertEqual(online_book['cover'], book['has_cover'])
+                asyncio.run(async_cloud.delete_book(
+                    next(iter(uploaded_books.values()))))
+                self.assertEqual(len(server.state.books), 4)
+            finally:
+                async_cloud.close()
+
+    def test_inventory_changes(self):
+        with StandinServer() as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    rate_limiter=RateLimiter(rate=None))
+            get_inventory = tolino_cloud.client.get_inventory
+
+            def upload_during_download(*args, **kwargs):
+                inventory = get_inventory(*args, **kwargs)
+                # an upload of another thread finishes before the answer
+                tolino_cloud.add_to_inventory({'other book': 'other id'})
+                return inventory
+
+            with mock.patch.object(
+                    tolino_cloud.client, 'get_inventory',
+                    upload_during_download):
+                uploaded_books = tolino_cloud.get_uploaded_books()
+            self.assertEqual(uploaded_books, {'other book': 'other id'})
+            self.assertEqual(
+                    tolino_cloud.get_uploaded_books(), uploaded_books)
+
+    def test_errors(self):
+        config = StandinConfig(error_rate=0.2, seed=0)
+        retry_policy = RetryPolicy(max_retries=10, base_delay=0.001)
+        with StandinServer(config) as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    retry_policy=retry_policy,
+                    rate_limiter=RateLimiter(rate=None))
+            tolino_cloud.upload_books(self.books.values())
+            self.assertEqual(len(server.state.books), 5)
+            self.assertTrue(server.state.stats['errors'].get(503))
+
+    def test_login_errors(self):
+        config = StandinConfig(error_rate=1., throttle_rate=1)
+        retry_policy = RetryPolicy(max_retries=2, base_delay=0.001)
+        with StandinServer(config) as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    retry_policy=retry_policy,
+                    rate_limiter=RateLimiter(rate=None))
+            with self.assertRaises(CalibrolinoException):
+                tolino_cloud.upload_books(list(self.books.values())[:1])
+            requests = server.state.stats['requests']
+            self.assertTrue(requests.pop('token'))
+            requests.pop('devices', None)
+            self.assertEqual(
+                    sum(server.state.stats['errors'].values()),
+                    sum(requests.values()))
+
+    def test_lost_upload(self):
+        upload = StandinRequestHandler._upload
+        statuses = list()
+
+        def lose_first_answer(handler, *args):
+            status, data = upload(handler, *args)
+            statuses.append(status)
+            if len(statuses) == 1:
+                return 503, dict(error='service unavailable')
+            return status, data
+
+        retry_policy = RetryPolicy(max_retries=2, base_delay=0.001)
+        with mock.patch.object(
+                StandinRequestHandler, '_upload', lose_first_answer):
+            with StandinServer() as server:
+                tolino_cloud = server.create_tolino_cloud(
+                        retry_policy=retry_policy,
+                        rate_limiter=RateLimiter(rate=None))
+                tolino_cloud.get_uploaded_books()
+                uploaded_books = tolino_cloud.upload_books(
+                        list(self.books.values())[:1])
+                self.assertEqual(statuses, [200])
+                self.assertEqual(
+                        list(uploaded_books.values()),
+                        list(server.state.books))
+                # without the inventory before the first attempt, the book
+                # found could be an older copy
+                statuses.clear()
+                tolino_cloud.invalidate_inventory()
+                with self.assertRaises(CalibrolinoException):
+                    tolino_cloud.upload_books(list(self.books.values())[1:2])
+                self.assertEqual(statuses, [200])
+                self.assertEqual(len(server.state.books), 2)
+
+    def test_lost_upload_other_book(self):
+        upload = StandinRequestHandler._upload
+        servers = list()
+
+        def fail_first_upload(handler, *args):
+            if servers:
+                # another thread uploads a book, its id is not claimed yet
+                state = servers.pop().state
+                book_id = state.new_id()
+                with state.lock:
+                    state.books[book_id] = dict(
+                            metadata=dict(
+                                title='other book', deliverableId=book_id),
+                            collections=set(),
+                            size=0,
+                            cover=False,
+                            )
+                return 503, dict(error='service unavailable')
+            return upload(handler, *args)
+
+        retry_policy = RetryPolicy(max_retries=2, base_delay=0.001)
+        with mock.patch.object(
+                StandinRequestHandler, '_upload', fail_first_upload):
+            with StandinServer() as server:
+                servers.append(server)
+                tolino_cloud = server.create_tolino_cloud(
+                        retry_policy=retry_policy,
+                        rate_limiter=RateLimiter(rate=None))
+                tolino_cloud.get_uploaded_books()
+                book = next(iter(self.books.values()))
+                book_id = tolino_cloud.upload_file(book)
+                self.assertEqual(len(server.state.books), 2)
+                self.assertNotEqual(
+                        server.state.books[book_id]['metadata']['title'],
+                        'other book')
+
+    def test_delete_missing_locally(self):
+        credentials = dict(
+                partner='orellfuessli', username='standin',
+                password='password')
+        options = argparse.Namespace(
+                missing_locally=True, dry_run=False, limit=None)
+        output = io.StringIO()
+        view = CalibrolinoBatchView('delete', options, output)
+        with mock.patch.object(
+                CalibrolinoController, 'credentials',
+                new_callable=mock.PropertyMock, return_value=credentials):
+            with StandinServer() as server:
+                controller = CalibrolinoController(view)
+                controller._tolino_cloud = server.create_tolino_cloud(
+                        rate_limiter=RateLimiter(rate=None))
+                view.controller = controller
+                books = list(self.books.values())
+                controller._tolino_cloud.upload_books(
+                        books, checkpoint=controller._ledger)
+                purchased_id = server.add_purchased_book('bought book')
+                unknown_id = server.add_purchased_book('other upload')
+                server.state.books[unknown_id]['purchased'] = False
+                local_books = {
+                        book['full_title']: book for book in books[1:]}
+                with mock.patch.object(
+                        CalibrolinoController, 'local_books',
+                        new_callable=mock.PropertyMock,
+                        return_value=local_books):
+                    view.start()
+                summary = json.loads(output.getvalue())
+                self.assertEqual(summary['deleted'], [books[0]['full_title']])
+                self.assertIn(purchased_id, server.state.books)
+                self.assertIn(unknown_id, server.state.books)
+                self.assertEqual(len(server.state.books), len(books) + 1)
+
+    def test_cancel(self):
+        progress = ProgressTracker()
+
+        def cancel_after_first_book(event):
+            if event.kind == BOOK_FINISHED:
+                progress.cancel()
+
+        progress.subscribe(cancel_after_first_book)
+        with StandinServer() as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    rate_limiter=RateLimiter(rate=None))
+            tolino_cloud.upload_books(self.books.values(), progress=progress)
+            self.assertEqual(len(server.state.books), 1)
+            self.assertTrue(progress.stats['cancelled'])
+            progress.clear_cancel()
+            self.assertFalse(progress.cancelled)
+
+    def test_stale_checkpoint(self):
+        ledger = SyncLedger(
+                path=os.path.join(self.folder, 'ledger.db'))
+        book = next(iter(self.books.values()))
+        ledger.reconcile(self.books, dict())
+        # the upload was interrupted after the collections, then the copy
+        # was deleted from the cloud
+        for step in ('upload', 'collection'):
+            ledger.save_step(book, step, 'deleted-book')
+        with StandinServer() as server:
+            tolino_cloud = server.create_tolino_cloud(
+                    retry_policy=RetryPolicy(max_retries=1, base_delay=0.001),
+                    rate_limiter=RateLimiter(rate=None))
+            with self.assertRaises(CalibrolinoException):
+                tolino_cloud.upload_books([book], checkpoint=ledger)
+            self.assertTrue(ledger.needs_reconcile())
+            ledger.reconcile(self.books, tolino_cloud.get_uploaded_books())
+            tolino_cloud.upload_books([book], checkpoint=ledger)
+            self.assertEqual(len(server.state.books), 1)
+        ledger.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
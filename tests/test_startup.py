@@ -0,0 +1,28 @@
+import sys
+import unittest
+import subprocess
+
+
+class TestStartup(unittest.TestCase):
+
+    """all test concerning the imports done by the text mode. """
+
+    def test_lazy_imports(self):
+        code = (
+            'import sys\n'
+            'import calibrolino.launcher, calibrolino.apps\n'
+            'import calibrolino.views, calibrolino.controllers\n'
+            "heavy = ('tkinter', 'pandastable', 'pandas', 'matplotlib')\n"
+            'print(*(name for name in heavy if name in sys.modules))\n'
+            )
+        result = subprocess.run(
+                [sys.executable, '-c', code],
+                capture_output=True,
+                text=True,
+                check=True,
+                )
+        self.assertEqual(result.stdout.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
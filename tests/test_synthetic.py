@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import unittest
+
+
+from calibrolino.synthetic import create_library
+from calibrolino.models import CalibreDBReader
+from tests.base import SyntheticLibraryTestCase
+
+
+class TestSyntheticLibrary(SyntheticLibraryTestCase):
+
+    """all test concerning the synthetic calibre libraries. """
+
+    n_books = 50
+    library_options = dict(n_tags=10, n_status_columns=2)
+
+    def test_create_library(self):
+        con = sqlite3.connect(self.db_path)
+        n_books, = con.execute('SELECT count(*) FROM books').fetchone()
+        n_columns, = con.execute(
+                'SELECT count(*) FROM custom_columns').fetchone()
+        con.close()
+        self.assertEqual(n_books, 50)
+        self.assertEqual(n_columns, 2)
+        with self.assertRaises(FileExistsError):
+            create_library(self.library_folder)
+
+    def test_same_seed(self):
+        other_folder = os.path.join(self.folder, 'other')
+        other_db_path = create_library(
+                other_folder, n_books=50, n_tags=10, n_status_columns=2)
+        sql = 'SELECT uuid, title, last_modified FROM books ORDER BY id'
+        rows = list()
+        for db_path in (self.db_path, other_db_path):
+            con = sqlite3.connect(db_path)
+            rows.append(con.execute(sql).fetchall())
+            con.close()
+        self.assertEqual(rows[0], rows[1])
+
+    def test_read(self):
+        books = CalibreDBReader(use_snapshot=False).books
+        self.assertEqual(len(books), 50)
+        for book in books.values():
+            self.assertTrue(os.path.exists(book['file_path']))
+            self.assertTrue(book['authors'])
+        self.assertTrue(any(book['status'] for book in books.values()))
+        self.assertTrue(any(book['serie_name'] for book in books.values()))
+
+    def test_names_order(self):
+        con = sqlite3.connect(self.db_path)
+        rows = con.execute("""
+        SELECT link.book, authors.name FROM books_authors_link AS link
+        JOIN authors ON authors.id = link.author ORDER BY link.id
+        """).fetchall()
+        con.close()
+        expected = dict()
+        for book_id, name in rows:
+            expected.setdefault(book_id, list()).append(name)
+        books = CalibreDBReader(use_snapshot=False).index
+        self.assertTrue(any(
+            names != sorted(names) for names in expected.values()))
+        for book_id, names in expected.items():
+            self.assertEqual(list(books.get(book_id)['authors']), names)
+            self.assertTrue(books.get(book_id)['file_path'].startswith(
+                os.path.join(self.library_folder, names[0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
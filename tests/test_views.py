@@ -0,0 +1,98 @@
+import io
+import json
+import argparse
+import unittest
+from unittest import mock
+
+
+from calibrolino.views import CalibrolinoBatchView, limit_changes
+from calibrolino.views import EXIT_OK, EXIT_FAILED, EXIT_NOT_CONFIGURED
+from calibrolino.ledger import BOOK_MISSING, BOOK_FILE_CHANGED
+from calibrolino.ledger import BOOK_METADATA_CHANGED, BOOK_UNCHANGED
+
+
+class TestCalibrolinoBatchView(unittest.TestCase):
+
+    """all test concerning the view of the headless commands. """
+
+    def setUp(self):
+        self.books = {
+                f'title {i}': dict(full_title=f'title {i}')
+                for i in range(5)}
+        books = list(self.books.values())
+        self.changes = {
+                BOOK_MISSING: books[:2],
+                BOOK_FILE_CHANGED: books[2:3],
+                BOOK_METADATA_CHANGED: books[3:4],
+                BOOK_UNCHANGED: books[4:],
+                }
+        self.controller = mock.Mock()
+        self.controller.local_books = self.books
+        self.controller.get_online_books.return_value = {
+                'title 0': 'pub-0', 'old title': 'pub-old'}
+        self.controller.get_uploaded_online_books.return_value = {
+                'title 0': 'pub-0', 'old title': 'pub-old'}
+        self.controller.get_sync_plan.return_value = self.changes
+        self.controller.run_sync.return_value = True
+
+    def run_command(self, command, **options):
+        output = io.StringIO()
+        view = CalibrolinoBatchView(
+                command, argparse.Namespace(**options), output)
+        view.controller = self.controller
+        exit_code = view.start()
+        summary = json.loads(output.getvalue())
+        self.assertEqual(summary['exit_code'], exit_code)
+        return exit_code, summary
+
+    def test_limit_changes(self):
+        changes = limit_changes(self.changes, 3)
+        self.assertEqual(len(changes[BOOK_MISSING]), 2)
+        self.assertEqual(len(changes[BOOK_FILE_CHANGED]), 1)
+        self.assertEqual(changes[BOOK_METADATA_CHANGED], list())
+        self.assertIs(limit_changes(self.changes), self.changes)
+
+    def test_sync(self):
+        exit_code, summary = self.run_command(
+                'sync', jobs=1, dry_run=True, limit=2, missing_only=False)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(summary['books']['missing'], ['title 0', 'title 1'])
+        self.controller.run_sync.assert_not_called()
+        exit_code, summary = self.run_command(
+                'sync', jobs=4, dry_run=False, limit=None, missing_only=False)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(summary['planned']['metadata_changed'], 1)
+        self.controller.run_sync.assert_called_once_with(
+                self.changes, max_workers=4)
+        self.controller.run_sync.side_effect = ValueError('upload failed')
+        exit_code, summary = self.run_command('sync')
+        self.assertEqual(exit_code, EXIT_FAILED)
+        self.assertEqual(summary['errors'], ['upload failed'])
+
+    def test_status(self):
+        exit_code, summary = self.run_command('status')
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(summary['local_books'], 5)
+        self.assertEqual(summary['missing_locally'], 1)
+
+    def test_delete(self):
+        exit_code, summary = self.run_command(
+                'delete', missing_locally=True, dry_run=False)
+        self.assertEqual(exit_code, EXIT_OK)
+        self.assertEqual(summary['deleted'], ['old title'])
+        self.controller.delete_book.assert_called_once_with('old title')
+        self.controller.local_books = dict()
+        exit_code, summary = self.run_command(
+                'delete', missing_locally=True, dry_run=False)
+        self.assertEqual(exit_code, EXIT_NOT_CONFIGURED)
+        self.assertEqual(self.controller.delete_book.call_count, 1)
+
+    def test_not_configured(self):
+        self.controller.credentials = None
+        exit_code, summary = self.run_command('status')
+        self.assertEqual(exit_code, EXIT_NOT_CONFIGURED)
+        self.controller.get_sync_plan.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+import unittest
+import threading
+
+
+from calibrolino.worker import BackgroundWorker
+
+
+class TestBackgroundWorker(unittest.TestCase):
+
+    """all test concerning BackgroundWorker. the main thread of the GUI is
+    played by the test, which calls process_queue"""
+
+    def setUp(self):
+        self.errors = list()
+        self.worker = BackgroundWorker(on_error=self.errors.append)
+
+    def wait_idle(self, timeout=5):
+        end = time.monotonic() + timeout
+        while self.worker.busy and time.monotonic() < end:
+            self.worker.process_queue()
+            time.sleep(0.01)
+        self.assertFalse(self.worker.busy)
+
+    def test_submit(self):
+        release = threading.Event()
+        results = list()
+        submitted = self.worker.submit(
+                'job', lambda: release.wait(5) and 42, results.append)
+        self.assertTrue(submitted)
+        self.assertTrue(self.worker.busy)
+        self.assertEqual(self.worker.job_name, 'job')
+        self.assertFalse(self.worker.submit('other', lambda: None))
+        release.set()
+        self.wait_idle()
+        self.assertEqual(results, [42])
+        self.assertIsNone(self.worker.job_name)
+
+    def test_error(self):
+        def fail():
+            raise ValueError('boom')
+
+        self.worker.submit('job', fail)
+        self.wait_idle()
+        self.assertEqual(len(self.errors), 1)
+        self.assertIsInstance(self.errors[0], ValueError)
+
+    def test_run_in_main_thread(self):
+        main_thread = threading.current_thread()
+        self.assertIs(
+                self.worker.run_in_main_thread(threading.current_thread),
+                main_thread)
+        results = list()
+        self.worker.submit(
+                'job',
+                lambda: self.worker.run_in_main_thread(
+                    threading.current_thread),
+                results.append)
+        self.wait_idle()
+        self.assertEqual(results, [main_thread])
+
+
+if __name__ == '__main__':
+    unittest.main()